@@ -0,0 +1,333 @@
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database import sharding
+from database.base import SessionLocal
+from repositories.repositories import OrderDetailRepository, ProductRepository, TableVersionRepository
+
+logger = logging.getLogger(__name__)
+
+# Pricing analytics (GET /api/v1/analytics/pricing/...) over columnar copies of the catalog
+# and the order lines. The columns are loaded on first use and kept per worker.
+
+# Version row bumped by ProductService writes, so every worker reloads the columns
+PRICING_VERSION = "analytics.pricing"
+# session.info key: product data written in the session's open transaction
+PRICING_WRITTEN = "pricing_written"
+# How often a worker checks that version for product writes made by other workers
+POLL_SECONDS = float(os.getenv("PRICING_POLL_SECONDS", "2"))
+# Columns are reloaded at least this often: stock moved by orders and new order lines do not bump the version
+MAX_AGE_SECONDS = float(os.getenv("PRICING_MAX_AGE_SECONDS", "300"))
+LOAD_BATCH_SIZE = 100000
+
+GROUP_COLUMNS = ("productLine", "productVendor")
+# Per product: MSRP - buyPrice, the same in percent of MSRP, quantityInStock * buyPrice
+PRODUCT_METRICS = ("margin", "margin_pct", "stock_value")
+# Per order line: priceEach / MSRP of the product
+LINE_METRICS = ("realized_ratio",)
+METRICS = PRODUCT_METRICS + LINE_METRICS
+DEFAULT_PERCENTILES = (5.0, 25.0, 50.0, 75.0, 95.0)
+
+
+class Grouped:
+    """
+    Finite values of a metric sorted by group, then value. Group g spans
+    values[starts[g]:starts[g] + counts[g]]; rows holds each value's source row.
+    """
+
+    def __init__(self, values: np.ndarray, rows: np.ndarray, groups: np.ndarray, labels: List[str]):
+        self.values = values
+        self.rows = rows
+        self.starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]]) if len(groups) else np.empty(0, dtype=np.int64)
+        self.counts = np.diff(np.r_[self.starts, len(values)])
+        self.labels = [labels[group] for group in groups[self.starts].tolist()]
+
+    def percentiles(self, percentiles: Sequence[float]) -> np.ndarray:
+        """
+        groups x percentiles, linear interpolation as np.percentile, for all groups at once
+        """
+        positions = self.starts[:, None] + (self.counts[:, None] - 1) * (np.asarray(percentiles) / 100)[None, :]
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.ceil(positions).astype(np.int64)
+        return self.values[lower] + (self.values[upper] - self.values[lower]) * (positions - lower)
+
+    def segment(self, label: str) -> Optional[np.ndarray]:
+        if label not in self.labels:
+            return None
+        group = self.labels.index(label)
+        return self.values[self.starts[group]:self.starts[group] + self.counts[group]]
+
+
+class PricingColumns:
+    """
+    Catalog and order-line columns as NumPy arrays at one version. Replaced as a whole,
+    never mutated; metric arrays and their group orderings are derived on first use and
+    kept with the columns.
+    """
+
+    def __init__(self, version: int, products: Dict[str, np.ndarray], labels: Dict[str, List[str]], lines: Dict[str, np.ndarray]):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.products = products
+        self.labels = labels
+        self.lines = lines
+        self._derived: Dict[Tuple, Any] = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def load(cls, db: Session, version: int) -> "PricingColumns":
+        started = time.perf_counter()
+        products = ProductRepository(db).stream_columns(
+            ["productCode", *GROUP_COLUMNS, "MSRP", "buyPrice", "quantityInStock"], LOAD_BATCH_SIZE
+        )
+        indexes: Dict[str, Dict[str, int]] = {name: {} for name in GROUP_COLUMNS}
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name in ("code", *GROUP_COLUMNS, "MSRP", "buyPrice", "quantityInStock")}
+        for batch in products:
+            parts["code"].append(np.array([row[0] for row in batch]))
+            for position, name in enumerate(GROUP_COLUMNS, start=1):
+                parts[name].append(_factorize([row[position] for row in batch], indexes[name]))
+            for position, name in enumerate(("MSRP", "buyPrice", "quantityInStock"), start=3):
+                parts[name].append(np.fromiter((row[position] for row in batch), dtype=np.float64, count=len(batch)))
+        columns = {name: np.concatenate(arrays) if arrays else np.empty(0) for name, arrays in parts.items()}
+        # Sorted codes, so order lines find their product with one searchsorted per batch
+        by_code = np.argsort(columns["code"], kind="stable")
+        sorted_codes = columns["code"][by_code]
+
+        line_parts: Dict[str, List[np.ndarray]] = {"orderNumber": [], "product": [], "priceEach": []}
+        for batch in OrderDetailRepository(db).stream_columns(["orderNumber", "productCode", "priceEach"], LOAD_BATCH_SIZE):
+            codes = np.array([row[1] for row in batch])
+            positions = np.minimum(np.searchsorted(sorted_codes, codes), max(len(sorted_codes) - 1, 0))
+            # Lines of products no longer in the catalog are left out
+            known = sorted_codes[positions] == codes if len(sorted_codes) else np.zeros(len(codes), dtype=bool)
+            line_parts["orderNumber"].append(np.fromiter((row[0] for row in batch), dtype=np.int64, count=len(batch))[known])
+            line_parts["product"].append(by_code[positions[known]])
+            line_parts["priceEach"].append(np.fromiter((row[2] for row in batch), dtype=np.float64, count=len(batch))[known])
+        lines = {name: np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64) for name, arrays in line_parts.items()}
+        labels = {name: list(indexes[name]) for name in GROUP_COLUMNS}
+        logger.info(f"Loaded pricing columns v{version}: {len(columns['code'])} products, {len(lines['product'])} order lines "
+                    f"in {time.perf_counter() - started:.1f}s")
+        return cls(version, columns, labels, lines)
+
+    def metric(self, name: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Finite values of a metric, their source rows (products or order lines) and the product of each
+        """
+        return self._derive(("metric", name), lambda: self._compute(name))
+
+    def grouped(self, metric: str, group_by: Optional[str]) -> Grouped:
+        def build():
+            values, rows, products = self.metric(metric)
+            if group_by is None:
+                groups, labels = np.zeros(len(values), dtype=np.int32), ["*"]
+            else:
+                groups, labels = self.products[group_by][products], self.labels[group_by]
+            order = np.lexsort((values, groups))
+            return Grouped(values[order], rows[order], groups[order], labels)
+        return self._derive(("grouped", metric, group_by), build)
+
+    def _compute(self, name: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        msrp, buy_price = self.products["MSRP"], self.products["buyPrice"]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if name == "margin":
+                values = msrp - buy_price
+            elif name == "margin_pct":
+                values = (msrp - buy_price) / msrp * 100
+            elif name == "stock_value":
+                values = self.products["quantityInStock"] * buy_price
+            else:
+                products = self.lines["product"]
+                values = self.lines["priceEach"] / msrp[products]
+                keep = np.isfinite(values)
+                return values[keep], np.flatnonzero(keep), products[keep]
+        rows = np.flatnonzero(np.isfinite(values))
+        return values[rows], rows, rows
+
+    def _derive(self, key: Tuple, build):
+        value = self._derived.get(key)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(key)
+                if value is None:
+                    value = self._derived[key] = build()
+        return value
+
+
+class PricingData:
+    """
+    The worker's PricingColumns: reloaded after a product write in this process, when
+    another worker's write moved the version (checked at most every POLL_SECONDS) and
+    at least every MAX_AGE_SECONDS. Only the first load blocks a request: later reloads
+    run in a background thread and requests keep the current columns until it is done.
+    """
+
+    def __init__(self, poll_seconds: float = POLL_SECONDS, max_age_seconds: float = MAX_AGE_SECONDS,
+                 session_factory: Callable[[], Session] = SessionLocal):
+        self.poll_seconds = poll_seconds
+        self.max_age_seconds = max_age_seconds
+        self.session_factory = session_factory
+        self._columns: Optional[PricingColumns] = None
+        self._checked = 0.0
+        self._stale = False
+        self._reloading = False
+        self._lock = threading.Lock()
+
+    def columns(self, db: Session) -> PricingColumns:
+        columns = self._columns
+        if columns is not None and (self._reloading or not self._must_check(columns)):
+            return columns
+        with self._lock:
+            columns = self._columns
+            if columns is not None and (self._reloading or not self._must_check(columns)):
+                return columns
+            version = TableVersionRepository(db).get_versions([PRICING_VERSION]).get(PRICING_VERSION, 0)
+            self._checked = time.monotonic()
+            if columns is None:
+                self._stale = False
+                self._columns = columns = PricingColumns.load(db, version)
+            elif self._stale or version != columns.version or time.monotonic() - columns.loaded_at >= self.max_age_seconds:
+                self._stale = False
+                self._reloading = True
+                threading.Thread(target=self._reload, args=(version,), name="pricing-reload", daemon=True).start()
+            return columns
+
+    def mark_written(self, db: Session):
+        """
+        Call before a product write commits: the commit bumps the shared version in the same
+        transaction, and this worker reloads on its next read
+        """
+        db.info[PRICING_WRITTEN] = True
+
+    def _reload(self, version: int):
+        db = self.session_factory()
+        try:
+            self._columns = PricingColumns.load(db, version)
+        except Exception as e:
+            logger.error(f"Pricing columns reload failed: {e}", exc_info=True)
+        finally:
+            sharding.close_sessions(db)
+            db.close()
+            self._reloading = False
+
+    def _must_check(self, columns: PricingColumns) -> bool:
+        now = time.monotonic()
+        return self._stale or now - self._checked >= self.poll_seconds or now - columns.loaded_at >= self.max_age_seconds
+
+
+def _factorize(values: Sequence[Any], index: Dict[str, int]) -> np.ndarray:
+    # Distinct values of the batch through np.unique, so Python only maps those to their numbers
+    labels, positions = np.unique(np.array([str(value) for value in values]), return_inverse=True)
+    numbers = np.array([index.setdefault(str(label), len(index)) for label in labels], dtype=np.int32)
+    return numbers[positions.ravel()]
+
+
+def describe(grouped: Grouped, percentiles: Sequence[float]) -> List[Dict[str, Any]]:
+    """
+    count, sum, mean, min, max and percentiles of every group, computed for all groups at once
+    """
+    if not len(grouped.values):
+        return []
+    sums = np.add.reduceat(grouped.values, grouped.starts)
+    points = grouped.percentiles(percentiles)
+    minimums = grouped.values[grouped.starts]
+    maximums = grouped.values[grouped.starts + grouped.counts - 1]
+    return [
+        {
+            "group": label,
+            "count": int(count),
+            "sum": round(float(total), 2),
+            "mean": round(float(total / count), 4),
+            "min": round(float(minimum), 4),
+            "max": round(float(maximum), 4),
+            "percentiles": {_percentile_name(q): round(float(point), 4) for q, point in zip(percentiles, row)},
+        }
+        for label, count, total, minimum, maximum, row in zip(
+            grouped.labels, grouped.counts.tolist(), sums.tolist(), minimums.tolist(), maximums.tolist(), points.tolist()
+        )
+    ]
+
+
+def histogram(values: np.ndarray, bins: int, value_range: Optional[Tuple[float, float]]) -> Dict[str, List]:
+    """
+    np.histogram of sorted values: the bin counts are the distances between the edges' positions
+    """
+    if not len(values):
+        return {"edges": [], "counts": []}
+    edges = np.histogram_bin_edges(values[[0, -1]], bins=bins, range=value_range)
+    positions = np.searchsorted(values, edges, side="left")
+    # The last bin includes its right edge
+    positions[-1] = np.searchsorted(values, edges[-1], side="right")
+    return {"edges": [round(edge, 4) for edge in edges.tolist()], "counts": np.diff(positions).tolist()}
+
+
+def outliers(grouped: Grouped, k: float, limit: int) -> Tuple[int, List[Tuple[int, str, float, float, float]]]:
+    """
+    Values outside [Q1 - k*IQR, Q3 + k*IQR] of their group (Tukey's fences), furthest
+    first (in IQRs): the total and up to `limit` (row, group, value, lower, upper)
+    """
+    if not len(grouped.values):
+        return 0, []
+    quartiles = grouped.percentiles((25.0, 75.0))
+    spread = quartiles[:, 1] - quartiles[:, 0]
+    lower, upper = quartiles[:, 0] - k * spread, quartiles[:, 1] + k * spread
+    # Each group is sorted, so its outliers are a prefix and a suffix of its segment
+    found, group_of = [], []
+    for group, (start, count) in enumerate(zip(grouped.starts.tolist(), grouped.counts.tolist())):
+        segment = grouped.values[start:start + count]
+        below = int(np.searchsorted(segment, lower[group], side="left"))
+        above = int(np.searchsorted(segment, upper[group], side="right"))
+        if below or above < count:
+            found.append(np.r_[start:start + below, start + above:start + count])
+            group_of.append(np.full(below + count - above, group))
+    if not found:
+        return 0, []
+    found, group_of = np.concatenate(found), np.concatenate(group_of)
+    values = grouped.values[found]
+    distance = np.maximum(lower[group_of] - values, values - upper[group_of])
+    # Groups without spread (IQR 0): every difference counts as far
+    scale = spread[group_of]
+    with np.errstate(divide="ignore"):
+        score = np.where(scale > 0, distance / scale, np.inf)
+    top = np.lexsort((-distance, -score))[:limit]
+    return len(found), [
+        (row, grouped.labels[group], value, low, high)
+        for row, group, value, low, high in zip(
+            grouped.rows[found[top]].tolist(), group_of[top].tolist(), values[top].tolist(),
+            lower[group_of[top]].tolist(), upper[group_of[top]].tolist()
+        )
+    ]
+
+
+def _percentile_name(q: float) -> str:
+    return f"p{q:g}"
+
+
+data = PricingData()
+
+
+def prepare(db: Session):
+    # The version row up front, so concurrent first writes only UPDATE it
+    TableVersionRepository(db).ensure([PRICING_VERSION])
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_version(session: Session):
+    if session.info.get(PRICING_WRITTEN):
+        TableVersionRepository(session).bump_many([PRICING_VERSION])
+
+
+@event.listens_for(Session, "after_commit")
+def _reload_written(session: Session):
+    if session.info.pop(PRICING_WRITTEN, None):
+        data._stale = True
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_written(session: Session):
+    session.info.pop(PRICING_WRITTEN, None)
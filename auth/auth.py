@@ -5,7 +5,10 @@ from passlib.context import CryptContext
 from datetime import datetime, timedelta
 from typing import Optional
 from pydantic import BaseModel
+from cache import shared_cache
+import hashlib
 import os
+import time
 from dotenv import load_dotenv
 
 # Konfigurasi autentikasi
@@ -27,6 +30,7 @@ fake_users_db = {
         "username": "admin",
         "hashed_password": admin_pass,  # password: admin
         "disabled": False,
+        "is_admin": True,
     },
     "user1": {
         "username": "user1",
@@ -47,6 +51,7 @@ class TokenData(BaseModel):
 class User(BaseModel):
     username: str
     disabled: Optional[bool] = None
+    is_admin: bool = False
 
 class UserInDB(User):
     hashed_password: str
@@ -80,21 +85,51 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def get_username_from_token(token: str) -> Optional[str]:
+    """
+    Username (sub) of a valid token, or None when the token is invalid or expired
+    """
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    return payload.get("sub")
+
+def get_principal(token: str) -> Optional[User]:
+    """
+    User of a valid token, or None. With SHARED_CACHE the verified user is shared by the
+    host's workers until the token expires (at most SHARED_CACHE_PRINCIPAL_SECONDS);
+    the cache is keyed by the token's hash, never the token itself
+    """
+    cache = shared_cache.cache
+    if cache is not None:
+        key = hashlib.sha256(token.encode()).hexdigest()
+        principal = cache.get(shared_cache.PRINCIPALS, key)
+        if principal is not None:
+            return User(**principal)
+        generation = cache.generation(shared_cache.PRINCIPALS)
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    username = payload.get("sub")
+    user = get_user(fake_users_db, username) if username is not None else None
+    if user is None:
+        return None
+    principal = User(username=user.username, disabled=user.disabled, is_admin=user.is_admin)
+    if cache is not None:
+        ttl_seconds = min(shared_cache.SHARED_CACHE_PRINCIPAL_SECONDS, payload.get("exp", 0) - time.time())
+        if ttl_seconds > 0:
+            cache.put(shared_cache.PRINCIPALS, key, principal.dict(), generation, ttl_seconds)
+    return principal
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = get_user(fake_users_db, username=token_data.username)
+    user = get_principal(token)
     if user is None:
         raise credentials_exception
     return user
@@ -102,4 +137,9 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
     if current_user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
-    return current_user
\ No newline at end of file
+    return current_user
+
+async def get_current_admin_user(current_user: User = Depends(get_current_active_user)):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin only")
+    return current_user
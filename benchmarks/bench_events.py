@@ -0,0 +1,145 @@
+"""
+Fan-out throughput of the order event hub to thousands of subscribers, in process.
+A thread publishes order events (as the sync endpoints do) at --rate events/sec while
+every subscriber drains its server-sent event stream; a third of the subscribers filter
+by customer, a third by status. --slow subscribers never read and must be dropped as
+slow consumers without affecting the others.
+
+    python -m benchmarks.bench_events --subscribers 5000 --events 1000 --rate 100 --slow 50
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from benchmarks.load_test import RESULTS_DIR, percentile
+from events.events import EventHub, Subscription, stream
+
+STATUSES = ["In Process", "On Hold", "Shipped", "Resolved"]
+
+
+def _publish(hub: EventHub, args: argparse.Namespace, stop: threading.Event):
+    rng = random.Random(args.seed)
+    interval = 1 / args.rate if args.rate else 0
+    started = time.perf_counter()
+    for number in range(args.events):
+        if stop.is_set():
+            return
+        if interval:
+            delay = started + number * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        previous, status = rng.sample(STATUSES, 2)
+        hub.publish("order.updated", {
+            "orderNumber": 100000 + number,
+            "customerNumber": rng.randrange(args.customers),
+            "status": status,
+            "shippedDate": None,
+            "publishedAt": time.perf_counter(),
+        }, previous)
+
+
+async def _consume(subscription: Subscription, hub: EventHub, counts: Dict[str, int], latencies: Optional[List[float]]):
+    async for chunk in stream(subscription, hub):
+        if latencies is not None:
+            now = time.perf_counter()
+            for line in chunk.split("\n"):
+                if line.startswith("data: ") and "publishedAt" in line:
+                    latencies.append(now - json.loads(line[6:])["publishedAt"])
+        counts["events"] += chunk.count("event: order.")
+        counts["overflows"] += chunk.count("event: overflow")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    hub = EventHub(max_queue=args.queue_size, max_subscribers=args.subscribers + args.slow)
+    counts = {"events": 0, "overflows": 0}
+    latencies: List[float] = []
+
+    fast: List[Subscription] = []
+    for index in range(args.subscribers):
+        kind = index % 3
+        if kind == 0:
+            fast.append(hub.subscribe())
+        elif kind == 1:
+            fast.append(hub.subscribe(customer_number=rng.randrange(args.customers)))
+        else:
+            fast.append(hub.subscribe(statuses=[rng.choice(STATUSES)]))
+    slow = [hub.subscribe() for _ in range(args.slow)]
+
+    # One subscriber in a hundred also decodes its events to measure publish-to-stream latency
+    consumers = [
+        asyncio.create_task(_consume(subscription, hub, counts, latencies if index % 100 == 0 else None))
+        for index, subscription in enumerate(fast)
+    ]
+    await asyncio.sleep(0)
+
+    stop = threading.Event()
+    started = time.perf_counter()
+    publisher = asyncio.create_task(asyncio.to_thread(_publish, hub, args, stop))
+    try:
+        await publisher
+        # Let the loop run the last dispatches and the consumers drain their queues
+        while any(subscription.queue.qsize() for subscription in fast if not subscription.overflowed):
+            await asyncio.sleep(0.001)
+        await asyncio.sleep(0.01)
+    finally:
+        stop.set()
+    elapsed = time.perf_counter() - started
+
+    for task in consumers:
+        task.cancel()
+    await asyncio.gather(*consumers, return_exceptions=True)
+
+    latencies.sort()
+    return {
+        "subscribers": args.subscribers,
+        "slow_subscribers": args.slow,
+        "events_published": args.events,
+        "deliveries": counts["events"],
+        "elapsed_s": round(elapsed, 3),
+        "publish_rate": round(args.events / elapsed, 1),
+        "deliveries_per_sec": round(counts["events"] / elapsed, 1),
+        "slow_dropped": sum(1 for subscription in slow if subscription.overflowed),
+        "fast_dropped": sum(1 for subscription in fast if subscription.overflowed),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "latency_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "latency_max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark order event fan-out to many subscribers")
+    parser.add_argument("--subscribers", type=int, default=5000)
+    parser.add_argument("--slow", type=int, default=50, help="subscribers that never read")
+    parser.add_argument("--events", type=int, default=1000, help="more than --queue-size, so slow subscribers overflow")
+    parser.add_argument("--rate", type=float, default=100, help="events per second, 0 = as fast as possible")
+    parser.add_argument("--customers", type=int, default=100)
+    parser.add_argument("--queue-size", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "bench_events.json"))
+    args = parser.parse_args(argv)
+
+    # One warning per dropped subscriber would drown the report
+    logging.getLogger("events.events").setLevel(logging.ERROR)
+    result = asyncio.run(run(args))
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    for name, value in result.items():
+        print(f"{name:20} {value}")
+    if args.slow and result["slow_dropped"] != args.slow:
+        print("\nNot every slow subscriber was dropped")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
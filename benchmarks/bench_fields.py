@@ -0,0 +1,101 @@
+"""
+Payload size and query time of product list reads on a large catalog: every column
+(?fields=*), the default list view (heavy text columns deferred) and a narrow
+?fields= selection.
+
+    python -m benchmarks.bench_fields --products 20000 --limit 1000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.load_test import API, RESULTS_DIR, percentile
+
+VARIANTS = {
+    "all columns (fields=*)": "*",
+    "default list view": None,
+    "fields=productCode,productName,MSRP": "productCode,productName,MSRP",
+}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark sparse fieldsets on GET /products/")
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--limit", type=int, default=1000, help="rows per request")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "bench_fields.json"))
+    args = parser.parse_args(argv)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    db_path = os.path.join(RESULTS_DIR, "bench_fields.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "SECRET_KEY": os.environ.get("SECRET_KEY") or "benchmark-secret",
+        "ALGORITHM": os.environ.get("ALGORITHM") or "HS256",
+        "ACCESS_TOKEN_EXPIRE_MINUTES": os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES") or "60",
+        "QUERY_STATS": "true",
+        "QUERY_STATS_HEADERS": "true",
+        "RATE_LIMITING": "false",
+        "REFERENCE_SNAPSHOT": "false",
+    })
+
+    from sqlalchemy import create_engine
+    from scripts.generate_data import GeneratorConfig, generate
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    generate(engine, GeneratorConfig.for_scale(1, products=args.products, seed=args.seed), verbose=False)
+    engine.dispose()
+
+    from fastapi.testclient import TestClient
+    import main as app_module
+
+    client = TestClient(app_module.app)
+    token = client.post(f"{API}/auth/token", data={"username": "admin", "password": "admin"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    results: Dict[str, Dict] = {}
+    for name, fields in VARIANTS.items():
+        params = {"limit": args.limit}
+        if fields:
+            params["fields"] = fields
+        latencies, db_times, sizes = [], [], []
+        for _ in range(args.iterations):
+            t0 = time.perf_counter()
+            response = client.get(f"{API}/products/", params=params, headers=headers)
+            latencies.append(time.perf_counter() - t0)
+            response.raise_for_status()
+            sizes.append(len(response.content))
+            db_times.append(float(response.headers["X-DB-Time"]))
+        latencies.sort()
+        db_times.sort()
+        results[name] = {
+            "payload_bytes": sizes[-1],
+            "db_time_p50_ms": round(percentile(db_times, 50) * 1000, 3),
+            "latency_p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "latency_p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        }
+
+    baseline = results["all columns (fields=*)"]
+    for stats in results.values():
+        stats["payload_vs_all"] = round(stats["payload_bytes"] / baseline["payload_bytes"], 3)
+        stats["db_time_vs_all"] = round(stats["db_time_p50_ms"] / max(baseline["db_time_p50_ms"], 1e-9), 3)
+
+    report = {"products": args.products, "limit": args.limit, "iterations": args.iterations, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'variant':38} {'bytes':>9} {'vs all':>7} {'db p50 ms':>10} {'vs all':>7} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, stats in results.items():
+        print(f"{name:38} {stats['payload_bytes']:>9} {stats['payload_vs_all']:>7.2f} {stats['db_time_p50_ms']:>10.2f} "
+              f"{stats['db_time_vs_all']:>7.2f} {stats['latency_p50_ms']:>8.2f} {stats['latency_p95_ms']:>8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
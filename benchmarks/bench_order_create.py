@@ -0,0 +1,149 @@
+"""
+Orders/sec for creating an order with N lines: the multi-call flow
+(POST /orders/ + one POST /orderdetails/ per line) against POST /orders/full.
+
+    python -m benchmarks.bench_order_create --lines 20 --duration 15 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.load_test import API, RESULTS_DIR, free_port, get_token, percentile, start_server, wait_until_ready
+
+
+def _order_body(rng: random.Random, customers: List[int]) -> Dict[str, Any]:
+    return {
+        "orderDate": "2025-06-01",
+        "requiredDate": "2025-06-10",
+        "status": "In Process",
+        "customerNumber": rng.choice(customers),
+    }
+
+
+async def multi_call(client: httpx.AsyncClient, rng: random.Random, pools: Dict[str, List], lines: int) -> bool:
+    response = await client.post(f"{API}/orders/", json=_order_body(rng, pools["customers"]))
+    if response.status_code >= 400:
+        return False
+    order_number = response.json()["orderNumber"]
+    for line_number, code in enumerate(rng.sample(pools["products"], lines), start=1):
+        response = await client.post(f"{API}/orderdetails/", json={
+            "orderNumber": order_number,
+            "productCode": code,
+            "quantityOrdered": rng.randint(1, 50),
+            "priceEach": round(rng.uniform(20, 200), 2),
+            "orderLineNumber": line_number,
+        })
+        if response.status_code >= 400:
+            return False
+    return True
+
+
+async def full(client: httpx.AsyncClient, rng: random.Random, pools: Dict[str, List], lines: int) -> bool:
+    body = _order_body(rng, pools["customers"])
+    body["lines"] = [
+        {"productCode": code, "quantityOrdered": rng.randint(1, 50), "priceEach": round(rng.uniform(20, 200), 2)}
+        for code in rng.sample(pools["products"], lines)
+    ]
+    response = await client.post(f"{API}/orders/full", json=body)
+    return response.status_code < 400
+
+
+FLOWS = {"multi-call": multi_call, "full": full}
+
+
+async def run_flow(base_url: str, token: str, flow: str, pools: Dict[str, List], lines: int,
+                   concurrency: int, duration: float, seed: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    errors = 0
+    create = FLOWS[flow]
+
+    async with httpx.AsyncClient(base_url=base_url, headers={"Authorization": f"Bearer {token}"}, timeout=60.0) as client:
+        stop_at = time.perf_counter() + duration
+
+        async def worker(worker_id: int):
+            nonlocal errors
+            rng = random.Random(seed * 1000 + worker_id)
+            while time.perf_counter() < stop_at:
+                t0 = time.perf_counter()
+                ok = await create(client, rng, pools, lines)
+                if ok:
+                    latencies.append(time.perf_counter() - t0)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+
+    latencies.sort()
+    return {
+        "orders": len(latencies),
+        "errors": errors,
+        "orders_per_sec": round(len(latencies) / duration, 2),
+        "http_requests_per_order": 1 + lines if flow == "multi-call" else 1,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark order creation: multi-call flow vs POST /orders/full")
+    parser.add_argument("--lines", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per flow")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--synthetic", type=float, default=1.0, help="generator scale used to seed the database")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", default=os.path.join(RESULTS_DIR, "bench_order_create.db"))
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "bench_order_create.json"))
+    args = parser.parse_args(argv)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    from sqlalchemy import create_engine
+    from scripts.generate_data import GeneratorConfig, generate
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    engine = create_engine(f"sqlite:///{args.db}")
+    keys = generate(engine, GeneratorConfig.for_scale(args.synthetic, seed=args.seed), verbose=False)
+    engine.dispose()
+    pools = {"customers": keys.customers, "products": keys.products}
+    if len(pools["products"]) < args.lines:
+        parser.error(f"only {len(pools['products'])} products, raise --synthetic")
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_server(args.db, port, 1, os.path.join(RESULTS_DIR, "server.log"), {})
+    results = {}
+    try:
+        wait_until_ready(base_url, server)
+        token = get_token(base_url, "admin", "admin")
+        for flow in FLOWS:
+            results[flow] = asyncio.run(run_flow(
+                base_url, token, flow, pools, args.lines, args.concurrency, args.duration, args.seed
+            ))
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    speedup = results["full"]["orders_per_sec"] / max(results["multi-call"]["orders_per_sec"], 1e-9)
+    report = {"lines_per_order": args.lines, "concurrency": args.concurrency, "flows": results, "speedup": round(speedup, 2)}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'flow':12} {'orders':>7} {'err':>5} {'orders/s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for flow, stats in results.items():
+        print(f"{flow:12} {stats['orders']:>7} {stats['errors']:>5} {stats['orders_per_sec']:>9.1f} "
+              f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f}")
+    print(f"\n/orders/full is {speedup:.1f}x faster with {args.lines} lines per order")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""
+Edits/sec for changing the lines of large orders: the per-line flow (the client diffs
+and sends one PUT/DELETE/POST /orderdetails/ per changed line) against one
+PUT /orderdetails/order/{orderNumber} with the whole line set. Every edit changes the
+quantity of --changed of the lines, drops --removed and adds as many new products.
+
+    python -m benchmarks.bench_order_lines --lines 100 --duration 15 --concurrency 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.load_test import API, RESULTS_DIR, free_port, get_token, percentile, start_server, wait_until_ready
+
+# productCode -> (quantityOrdered, priceEach, orderLineNumber)
+Lines = Dict[str, Tuple[int, float, int]]
+
+
+def _edit(rng: random.Random, lines: Lines, products: List[str], changed: float, removed: float) -> Lines:
+    codes = list(lines)
+    dropped = set(rng.sample(codes, int(len(codes) * removed)))
+    kept = [code for code in codes if code not in dropped]
+    bumped = set(rng.sample(kept, int(len(codes) * changed)))
+    edited = {code: ((lines[code][0] % 3) + 1 if code in bumped else lines[code][0], *lines[code][1:]) for code in kept}
+    line_number = max(line[2] for line in lines.values())
+    candidates = [code for code in products if code not in lines]
+    for line_number, code in enumerate(rng.sample(candidates, len(dropped)), start=line_number + 1):
+        edited[code] = (rng.randint(1, 3), round(rng.uniform(20, 200), 2), line_number)
+    return edited
+
+
+async def _create(client: httpx.AsyncClient, rng: random.Random, pools: Dict[str, List], lines: int) -> Tuple[int, Lines]:
+    codes = rng.sample(pools["products"], lines)
+    body = {
+        "orderDate": "2025-06-01",
+        "requiredDate": "2025-06-10",
+        "status": "In Process",
+        "customerNumber": rng.choice(pools["customers"]),
+        "lines": [{"productCode": code, "quantityOrdered": rng.randint(1, 3), "priceEach": round(rng.uniform(20, 200), 2)}
+                  for code in codes],
+    }
+    response = await client.post(f"{API}/orders/full", json=body)
+    response.raise_for_status()
+    order = response.json()
+    return order["orderNumber"], {
+        line["productCode"]: (line["quantityOrdered"], line["priceEach"], line["orderLineNumber"]) for line in order["orderDetails"]
+    }
+
+
+async def per_line(client: httpx.AsyncClient, order: Dict[str, Any], edited: Lines) -> bool:
+    number, lines = order["orderNumber"], order["lines"]
+    for code in lines:
+        if code not in edited:
+            response = await client.delete(f"{API}/orderdetails/{number}/{code}")
+            if response.status_code >= 400:
+                return False
+    for code, (quantity, price, line_number) in edited.items():
+        if code not in lines:
+            response = await client.post(f"{API}/orderdetails/", json={
+                "orderNumber": number, "productCode": code, "quantityOrdered": quantity,
+                "priceEach": price, "orderLineNumber": line_number,
+            })
+        elif lines[code] != (quantity, price, line_number):
+            response = await client.put(f"{API}/orderdetails/{number}/{code}", json={
+                "quantityOrdered": quantity, "orderLineNumber": line_number,
+            })
+        else:
+            continue
+        if response.status_code >= 400:
+            return False
+    return True
+
+
+async def replace(client: httpx.AsyncClient, order: Dict[str, Any], edited: Lines) -> bool:
+    response = await client.put(f"{API}/orderdetails/order/{order['orderNumber']}", json={
+        "version": order["version"],
+        "lines": [{"productCode": code, "quantityOrdered": quantity, "priceEach": price, "orderLineNumber": line_number}
+                  for code, (quantity, price, line_number) in edited.items()],
+    })
+    if response.status_code >= 400:
+        return False
+    order["version"] = response.json()["version"]
+    return True
+
+
+FLOWS = {"per-line": per_line, "replace": replace}
+
+
+async def run_flow(base_url: str, token: str, flow: str, pools: Dict[str, List], args: argparse.Namespace) -> Dict[str, Any]:
+    latencies: List[float] = []
+    requests = 0
+    errors = 0
+    apply = FLOWS[flow]
+
+    async with httpx.AsyncClient(base_url=base_url, headers={"Authorization": f"Bearer {token}"}, timeout=60.0) as client:
+        stop_at = time.perf_counter() + args.duration
+
+        async def worker(worker_id: int):
+            nonlocal requests, errors
+            rng = random.Random(args.seed * 1000 + worker_id)
+            number, lines = await _create(client, rng, pools, args.lines)
+            order = {"orderNumber": number, "lines": lines, "version": 1}
+            while time.perf_counter() < stop_at:
+                edited = _edit(rng, order["lines"], pools["products"], args.changed, args.removed)
+                requests += 1 if flow == "replace" else sum(1 for code in order["lines"] if code not in edited) + sum(
+                    1 for code, line in edited.items() if order["lines"].get(code) != line)
+                t0 = time.perf_counter()
+                if await apply(client, order, edited):
+                    latencies.append(time.perf_counter() - t0)
+                    order["lines"] = edited
+                else:
+                    errors += 1
+                    # Start over from a fresh order; the failed edit may have been half applied
+                    number, lines = await _create(client, rng, pools, args.lines)
+                    order = {"orderNumber": number, "lines": lines, "version": 1}
+
+        await asyncio.gather(*(worker(i) for i in range(args.concurrency)))
+
+    latencies.sort()
+    edits = len(latencies)
+    return {
+        "edits": edits,
+        "errors": errors,
+        "edits_per_sec": round(edits / args.duration, 2),
+        "http_requests_per_edit": round(requests / max(edits + errors, 1), 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark order line edits: per-line calls vs PUT /orderdetails/order/{n}")
+    parser.add_argument("--lines", type=int, default=100)
+    parser.add_argument("--changed", type=float, default=0.2, help="share of the lines whose quantity changes per edit")
+    parser.add_argument("--removed", type=float, default=0.1, help="share of the lines replaced by new products per edit")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per flow")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--synthetic", type=float, default=4.0, help="generator scale used to seed the database")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", default=os.path.join(RESULTS_DIR, "bench_order_lines.db"))
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "bench_order_lines.json"))
+    args = parser.parse_args(argv)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    from sqlalchemy import create_engine
+    from scripts.generate_data import GeneratorConfig, generate
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    engine = create_engine(f"sqlite:///{args.db}")
+    keys = generate(engine, GeneratorConfig.for_scale(args.synthetic, seed=args.seed), verbose=False)
+    engine.dispose()
+    # Products with enough stock that no edit fails on it
+    with sqlite3.connect(args.db) as con:
+        stocked = {code for code, in con.execute("SELECT productCode FROM products WHERE quantityInStock >= 1000")}
+    pools = {"customers": keys.customers, "products": [code for code in keys.products if code in stocked]}
+    if len(pools["products"]) < args.lines * (1 + args.removed) + 1:
+        parser.error(f"only {len(pools['products'])} products with stock, raise --synthetic")
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_server(args.db, port, 1, os.path.join(RESULTS_DIR, "server.log"), {})
+    results = {}
+    try:
+        wait_until_ready(base_url, server)
+        token = get_token(base_url, "admin", "admin")
+        for flow in FLOWS:
+            results[flow] = asyncio.run(run_flow(base_url, token, flow, pools, args))
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    speedup = results["replace"]["edits_per_sec"] / max(results["per-line"]["edits_per_sec"], 1e-9)
+    report = {
+        "lines_per_order": args.lines, "changed": args.changed, "removed": args.removed,
+        "concurrency": args.concurrency, "flows": results, "speedup": round(speedup, 2),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'flow':10} {'edits':>7} {'err':>5} {'req/edit':>9} {'edits/s':>9} {'p50 ms':>9} {'p95 ms':>9}")
+    for flow, stats in results.items():
+        print(f"{flow:10} {stats['edits']:>7} {stats['errors']:>5} {stats['http_requests_per_edit']:>9.1f} "
+              f"{stats['edits_per_sec']:>9.1f} {stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f}")
+    print(f"\nOne PUT of the line set is {speedup:.1f}x faster with {args.lines} lines per order")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
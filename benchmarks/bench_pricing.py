@@ -0,0 +1,149 @@
+"""
+Latency of the /analytics/pricing endpoints on a large synthetic catalog: loading the
+columns, the first request of each kind (sorts the metric into its groups) and repeated
+requests, against the old way of pulling every product through the ORM and computing
+the percentiles in Python.
+
+    python -m benchmarks.bench_pricing --products 1000000 --lines 2000000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.load_test import RESULTS_DIR, percentile
+
+
+def _write_catalog(db_path: str, products: int, lines: int, vendors: int, seed: int, batch_size: int = 200000):
+    rng = np.random.default_rng(seed)
+    product_lines = ["Classic Cars", "Motorcycles", "Planes", "Ships", "Trains", "Trucks and Buses", "Vintage Cars"]
+    con = sqlite3.connect(db_path)
+    con.execute("PRAGMA journal_mode=OFF")
+    con.execute("PRAGMA synchronous=OFF")
+    con.executemany("INSERT INTO productlines (productLine, textDescription) VALUES (?, '')", [(name,) for name in product_lines])
+    codes = np.array([f"S{index // 100000 + 10}_{index % 100000:05d}" for index in range(products)])
+    msrp = np.round(rng.lognormal(4.3, 0.5, size=products), 2)
+    for start in range(0, products, batch_size):
+        end = min(start + batch_size, products)
+        size = end - start
+        buy_price = np.round(msrp[start:end] * rng.uniform(0.35, 0.75, size=size), 2)
+        rows = zip(
+            codes[start:end].tolist(),
+            [product_lines[index] for index in rng.integers(0, len(product_lines), size=size)],
+            [f"Vendor {index:03d}" for index in rng.integers(0, vendors, size=size)],
+            rng.integers(0, 10000, size=size).tolist(), buy_price.tolist(), msrp[start:end].tolist(),
+        )
+        con.executemany(
+            "INSERT INTO products (productCode, productName, productLine, productScale, productVendor, productDescription, "
+            "quantityInStock, buyPrice, MSRP) VALUES (?, 'Model', ?, '1:18', ?, '', ?, ?, ?)", rows,
+        )
+    for start in range(0, lines, batch_size):
+        size = min(batch_size, lines - start)
+        chosen = rng.integers(0, products, size=size)
+        # One line per order keeps the (orderNumber, productCode) key unique
+        rows = zip(range(10100 + start, 10100 + start + size), codes[chosen].tolist(), rng.integers(1, 100, size=size).tolist(),
+                   np.round(msrp[chosen] * rng.normal(0.9, 0.05, size=size), 2).tolist())
+        con.executemany("INSERT INTO orderdetails VALUES (?, ?, ?, ?, 1)", rows)
+    con.commit()
+    con.close()
+
+
+def _timed(call, iterations: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {"p50_ms": round(percentile(timings, 50) * 1000, 3), "p95_ms": round(percentile(timings, 95) * 1000, 3)}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the pricing analytics endpoints")
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--lines", type=int, default=2_000_000, help="order lines")
+    parser.add_argument("--vendors", type=int, default=200)
+    parser.add_argument("--iterations", type=int, default=20, help="repeated requests per endpoint")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "bench_pricing.json"))
+    args = parser.parse_args(argv)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    db_path = os.path.join(RESULTS_DIR, "bench_pricing.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import sessionmaker
+    from analytics.pricing import PricingData
+    from analytics import pricing
+    from database.base import Base
+    from models.models import Product
+    from services.service import PricingAnalyticsService
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(engine, tables=[Base.metadata.tables[name] for name in ("productlines", "products", "orderdetails", "table_versions")])
+    started = time.perf_counter()
+    _write_catalog(db_path, args.products, args.lines, args.vendors, args.seed)
+    print(f"Wrote {args.products:,} products and {args.lines:,} order lines in {time.perf_counter() - started:.0f}s")
+    db = sessionmaker(bind=engine)()
+
+    # The old way: every product through the ORM, percentiles of the margin per line in Python
+    started = time.perf_counter()
+    by_line: Dict[str, List[float]] = {}
+    for product in db.execute(select(Product)).scalars():
+        by_line.setdefault(product.productLine, []).append(product.MSRP - product.buyPrice)
+    {name: np.percentile(values, [5, 25, 50, 75, 95]) for name, values in by_line.items()}
+    orm_seconds = time.perf_counter() - started
+    db.expunge_all()
+
+    pricing.data = PricingData()
+    started = time.perf_counter()
+    pricing.data.columns(db)
+    load_seconds = time.perf_counter() - started
+    service = PricingAnalyticsService(db)
+
+    requests = {
+        "distribution margin by line": lambda: service.get_distribution("margin", "productLine"),
+        "distribution margin_pct by vendor": lambda: service.get_distribution("margin_pct", "productVendor", "1,10,50,90,99"),
+        "distribution stock_value": lambda: service.get_distribution("stock_value"),
+        "distribution realized_ratio by line": lambda: service.get_distribution("realized_ratio", "productLine"),
+        "histogram margin, 50 bins": lambda: service.get_histogram("margin", bins=50),
+        "histogram margin of one line": lambda: service.get_histogram("margin", "productLine", "Classic Cars", bins=50),
+        "outliers stock_value by vendor": lambda: service.get_outliers("stock_value", "productVendor", limit=100),
+        "outliers realized_ratio by line": lambda: service.get_outliers("realized_ratio", "productLine", limit=100),
+    }
+    results: Dict[str, Dict[str, Any]] = {}
+    for name, call in requests.items():
+        started = time.perf_counter()
+        call()
+        first_ms = round((time.perf_counter() - started) * 1000, 3)
+        results[name] = {"first_ms": first_ms, **_timed(call, args.iterations)}
+    db.close()
+
+    report = {
+        "products": args.products,
+        "lines": args.lines,
+        "orm_seconds": round(orm_seconds, 2),
+        "load_seconds": round(load_seconds, 2),
+        "requests": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{args.products:,} products, {args.lines:,} order lines\n")
+    print(f"{'old: all products through the ORM':38} {orm_seconds * 1000:>10.0f} ms")
+    print(f"{'load pricing columns':38} {load_seconds * 1000:>10.0f} ms\n")
+    print(f"{'request':38} {'first ms':>10} {'p50 ms':>9} {'p95 ms':>9}")
+    for name, stats in results.items():
+        print(f"{name:38} {stats['first_ms']:>10.2f} {stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""
+Build time and memory of the co-purchase matrix behind /products/{code}/recommendations
+for millions of order lines, and the per-request cost of a recommendation served from
+the matrix against counting the co-purchases in SQL. The lines are synthetic: baskets
+of products drawn with a skewed popularity, written straight into an orderdetails table.
+
+    python -m benchmarks.bench_recommendations --lines 10000000 --products 2000
+"""
+import argparse
+import json
+import os
+import resource
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.load_test import RESULTS_DIR, percentile
+
+
+def _write_lines(db_path: str, lines: int, products: int, basket: float, seed: int, batch_size: int = 500000) -> int:
+    """
+    Orders of 1 + Poisson(basket - 1) distinct products, Zipf-like popularity
+    """
+    rng = np.random.default_rng(seed)
+    codes = np.array([f"S{index // 10000 + 10}_{index % 10000:04d}" for index in range(products)])
+    popularity = 1.0 / np.arange(1, products + 1) ** 0.8
+    popularity /= popularity.sum()
+    con = sqlite3.connect(db_path)
+    con.execute("PRAGMA journal_mode=OFF")
+    con.execute("PRAGMA synchronous=OFF")
+    written, order_number = 0, 10100
+    while written < lines:
+        sizes = np.minimum(1 + rng.poisson(basket - 1, size=int(batch_size / basket) + 1), products)
+        orders = np.repeat(np.arange(order_number, order_number + len(sizes)), sizes)
+        chosen = rng.choice(products, size=len(orders), p=popularity)
+        # Drop a product drawn twice for one order (primary key)
+        keys = np.unique(orders.astype(np.int64) * products + chosen)
+        keys = keys[:lines - written]
+        rows = zip((keys // products).tolist(), codes[keys % products].tolist(),
+                   rng.integers(1, 100, size=len(keys)).tolist(), np.round(rng.uniform(10, 200, size=len(keys)), 2).tolist())
+        con.executemany("INSERT INTO orderdetails VALUES (?, ?, ?, ?, 1)", rows)
+        con.commit()
+        written += len(keys)
+        order_number += len(sizes)
+    # MySQL has one for the productCode foreign key; SQLite needs it for the SQL side to be fair
+    con.execute("CREATE INDEX ix_orderdetails_productCode ON orderdetails (productCode)")
+    con.commit()
+    con.close()
+    return written
+
+
+def _max_rss_mib() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _timed(call, iterations: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {"p50_ms": round(percentile(timings, 50) * 1000, 4), "p95_ms": round(percentile(timings, 95) * 1000, 4)}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the co-purchase matrix for product recommendations")
+    parser.add_argument("--lines", type=int, default=10_000_000, help="order lines")
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--basket", type=float, default=9, help="mean products per order")
+    parser.add_argument("--iterations", type=int, default=20, help="requests per product for the lookups")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "bench_recommendations.json"))
+    args = parser.parse_args(argv)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    db_path = os.path.join(RESULTS_DIR, "bench_recommendations.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from database.base import Base
+    from recommendations.recommendations import BUILD_BATCH_SIZE, Recommender, rank
+    from repositories.repositories import OrderDetailRepository
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.tables["orderdetails"].create(engine)
+    started = time.perf_counter()
+    lines = _write_lines(db_path, args.lines, args.products, args.basket, args.seed)
+    print(f"Wrote {lines:,} order lines over {args.products:,} products in {time.perf_counter() - started:.0f}s")
+    db = sessionmaker(bind=engine)()
+    repository = OrderDetailRepository(db)
+
+    # Reading the lines alone, then the whole build as the application runs it; the
+    # build's memory is the growth of the process peak over what it held before
+    started = time.perf_counter()
+    for _ in repository.get_product_lines(BUILD_BATCH_SIZE):
+        pass
+    scan_seconds = time.perf_counter() - started
+    rss_before = _max_rss_mib()
+    recommender = Recommender()
+    recommender.build(repository.get_product_lines(BUILD_BATCH_SIZE))
+    build_peak = _max_rss_mib() - rss_before
+    matrix = recommender.matrix
+
+    # The most, a middling and the least ordered products
+    by_orders = sorted(matrix.codes, key=lambda code: -matrix.counts[matrix.index[code], matrix.index[code]])
+    samples = {"popular": by_orders[0], "median": by_orders[len(by_orders) // 2], "rare": by_orders[-1]}
+    lookups: Dict[str, Dict[str, Any]] = {}
+    for name, code in samples.items():
+        lookups[name] = {
+            "productCode": code,
+            "memory": _timed(lambda: recommender.recommend(code, 10), args.iterations),
+            "sql": _timed(lambda: rank(code, repository.co_purchases(code), 10), max(3, args.iterations // 4)),
+        }
+    existing = by_orders[1:9]
+    add = _timed(lambda: recommender.add([by_orders[0]], existing), 1000)
+    db.close()
+
+    report = {
+        "lines": lines,
+        "orders": matrix.orders,
+        "products": len(matrix.codes),
+        "pairs": matrix.counts.nnz,
+        "scan_seconds": round(scan_seconds, 2),
+        "build_seconds": round(recommender.build_seconds, 2),
+        "matrix_mib": round(matrix.nbytes / 2 ** 20, 2),
+        "build_peak_mib": round(build_peak, 1),
+        "max_rss_mib": round(_max_rss_mib(), 1),
+        "lookups": lookups,
+        "add_line": add,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{lines:,} lines, {matrix.orders:,} orders, {len(matrix.codes):,} products, {matrix.counts.nnz:,} co-purchased pairs\n")
+    print(f"{'read lines from SQLite':34} {scan_seconds:>8.2f} s")
+    print(f"{'full rebuild (streamed)':34} {recommender.build_seconds:>8.2f} s   peak +{build_peak:.1f} MiB")
+    print(f"{'matrix held in memory':34} {report['matrix_mib']:>8.2f} MiB")
+    print(f"{'process max RSS':34} {report['max_rss_mib']:>8.1f} MiB\n")
+    print(f"{'recommendations':22} {'memory p50 ms':>14} {'SQL p50 ms':>11} {'SQL p95 ms':>11}")
+    for name, stats in lookups.items():
+        print(f"{name + ' ' + stats['productCode']:22} {stats['memory']['p50_ms']:>14.3f} {stats['sql']['p50_ms']:>11.2f} {stats['sql']['p95_ms']:>11.2f}")
+    print(f"\nincremental add of one line to a 9-product order: p50 {add['p50_ms']:.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
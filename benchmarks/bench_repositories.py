@@ -0,0 +1,160 @@
+"""
+CPU time per repository read, old Query-based implementation against the cached
+select() statements, on the same session and data. Measures the Python side of a
+request's reads (statement building, compilation cache lookup, ORM loading); the
+SQLite queries themselves are the same for both.
+
+    python -m benchmarks.bench_repositories --iterations 2000
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.load_test import RESULTS_DIR
+
+
+class LegacyReads:
+    """The repository reads as they were before the statement cache, built on Session.query"""
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+
+    def get_all(self, skip: int = 0, limit: int = 100, fields: Optional[List[str]] = None,
+                criteria: Optional[List[Any]] = None, order_by: Optional[List[Any]] = None) -> List[Any]:
+        query = self._query(fields, list_view=True).filter(*(criteria or []))
+        return query.order_by(*(order_by or [])).offset(skip).limit(limit).all()
+
+    def get_paginated(self, page: int = 1, size: int = 10, fields: Optional[List[str]] = None,
+                      criteria: Optional[List[Any]] = None, order_by: Optional[List[Any]] = None):
+        from sqlalchemy import func
+        total = self.db.query(func.count(self.model.__table__.c.get(list(self.model.__table__.primary_key)[0].name))).filter(*(criteria or [])).scalar()
+        pages = math.ceil(total / size)
+        query = self._query(fields, list_view=True).filter(*(criteria or []))
+        items = query.order_by(*(order_by or [])).offset((page - 1) * size).limit(size).all()
+        return items, total, pages
+
+    def get_by_id(self, id_value, fields: Optional[List[str]] = None) -> Any:
+        return self._query(fields).filter(*self._primary_key_criteria(id_value)).first()
+
+    def filter_by(self, column, value, fields: Optional[List[str]] = None) -> List[Any]:
+        return self._query(fields, list_view=True).filter(column == value).all()
+
+    def _query(self, fields: Optional[List[str]] = None, list_view: bool = False):
+        from sqlalchemy.orm import defer, load_only
+        if fields:
+            return self.db.query(self.model).options(load_only(*[getattr(self.model, name) for name in fields]))
+        heavy = [getattr(self.model, column.key) for column in self.model.__table__.columns if column.info.get("heavy")]
+        if list_view and heavy:
+            return self.db.query(self.model).options(*[defer(column) for column in heavy])
+        return self.db.query(self.model)
+
+    def _primary_key_criteria(self, id_value) -> List[Any]:
+        columns = list(self.model.__table__.primary_key)
+        values = id_value if len(columns) > 1 else (id_value,)
+        return [getattr(self.model, column.key) == value for column, value in zip(columns, values)]
+
+
+def _cpu_us(call: Callable[[], Any], iterations: int) -> float:
+    call()
+    started = time.process_time()
+    for _ in range(iterations):
+        call()
+    return (time.process_time() - started) / iterations * 1e6
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark CPU time of repository reads, Query API against cached select()")
+    parser.add_argument("--scale", type=float, default=1, help="synthetic data scale")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "bench_repositories.json"))
+    args = parser.parse_args(argv)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    db_path = os.path.join(RESULTS_DIR, "bench_repositories.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    from sqlalchemy import create_engine, select
+    from sqlalchemy.orm import sessionmaker
+    from database.base import Base
+    from models.models import Customer, Order, OrderDetail, Payment, Product
+    from repositories.repositories import (CustomerRepository, OrderDetailRepository, OrderRepository,
+                                           PaymentRepository, ProductRepository)
+    from scripts.generate_data import GeneratorConfig, generate
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(engine)
+    config = GeneratorConfig.for_scale(args.scale, seed=args.seed)
+    print(f"Generating {config}")
+    generate(engine, config, verbose=False)
+    db = sessionmaker(bind=engine)()
+
+    customer_number = db.execute(select(Customer.customerNumber).limit(1)).scalar()
+    order_number, product_code = db.execute(select(OrderDetail.orderNumber, OrderDetail.productCode).limit(1)).one()
+    payment_key = tuple(db.execute(select(Payment.customerNumber, Payment.checkNumber).limit(1)).one())
+
+    # Both sides get fresh repository objects per call, as services do per request
+    cases: Dict[str, Dict[str, Callable[[], Any]]] = {
+        "customer by id": {
+            "legacy": lambda: LegacyReads(db, Customer).get_by_id(customer_number),
+            "cached": lambda: CustomerRepository(db).get_by_id(customer_number),
+        },
+        "customer by id, ?fields=": {
+            "legacy": lambda: LegacyReads(db, Customer).get_by_id(customer_number, ["customerName", "city"]),
+            "cached": lambda: CustomerRepository(db).get_by_id(customer_number, ["customerName", "city"]),
+        },
+        "payment by composite key": {
+            "legacy": lambda: LegacyReads(db, Payment).get_by_id(payment_key),
+            "cached": lambda: PaymentRepository(db).get_by_id(payment_key),
+        },
+        "order line by composite key": {
+            "legacy": lambda: LegacyReads(db, OrderDetail).get_by_id((order_number, product_code)),
+            "cached": lambda: OrderDetailRepository(db).get_by_composite_key(order_number, product_code),
+        },
+        "customers, list of 10": {
+            "legacy": lambda: LegacyReads(db, Customer).get_all(0, 10),
+            "cached": lambda: CustomerRepository(db).get_all(0, 10),
+        },
+        "products, list of 10 (deferred text)": {
+            "legacy": lambda: LegacyReads(db, Product).get_all(0, 10),
+            "cached": lambda: ProductRepository(db).get_all(0, 10),
+        },
+        "orders, page of 10 with count": {
+            "legacy": lambda: LegacyReads(db, Order).get_paginated(3, 10),
+            "cached": lambda: OrderRepository(db).get_paginated(3, 10),
+        },
+        "orders of a customer": {
+            "legacy": lambda: LegacyReads(db, Order).filter_by(Order.customerNumber, customer_number),
+            "cached": lambda: OrderRepository(db).get_by_customer(customer_number),
+        },
+    }
+
+    results: Dict[str, Dict[str, float]] = {}
+    for name, calls in cases.items():
+        legacy = _cpu_us(calls["legacy"], args.iterations)
+        # Leave the identity map as the legacy run found it
+        db.expunge_all()
+        cached = _cpu_us(calls["cached"], args.iterations)
+        db.expunge_all()
+        results[name] = {"legacy_us": round(legacy, 1), "cached_us": round(cached, 1), "speedup": round(legacy / max(cached, 1e-9), 2)}
+    db.close()
+
+    report = {"scale": args.scale, "iterations": args.iterations, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\nCPU time per call, {args.iterations} iterations\n")
+    print(f"{'read':38} {'Query us':>9} {'select us':>10} {'speedup':>8}")
+    for name, stats in results.items():
+        print(f"{name:38} {stats['legacy_us']:>9.1f} {stats['cached_us']:>10.1f} {stats['speedup']:>8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
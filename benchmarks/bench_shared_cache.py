@@ -0,0 +1,197 @@
+"""
+Product reads by id from several worker processes at once, each going to the database,
+keeping its own in-process copy of every row it read, or sharing one memory-mapped cache
+per host (SHARED_CACHE). Reports lookups/sec, latency, hit ratio and the memory each
+approach takes, checks that writes in one process are seen by the others right away, and
+times token verification with and without the shared cache.
+
+    python -m benchmarks.bench_shared_cache --products 20000 --workers 4 --reads 50000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.load_test import RESULTS_DIR, percentile
+
+MODES = ("database", "private", "shared")
+
+
+def _write_catalog(db_path: str, products: int, seed: int) -> List[str]:
+    rng = np.random.default_rng(seed)
+    codes = [f"S{index // 10000 + 10}_{index % 10000:04d}" for index in range(products)]
+    con = sqlite3.connect(db_path)
+    con.execute("INSERT INTO productlines (productLine, textDescription) VALUES ('Classic Cars', '')")
+    msrp = np.round(rng.lognormal(4.3, 0.5, size=products), 2)
+    con.executemany(
+        "INSERT INTO products (productCode, productName, productLine, productScale, productVendor, productDescription, "
+        "quantityInStock, buyPrice, MSRP) VALUES (?, ?, 'Classic Cars', '1:18', ?, ?, ?, ?, ?)",
+        [(code, f"Model {code}", f"Vendor {index % 200:03d}", "Die-cast replica with opening doors and detailed engine. " * 4,
+          int(rng.integers(1000, 10000)), round(float(msrp[index]) * 0.6, 2), float(msrp[index]))
+         for index, code in enumerate(codes)],
+    )
+    con.commit()
+    con.close()
+    return codes
+
+
+def _worker(options: Dict[str, Any]) -> Dict[str, Any]:
+    from cache import shared_cache
+    from database.base import SessionLocal
+    from services.service import ProductService, to_dict
+
+    mode = options["mode"]
+    if mode in ("shared", "check"):
+        shared_cache.open_cache(options["cache_path"])
+    codes = options["codes"]
+    rng = np.random.default_rng(options["seed"])
+    # Skewed popularity: a few hot products get most reads
+    popularity = 1.0 / np.arange(1, len(codes) + 1) ** 0.9
+    picks = rng.choice(len(codes), size=options["reads"], p=popularity / popularity.sum())
+    private: Dict[str, Dict[str, Any]] = {}
+    hits_before = shared_cache.lookups.value(namespace="products", result="hit")
+    timings = np.empty(len(picks))
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with SessionLocal() as db:
+        service = ProductService(db)
+        if mode == "check":
+            return {code: service.get_by_id(code)["MSRP"] for code in codes}
+        for index, pick in enumerate(picks):
+            code = codes[pick]
+            started = time.perf_counter()
+            if mode == "private":
+                row = private.get(code)
+                if row is None:
+                    row = private[code] = to_dict(service.repository.get_by_id(code))
+            else:
+                service.get_by_id(code)
+            timings[index] = time.perf_counter() - started
+            db.expunge_all()
+    hits = shared_cache.lookups.value(namespace="products", result="hit") - hits_before
+    return {
+        "timings": timings,
+        "rss_growth_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before,
+        "hits": hits,
+        "private_rows": len(private),
+    }
+
+
+def _map(tasks: List[Dict[str, Any]]) -> List[Any]:
+    # One fresh spawned process per task, like uvicorn's workers: nothing inherited but the environment
+    with multiprocessing.get_context("spawn").Pool(len(tasks)) as pool:
+        return pool.map(_worker, tasks, chunksize=1)
+
+
+def _run(mode: str, codes: List[str], args: argparse.Namespace, cache_path: str) -> Dict[str, Any]:
+    tasks = [{"mode": mode, "codes": codes, "reads": args.reads, "seed": args.seed + worker, "cache_path": cache_path}
+             for worker in range(args.workers)]
+    started = time.perf_counter()
+    results = _map(tasks)
+    seconds = time.perf_counter() - started
+    timings = np.sort(np.concatenate([result["timings"] for result in results])).tolist()
+    report = {
+        "lookups_per_sec": round(len(timings) / seconds),
+        "p50_us": round(percentile(timings, 50) * 1e6, 1),
+        "p99_us": round(percentile(timings, 99) * 1e6, 1),
+        "rss_growth_mb_per_worker": round(float(np.mean([result["rss_growth_kb"] for result in results])) / 1024, 1),
+    }
+    if mode == "shared":
+        report["hit_ratio"] = round(sum(result["hits"] for result in results) / len(timings), 4)
+    if mode == "private":
+        report["rows_held_per_worker"] = round(float(np.mean([result["private_rows"] for result in results])))
+    return report
+
+
+def _principals(iterations: int, cache_path: str) -> Dict[str, float]:
+    from auth import auth
+    from cache import shared_cache
+
+    token = auth.create_access_token({"sub": "admin"})
+    timings = {}
+    for name in ("verify", "shared"):
+        if name == "shared":
+            shared_cache.open_cache(cache_path)
+        auth.get_principal(token)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            auth.get_principal(token)
+        timings[f"{name}_us"] = round((time.perf_counter() - started) / iterations * 1e6, 2)
+    return timings
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the host-wide shared cache with several worker processes")
+    parser.add_argument("--products", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--reads", type=int, default=50000, help="product reads per worker")
+    parser.add_argument("--writes", type=int, default=200, help="products updated before the consistency check")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "bench_shared_cache.json"))
+    args = parser.parse_args(argv)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    db_path = os.path.join(RESULTS_DIR, "bench_shared_cache.db")
+    cache_path = os.path.join(RESULTS_DIR, "bench_shared_cache.mmap")
+    for path in (db_path, cache_path):
+        if os.path.exists(path):
+            os.remove(path)
+    # Inherited by the worker processes
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    from sqlalchemy import create_engine
+    from database.base import Base
+    import models.models  # noqa: F401 (registers the tables)
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(engine)
+    engine.dispose()
+    codes = _write_catalog(db_path, args.products, args.seed)
+
+    results: Dict[str, Any] = {mode: _run(mode, codes, args, cache_path) for mode in MODES}
+
+    # Hot products are in the shared cache now: a write in this process must be seen by
+    # the next read of every other process
+    from cache import shared_cache
+    from database.base import SessionLocal
+    from schemas.schema import ProductUpdate
+    from services.service import ProductService
+
+    cache = shared_cache.open_cache(cache_path)
+    results["shared"]["cache_mb"] = round(cache.bytes_used() / 1024 / 1024, 1)
+    results["shared"]["entries"] = cache.entries()
+    written = {code: 1000.0 + index for index, code in enumerate(codes[:args.writes])}
+    with SessionLocal() as db:
+        service = ProductService(db)
+        for code, msrp in written.items():
+            service.patch(code, ProductUpdate(MSRP=msrp))
+    seen = _map([{"mode": "check", "codes": list(written), "reads": 0, "seed": 0, "cache_path": cache_path}] * args.workers)
+    stale = sum(values[code] != msrp for values in seen for code, msrp in written.items())
+    results["stale_reads_after_write"] = stale
+    results["principal"] = _principals(20000, cache_path)
+
+    report = {"products": args.products, "workers": args.workers, "reads_per_worker": args.reads, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{args.products:,} products, {args.workers} workers x {args.reads:,} reads\n")
+    print(f"{'mode':10} {'lookups/s':>10} {'p50 us':>9} {'p99 us':>9} {'RSS +MB/worker':>15}")
+    for mode in MODES:
+        stats = results[mode]
+        print(f"{mode:10} {stats['lookups_per_sec']:>10,} {stats['p50_us']:>9.1f} {stats['p99_us']:>9.1f} "
+              f"{stats['rss_growth_mb_per_worker']:>15.1f}")
+    print(f"\nshared: hit ratio {results['shared']['hit_ratio']:.1%}, {results['shared']['entries']:,} entries "
+          f"in {results['shared']['cache_mb']} MB once per host; private: {results['private']['rows_held_per_worker']:,} rows per worker")
+    print(f"stale reads after {args.writes} writes in another process: {stale}")
+    print(f"token check: {results['principal']['verify_us']} us verifying, {results['principal']['shared_us']} us from the shared cache")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Many workers ordering the same best-seller at once. The "reserve" flow buys through
+POST /orders/full, which takes stock with a conditional UPDATE; the "read-modify-write"
+flow does what a client of PUT /products/{code} would do (GET the stock, PUT stock - n).
+
+Checks afterwards, straight from the database, that the reserve flow never oversold
+(stock >= 0) and lost no update (stock taken == units on the new order lines), and
+reports how many units the read-modify-write flow lost. Exits with 1 when the reserve
+flow breaks either invariant.
+
+    python -m benchmarks.bench_stock --concurrency 32 --stock 2000 --duration 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+from sqlalchemy import create_engine, func, select, update
+from sqlalchemy.engine import Engine
+
+from benchmarks.load_test import API, RESULTS_DIR, free_port, get_token, percentile, start_server, wait_until_ready
+from models.models import Order, OrderDetail, Product
+
+
+def _stock(engine: Engine, product_code: str) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(Product.quantityInStock).where(Product.productCode == product_code)).scalar()
+
+
+def _set_stock(engine: Engine, product_code: str, quantity: int):
+    with engine.begin() as conn:
+        conn.execute(update(Product).where(Product.productCode == product_code).values(quantityInStock=quantity))
+
+
+async def reserve(client: httpx.AsyncClient, product_code: str, quantity: int, customer: int) -> int:
+    response = await client.post(f"{API}/orders/full", json={
+        "orderDate": "2025-06-01",
+        "requiredDate": "2025-06-10",
+        "status": "In Process",
+        "customerNumber": customer,
+        "lines": [{"productCode": product_code, "quantityOrdered": quantity}],
+    })
+    return response.status_code
+
+
+async def read_modify_write(client: httpx.AsyncClient, product_code: str, quantity: int, customer: int) -> int:
+    response = await client.get(f"{API}/products/{product_code}", params={"fields": "quantityInStock"})
+    if response.status_code >= 400:
+        return response.status_code
+    in_stock = response.json()["quantityInStock"]
+    if in_stock < quantity:
+        return 409
+    response = await client.put(f"{API}/products/{product_code}", json={"quantityInStock": in_stock - quantity})
+    return response.status_code
+
+
+FLOWS = {"reserve": reserve, "read-modify-write": read_modify_write}
+
+
+async def run_flow(base_url: str, token: str, flow: str, product_code: str, customers: List[int],
+                   concurrency: int, duration: float, seed: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    sold = 0
+    rejected = 0
+    errors = 0
+    buy = FLOWS[flow]
+
+    async with httpx.AsyncClient(base_url=base_url, headers={"Authorization": f"Bearer {token}"}, timeout=60.0) as client:
+        started = time.perf_counter()
+        stop_at = started + duration
+
+        async def worker(worker_id: int):
+            nonlocal sold, rejected, errors
+            rng = random.Random(seed * 1000 + worker_id)
+            while time.perf_counter() < stop_at:
+                quantity = rng.randint(1, 3)
+                t0 = time.perf_counter()
+                status = await buy(client, product_code, quantity, rng.choice(customers))
+                if status < 400:
+                    latencies.append(time.perf_counter() - t0)
+                    sold += quantity
+                elif status == 409:
+                    # Sold out: nothing left to contend for
+                    rejected += 1
+                    return
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "purchases": len(latencies),
+        "units_sold": sold,
+        "sold_out_rejections": rejected,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 2),
+        "purchases_per_sec": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Concurrency check and benchmark of stock reservation on one hot product")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--stock", type=int, default=2000, help="starting stock of the hot product")
+    parser.add_argument("--duration", type=float, default=10.0, help="upper bound in seconds per flow")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--synthetic", type=float, default=0.1, help="generator scale used to seed the database")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", default=os.path.join(RESULTS_DIR, "bench_stock.db"))
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "bench_stock.json"))
+    args = parser.parse_args(argv)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    from scripts.generate_data import GeneratorConfig, generate
+
+    if os.path.exists(args.db):
+        os.remove(args.db)
+    engine = create_engine(f"sqlite:///{args.db}")
+    keys = generate(engine, GeneratorConfig.for_scale(args.synthetic, seed=args.seed), verbose=False)
+    product_code = keys.products[0]
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_server(args.db, port, args.workers, os.path.join(RESULTS_DIR, "server.log"), {})
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        wait_until_ready(base_url, server)
+        token = get_token(base_url, "admin", "admin")
+        for flow in FLOWS:
+            _set_stock(engine, product_code, args.stock)
+            with engine.connect() as conn:
+                last_order = conn.execute(select(func.max(Order.orderNumber))).scalar() or 0
+            stats = asyncio.run(run_flow(
+                base_url, token, flow, product_code, keys.customers, args.concurrency, args.duration, args.seed
+            ))
+            final_stock = _stock(engine, product_code)
+            with engine.connect() as conn:
+                ordered = conn.execute(
+                    select(func.coalesce(func.sum(OrderDetail.quantityOrdered), 0))
+                    .where(OrderDetail.productCode == product_code, OrderDetail.orderNumber > last_order)
+                ).scalar()
+            stats["final_stock"] = final_stock
+            stats["stock_taken"] = args.stock - final_stock
+            stats["units_on_order_lines"] = ordered
+            stats["lost_updates_units"] = stats["units_sold"] - stats["stock_taken"]
+            results[flow] = stats
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        engine.dispose()
+
+    reserved = results["reserve"]
+    violations = []
+    if reserved["final_stock"] < 0:
+        violations.append(f"oversold: final stock {reserved['final_stock']}")
+    if reserved["stock_taken"] != reserved["units_on_order_lines"]:
+        violations.append(f"stock taken {reserved['stock_taken']} != {reserved['units_on_order_lines']} units on order lines")
+    if reserved["stock_taken"] != reserved["units_sold"]:
+        violations.append(f"stock taken {reserved['stock_taken']} != {reserved['units_sold']} units confirmed to clients")
+
+    report = {
+        "product": product_code,
+        "starting_stock": args.stock,
+        "concurrency": args.concurrency,
+        "workers": args.workers,
+        "flows": results,
+        "violations": violations,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"{'flow':18} {'bought':>7} {'units':>6} {'taken':>6} {'lost':>5} {'err':>5} {'buys/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for flow, stats in results.items():
+        print(f"{flow:18} {stats['purchases']:>7} {stats['units_sold']:>6} {stats['stock_taken']:>6} "
+              f"{stats['lost_updates_units']:>5} {stats['errors']:>5} {stats['purchases_per_sec']:>8.1f} "
+              f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f}")
+    if violations:
+        print("\nReservation invariants violated:\n  " + "\n  ".join(violations))
+        return 1
+    print(f"\nNo oversell: {reserved['stock_taken']} units taken, all on order lines, final stock {reserved['final_stock']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
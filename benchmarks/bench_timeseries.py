@@ -0,0 +1,151 @@
+"""
+Latency of date-range filters and time-bucketed aggregates on ten years of synthetic
+orders and payments, with the date indexes and again after dropping them. The first
+row is the old way of answering "payments this month": download every payment and
+filter on the client.
+
+    python -m benchmarks.bench_timeseries --scale 300 --iterations 30
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from benchmarks.load_test import API, RESULTS_DIR, percentile
+
+# Indexes added for the range filters and timeseries endpoints
+DATE_INDEXES = {
+    "orders": ["ix_orders_customer_orderDate", "ix_orders_orderDate", "ix_orders_requiredDate", "ix_orders_shippedDate"],
+    "payments": ["ix_payments_customer_paymentDate", "ix_payments_paymentDate"],
+}
+
+
+def _queries(end: date, years: int, customer_number: int) -> Dict[str, Tuple[str, Dict[str, Any]]]:
+    month = end.replace(day=1)
+    week = end - timedelta(days=end.weekday() + 7)
+    year = date(end.year - 1, 1, 1)
+    return {
+        "payments this month, client-side filter": ("/payments/", {"limit": 10 ** 7}),
+        "payments this month": ("/payments/", {"date_from": month, "date_to": end, "limit": 10000}),
+        "orders in one week": ("/orders/", {"order_date_from": week, "order_date_to": week + timedelta(days=6), "limit": 10000}),
+        "late orders due in one week": ("/orders/", {
+            "late": "true", "required_date_from": week, "required_date_to": week + timedelta(days=6), "limit": 10000,
+        }),
+        "hot customer's orders, one year": ("/orders/", {
+            "customer_number": customer_number, "order_date_from": year, "order_date_to": date(year.year, 12, 31), "limit": 10000,
+        }),
+        "orders per day, one year": ("/orders/timeseries", {"bucket": "day", "date_from": year, "date_to": date(year.year, 12, 31)}),
+        f"orders per week, {years} years": ("/orders/timeseries", {"bucket": "week"}),
+        f"orders per month, {years} years": ("/orders/timeseries", {"bucket": "month"}),
+        f"shipped per month, {years} years": ("/orders/timeseries", {"bucket": "month", "field": "shippedDate"}),
+        f"payments per month, {years} years": ("/payments/timeseries", {"bucket": "month"}),
+    }
+
+
+def _measure(client, headers: Dict[str, str], path: str, params: Dict[str, Any], iterations: int) -> Dict[str, Any]:
+    latencies, db_times = [], []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        response = client.get(f"{API}{path}", params=params, headers=headers)
+        latencies.append(time.perf_counter() - t0)
+        response.raise_for_status()
+        db_times.append(float(response.headers["X-DB-Time"]))
+    latencies.sort()
+    db_times.sort()
+    body = response.json()
+    return {
+        "rows": len(body["points"]) if isinstance(body, dict) else len(body),
+        "payload_bytes": len(response.content),
+        "db_time_p50_ms": round(percentile(db_times, 50) * 1000, 3),
+        "latency_p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "latency_p95_ms": round(percentile(latencies, 95) * 1000, 3),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark date-range filters and timeseries endpoints")
+    parser.add_argument("--scale", type=float, default=300, help="synthetic data scale (300 ~ 100k orders)")
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-unindexed", action="store_true", help="do not repeat the queries without the date indexes")
+    parser.add_argument("--output", default=os.path.join(RESULTS_DIR, "bench_timeseries.json"))
+    args = parser.parse_args(argv)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    db_path = os.path.join(RESULTS_DIR, "bench_timeseries.db")
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.environ.update({
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "SECRET_KEY": os.environ.get("SECRET_KEY") or "benchmark-secret",
+        "ALGORITHM": os.environ.get("ALGORITHM") or "HS256",
+        "ACCESS_TOKEN_EXPIRE_MINUTES": os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES") or "60",
+        "QUERY_STATS": "true",
+        "QUERY_STATS_HEADERS": "true",
+        "RATE_LIMITING": "false",
+        "RESULT_CACHE": "false",
+    })
+
+    from sqlalchemy import create_engine, func, select, text
+    from scripts.generate_data import GeneratorConfig, generate
+    from models.models import Order
+
+    config = GeneratorConfig.for_scale(args.scale, years=args.years, seed=args.seed)
+    engine = create_engine(f"sqlite:///{db_path}")
+    print(f"Generating {config}")
+    generate(engine, config, verbose=False)
+    with engine.connect() as conn:
+        customer_number = conn.execute(
+            select(Order.customerNumber).group_by(Order.customerNumber).order_by(func.count().desc()).limit(1)
+        ).scalar()
+        end = conn.execute(select(func.max(Order.orderDate))).scalar()
+        orders = conn.execute(select(func.count()).select_from(Order)).scalar()
+
+    from fastapi.testclient import TestClient
+    import main as app_module
+
+    client = TestClient(app_module.app)
+    token = client.post(f"{API}/auth/token", data={"username": "admin", "password": "admin"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    queries = _queries(end, args.years, customer_number)
+
+    results: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for name, (path, params) in queries.items():
+        # The full download is slow and only the baseline, a few runs are enough
+        iterations = max(3, args.iterations // 10) if "client-side" in name else args.iterations
+        results[name] = {"indexed": _measure(client, headers, path, params, iterations)}
+
+    if not args.skip_unindexed:
+        with engine.begin() as conn:
+            for names in DATE_INDEXES.values():
+                for index in names:
+                    conn.execute(text(f'DROP INDEX IF EXISTS "{index}"'))
+        for name, (path, params) in queries.items():
+            if "client-side" in name:
+                continue
+            results[name]["unindexed"] = _measure(client, headers, path, params, args.iterations)
+            results[name]["speedup_p50"] = round(
+                results[name]["unindexed"]["latency_p50_ms"] / max(results[name]["indexed"]["latency_p50_ms"], 1e-9), 2
+            )
+
+    report = {"scale": args.scale, "years": args.years, "orders": orders, "iterations": args.iterations, "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+
+    print(f"\n{orders:,} orders over {args.years} years\n")
+    print(f"{'query':42} {'rows':>7} {'db p50 ms':>10} {'p50 ms':>8} {'p95 ms':>8} {'no idx p50':>11} {'speedup':>8}")
+    for name, stats in results.items():
+        indexed = stats["indexed"]
+        unindexed = stats.get("unindexed")
+        print(f"{name:42} {indexed['rows']:>7} {indexed['db_time_p50_ms']:>10.2f} {indexed['latency_p50_ms']:>8.2f} "
+              f"{indexed['latency_p95_ms']:>8.2f} "
+              f"{unindexed['latency_p50_ms'] if unindexed else float('nan'):>11.2f} {stats.get('speedup_p50', float('nan')):>8.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
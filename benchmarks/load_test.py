@@ -0,0 +1,380 @@
+"""
+Load test for the ClassicModels API.
+
+Seeds a local SQLite database from data_dump.sql, starts the app under uvicorn,
+authenticates through /api/v1/auth/token and drives a weighted mix of reads and
+writes. Reports RPS and p50/p95/p99 per endpoint, writes the results as JSON and
+optionally compares them against a stored baseline.
+
+    python -m benchmarks.load_test --scale 200 --duration 30 --concurrency 32
+    python -m benchmarks.load_test --save-baseline
+    python -m benchmarks.load_test --baseline benchmarks/results/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, "baseline.json")
+
+API = "/api/v1"
+
+# name -> weight; the mix is roughly what the UI produces (mostly reads)
+DEFAULT_MIX = {
+    "GET /customers/": 10,
+    "GET /customers/paginated": 10,
+    "GET /customers/{n}": 15,
+    "GET /customers/{n}/orders": 5,
+    "GET /orders/": 5,
+    "GET /orders/paginated": 10,
+    "GET /orders/{n}": 15,
+    "GET /orders/{n}/details": 10,
+    "GET /products/": 5,
+    "GET /products/{code}": 5,
+    "POST /orders/": 4,
+    "PUT /orders/{n}": 3,
+    "POST /payments/": 3,
+}
+
+
+class Workload:
+    def __init__(self, pools: Dict[str, List], rng: random.Random):
+        self.pools = pools
+        self.rng = rng
+        self.check_seq = 0
+
+    def request(self, name: str) -> Tuple[str, str, Optional[Dict[str, Any]]]:
+        rng = self.rng
+        customer = rng.choice(self.pools["customers"])
+        order = rng.choice(self.pools["orders"])
+        product = rng.choice(self.pools["products"])
+        page = rng.randint(1, max(1, len(self.pools["customers"]) // 10))
+
+        if name == "GET /customers/":
+            return "GET", f"{API}/customers/?skip={rng.randint(0, 50)}&limit=20", None
+        if name == "GET /customers/paginated":
+            return "GET", f"{API}/customers/paginated?page={page}&size=10", None
+        if name == "GET /customers/{n}":
+            return "GET", f"{API}/customers/{customer}", None
+        if name == "GET /customers/{n}/orders":
+            return "GET", f"{API}/customers/{customer}/orders", None
+        if name == "GET /orders/":
+            return "GET", f"{API}/orders/?skip={rng.randint(0, 50)}&limit=20", None
+        if name == "GET /orders/paginated":
+            return "GET", f"{API}/orders/paginated?page={max(1, page // 2)}&size=10", None
+        if name == "GET /orders/{n}":
+            return "GET", f"{API}/orders/{order}", None
+        if name == "GET /orders/{n}/details":
+            return "GET", f"{API}/orders/{order}/details", None
+        if name == "GET /products/":
+            return "GET", f"{API}/products/", None
+        if name == "GET /products/{code}":
+            return "GET", f"{API}/products/{product}", None
+        if name == "POST /orders/":
+            order_date = date(2025, 1, 1) + timedelta(days=rng.randint(0, 300))
+            return "POST", f"{API}/orders/", {
+                "orderDate": order_date.isoformat(),
+                "requiredDate": (order_date + timedelta(days=7)).isoformat(),
+                "status": "In Process",
+                "customerNumber": customer,
+            }
+        if name == "PUT /orders/{n}":
+            return "PUT", f"{API}/orders/{order}", {"status": rng.choice(["Dikirim", "In Process", "On Hold"])}
+        if name == "POST /payments/":
+            self.check_seq += 1
+            return "POST", f"{API}/payments/", {
+                "customerNumber": customer,
+                "checkNumber": f"LT{id(self) % 100000}-{self.check_seq}",
+                "paymentDate": date(2025, 6, 1).isoformat(),
+                "amount": round(rng.uniform(100, 50000), 2),
+            }
+        raise ValueError(f"Unknown workload entry: {name}")
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(samples: Dict[str, List[float]], errors: Dict[str, int], elapsed: float) -> Dict[str, Any]:
+    endpoints = {}
+    for name in sorted(set(samples) | set(errors)):
+        latencies = sorted(samples.get(name, []))
+        endpoints[name] = {
+            "requests": len(latencies),
+            "errors": errors.get(name, 0),
+            "rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "max_ms": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        }
+    all_latencies = sorted(value for values in samples.values() for value in values)
+    total = {
+        "requests": len(all_latencies),
+        "errors": sum(errors.values()),
+        "rps": round(len(all_latencies) / elapsed, 2),
+        "p50_ms": round(percentile(all_latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(all_latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(all_latencies, 99) * 1000, 3),
+    }
+    return {"total": total, "endpoints": endpoints}
+
+
+async def run_load(
+    base_url: str,
+    token: str,
+    pools: Dict[str, List],
+    mix: Dict[str, int],
+    concurrency: int,
+    duration: float,
+    warmup: float,
+    seed: int,
+) -> Dict[str, Any]:
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {}
+    headers = {"Authorization": f"Bearer {token}"}
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, limits=limits, timeout=30.0) as client:
+        start = time.perf_counter()
+        measure_from = start + warmup
+        stop_at = measure_from + duration
+
+        async def worker(worker_id: int):
+            rng = random.Random(seed * 1000 + worker_id)
+            workload = Workload(pools, rng)
+            while True:
+                now = time.perf_counter()
+                if now >= stop_at:
+                    return
+                name = rng.choices(names, weights)[0]
+                method, path, body = workload.request(name)
+                t0 = time.perf_counter()
+                try:
+                    response = await client.request(method, path, json=body)
+                    failed = response.status_code >= 400
+                except httpx.HTTPError:
+                    failed = True
+                t1 = time.perf_counter()
+                if t0 < measure_from:
+                    continue
+                if failed:
+                    errors[name] = errors.get(name, 0) + 1
+                else:
+                    samples[name].append(t1 - t0)
+
+        await asyncio.gather(*(worker(i) for i in range(concurrency)))
+
+    return summarize(samples, errors, duration)
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    Compare per-endpoint results; an endpoint regresses when its RPS drops or its
+    p95 grows by more than `threshold` percent.
+    """
+    report = []
+    for name, now in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before or not before["requests"] or not now["requests"]:
+            continue
+        rps_change = (now["rps"] - before["rps"]) / before["rps"] * 100 if before["rps"] else 0.0
+        p95_change = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0.0
+        report.append({
+            "endpoint": name,
+            "rps_before": before["rps"],
+            "rps_after": now["rps"],
+            "rps_change_pct": round(rps_change, 1),
+            "p95_before_ms": before["p95_ms"],
+            "p95_after_ms": now["p95_ms"],
+            "p95_change_pct": round(p95_change, 1),
+            "regression": rps_change < -threshold or p95_change > threshold,
+        })
+    return report
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(db_path: str, port: int, workers: int, log_path: str, extra_env: Dict[str, str]) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": f"sqlite:///{db_path}",
+        "SECRET_KEY": env.get("SECRET_KEY") or "benchmark-secret",
+        "ALGORITHM": env.get("ALGORITHM") or "HS256",
+        "ACCESS_TOKEN_EXPIRE_MINUTES": env.get("ACCESS_TOKEN_EXPIRE_MINUTES") or "60",
+        # One benchmark user drives all the traffic; pass extra_env to measure with limits on
+        "RATE_LIMITING": "false",
+    })
+    env.update(extra_env)
+    log = open(log_path, "w")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Server exited during startup, see the server log")
+        try:
+            if httpx.get(f"{base_url}/", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("Server did not become ready in time")
+
+
+def get_token(base_url: str, username: str, password: str) -> str:
+    response = httpx.post(
+        f"{base_url}{API}/auth/token", data={"username": username, "password": password}, timeout=10.0
+    )
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(value: Optional[str]) -> Dict[str, int]:
+    if not value:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.rpartition("=")
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown workload entry: {name}")
+        mix[name] = int(weight)
+    return mix
+
+
+def print_summary(result: Dict[str, Any], comparison: Optional[List[Dict[str, Any]]]):
+    print(f"{'endpoint':32} {'req':>7} {'err':>5} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = list(result["endpoints"].items()) + [("TOTAL", result["total"])]
+    for name, stats in rows:
+        print(f"{name:32} {stats['requests']:>7} {stats['errors']:>5} {stats['rps']:>9.1f} "
+              f"{stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f}")
+    if comparison:
+        print()
+        print(f"{'endpoint':32} {'rps %':>8} {'p95 %':>8}")
+        for row in comparison:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"{row['endpoint']:32} {row['rps_change_pct']:>+8.1f} {row['p95_change_pct']:>+8.1f}{flag}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load test the ClassicModels API against a local SQLite database")
+    parser.add_argument("--scale", type=int, default=100, help="copies of the per-customer data in data_dump.sql")
+    parser.add_argument("--synthetic", type=float, default=None,
+                        help="seed with scripts.generate_data at this scale instead of data_dump.sql")
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before measuring")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mix", type=parse_mix, default=None, help='e.g. "GET /orders/{n}=5,POST /orders/=1"')
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--db", default=os.path.join(RESULTS_DIR, "loadtest.db"))
+    parser.add_argument("--output", default=None, help="results JSON path")
+    parser.add_argument("--baseline", default=None, help="baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help=f"also write the results to {DEFAULT_BASELINE}")
+    parser.add_argument("--threshold", type=float, default=10.0, help="allowed regression in percent")
+    parser.add_argument("--env", action="append", default=[], help="extra KEY=VALUE for the server")
+    args = parser.parse_args(argv)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    os.environ["DATABASE_URL"] = f"sqlite:///{args.db}"
+    mix = args.mix or dict(DEFAULT_MIX)
+    if args.synthetic:
+        from sqlalchemy import create_engine
+        from scripts.generate_data import GeneratorConfig, generate
+
+        if os.path.exists(args.db):
+            os.remove(args.db)
+        engine = create_engine(f"sqlite:///{args.db}")
+        keys = generate(engine, GeneratorConfig.for_scale(args.synthetic, seed=args.seed), verbose=False)
+        engine.dispose()
+        pools = {
+            "customers": keys.customers,
+            "orders": list(range(keys.first_order, keys.last_order + 1)),
+            "products": keys.products,
+        }
+    else:
+        from benchmarks.seed import seed_sqlite
+
+        pools = seed_sqlite(args.db, scale=args.scale)
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    extra_env = dict(item.split("=", 1) for item in args.env)
+    server = start_server(args.db, port, args.workers, os.path.join(RESULTS_DIR, "server.log"), extra_env)
+    try:
+        wait_until_ready(base_url, server)
+        token = get_token(base_url, args.username, args.password)
+        result = asyncio.run(run_load(
+            base_url, token, pools, mix, args.concurrency, args.duration, args.warmup, args.seed
+        ))
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    result["meta"] = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "scale": args.scale, "synthetic": args.synthetic, "duration": args.duration, "warmup": args.warmup,
+            "concurrency": args.concurrency, "workers": args.workers, "seed": args.seed, "mix": mix,
+        },
+    }
+
+    comparison = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            comparison = compare(result, json.load(f), args.threshold)
+        result["comparison"] = comparison
+
+    output = args.output or os.path.join(RESULTS_DIR, f"run-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    if args.save_baseline:
+        with open(DEFAULT_BASELINE, "w") as f:
+            json.dump(result, f, indent=2)
+
+    print_summary(result, comparison)
+    print(f"\nResults written to {output}")
+    return 1 if comparison and any(row["regression"] for row in comparison) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+import os
+import sqlite3
+from datetime import date
+from typing import Dict, List
+
+from sqlalchemy import Date, Table, create_engine, insert
+from sqlalchemy.orm import Session
+
+from database.base import Base
+import models.models  # noqa: F401 - register tables on Base.metadata
+from repositories.repositories import OrderRepository
+
+DUMP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data_dump.sql")
+
+# Key offset between two copies of the per-customer data when scaling up
+SCALE_OFFSET = 100000
+
+
+def _load_dump(dump_path: str) -> sqlite3.Connection:
+    """
+    Replay data_dump.sql into an in-memory SQLite staging database
+    """
+    with open(dump_path, encoding="utf-8") as f:
+        # MySQL-only statements that SQLite does not understand
+        script = "\n".join(
+            line for line in f
+            if not line.lstrip().upper().startswith(("CREATE DATABASE", "USE "))
+        )
+    staging = sqlite3.connect(":memory:")
+    staging.row_factory = sqlite3.Row
+    staging.executescript(script)
+    return staging
+
+
+def _scaled_rows(staging: sqlite3.Connection, table: Table, scale: int) -> List[Dict]:
+    date_columns = [column.name for column in table.columns if isinstance(column.type, Date)]
+    rows = []
+    for row in staging.execute(f"SELECT * FROM {table.name}"):
+        row = dict(row)
+        for name in date_columns:
+            if row.get(name) is not None:
+                row[name] = date.fromisoformat(row[name])
+        rows.append(row)
+    if table.name not in ("customers", "orders", "orderdetails", "payments"):
+        return rows
+
+    scaled = []
+    for copy in range(scale):
+        offset = copy * SCALE_OFFSET
+        for row in rows:
+            row = dict(row)
+            if "customerNumber" in row:
+                row["customerNumber"] += offset
+            if "orderNumber" in row:
+                row["orderNumber"] += offset
+            if table.name == "payments" and copy:
+                row["checkNumber"] = f"{row['checkNumber']}-{copy}"
+            scaled.append(row)
+    return scaled
+
+
+def seed_sqlite(db_path: str, scale: int = 1, dump_path: str = DUMP_PATH) -> Dict[str, List]:
+    """
+    Create a fresh SQLite database at db_path from data_dump.sql.
+
+    Customers, orders, order details and payments are copied `scale` times with
+    shifted keys; offices, employees, product lines and products are shared.
+    Returns the key pools the load generator picks from.
+    """
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    staging = _load_dump(dump_path)
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if staging.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)
+            ).fetchone() is None:
+                continue
+            rows = _scaled_rows(staging, table, scale)
+            if rows:
+                conn.execute(insert(table), rows)
+
+    # The dump has no denormalized order totals
+    with Session(engine) as db:
+        OrderRepository(db).refresh_totals()
+        db.commit()
+
+    pools = {
+        "customers": [row[0] for row in staging.execute("SELECT customerNumber FROM customers")],
+        "orders": [row[0] for row in staging.execute("SELECT orderNumber FROM orders")],
+        "products": [row[0] for row in staging.execute("SELECT productCode FROM products")],
+    }
+    staging.close()
+    engine.dispose()
+
+    return {
+        "customers": [n + copy * SCALE_OFFSET for copy in range(scale) for n in pools["customers"]],
+        "orders": [n + copy * SCALE_OFFSET for copy in range(scale) for n in pools["orders"]],
+        "products": pools["products"],
+    }
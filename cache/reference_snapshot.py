@@ -0,0 +1,108 @@
+import logging
+import math
+import os
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from models.models import Office, ProductLine
+from repositories.repositories import TableVersionRepository
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_SNAPSHOT = os.getenv("REFERENCE_SNAPSHOT", "false").lower() == "true"
+
+# How often a worker checks table_versions for writes made by other workers
+POLL_SECONDS = float(os.getenv("REFERENCE_SNAPSHOT_POLL_SECONDS", "2"))
+
+
+class Snapshot:
+    """
+    Immutable copy of a whole table at one version: rows ordered by primary key, each a
+    read-only mapping, plus an index by key. Replaced as a whole, never mutated.
+    """
+
+    def __init__(self, version: int, rows: Tuple[Mapping[str, Any], ...], key: str):
+        self.version = version
+        self.rows = rows
+        self.by_key = MappingProxyType({row[key]: row for row in rows})
+
+
+class ReferenceTable:
+    """
+    Serves a small, rarely written table from memory. Writes in this process reload
+    the snapshot right away; writes in other workers are picked up by polling the
+    table's version at most every POLL_SECONDS.
+    """
+
+    def __init__(self, model, poll_seconds: float = POLL_SECONDS):
+        self.model = model
+        self.name = model.__tablename__
+        self.key = list(model.__table__.primary_key)[0].name
+        self.heavy = {column.name for column in model.__table__.columns if column.info.get("heavy")}
+        self.poll_seconds = poll_seconds
+        self._snapshot: Optional[Snapshot] = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def load(self, db: Session, version: Optional[int] = None) -> Snapshot:
+        if version is None:
+            version = TableVersionRepository(db).get_versions([self.name]).get(self.name, 0)
+        columns = [column.name for column in self.model.__table__.columns]
+        result = db.execute(self.model.__table__.select().order_by(self.model.__table__.c[self.key]))
+        rows = tuple(MappingProxyType(dict(zip(columns, row))) for row in result)
+        self._snapshot = Snapshot(version, rows, self.key)
+        self._checked = time.monotonic()
+        logger.info(f"Loaded {self.name} snapshot v{version}: {len(rows)} rows")
+        return self._snapshot
+
+    def snapshot(self, db: Session) -> Snapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked < self.poll_seconds:
+            return snapshot
+        with self._lock:
+            if self._snapshot is not None and time.monotonic() - self._checked < self.poll_seconds:
+                return self._snapshot
+            version = TableVersionRepository(db).get_versions([self.name]).get(self.name, 0)
+            if self._snapshot is None or version != self._snapshot.version:
+                return self.load(db, version)
+            self._checked = time.monotonic()
+            return self._snapshot
+
+    def invalidate(self, db: Session):
+        """
+        Call after a committed write: bumps the shared version and reloads locally
+        """
+        with self._lock:
+            version = TableVersionRepository(db).bump(self.name)
+            self.load(db, version)
+
+    def get_all(self, db: Session, skip: int = 0, limit: int = 100) -> List[Mapping[str, Any]]:
+        return list(self.snapshot(db).rows[skip:skip + limit])
+
+    def get_paginated(self, db: Session, page: int = 1, size: int = 10) -> Dict[str, Any]:
+        rows = self.snapshot(db).rows
+        return {
+            "items": list(rows[(page - 1) * size:page * size]),
+            "total": len(rows),
+            "page": page,
+            "size": size,
+            "pages": math.ceil(len(rows) / size),
+        }
+
+    def get_by_id(self, db: Session, key) -> Optional[Mapping[str, Any]]:
+        return self.snapshot(db).by_key.get(key)
+
+
+offices = ReferenceTable(Office)
+product_lines = ReferenceTable(ProductLine)
+
+
+def load_all(db: Session):
+    # Version rows up front, so concurrent first writes only UPDATE them
+    TableVersionRepository(db).ensure([table.name for table in (offices, product_lines)])
+    for table in (offices, product_lines):
+        table.load(db)
@@ -0,0 +1,167 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, Set, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from metrics.metrics import Counter, Gauge
+from models.models import Customer, Employee, Office, Order, OrderDetail, Payment, Product, ProductLine
+from repositories.repositories import WRITTEN_TABLES, TableVersionRepository
+
+# Results of list and paginated reads, keyed by resource and query parameters and valid
+# for the versions (table_versions) of the tables they were read from. Every commit that
+# wrote through the repositories bumps the written tables' versions in the same
+# transaction, so a page is recomputed after a write to one of its tables in any worker,
+# while pages of other tables stay cached.
+
+RESULT_CACHE = os.getenv("RESULT_CACHE", "false").lower() == "true"
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "2000"))
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "64"))
+# Upper bound on an entry's age, for writes that bypass the repositories (scripts, manual SQL)
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+
+CACHED_TABLES = [
+    model.__tablename__
+    for model in (Customer, Employee, Office, Order, OrderDetail, Product, ProductLine, Payment)
+]
+
+cache_hits = Counter("result_cache_hits_total", "Reads answered from the result cache", ("resource",))
+cache_misses = Counter("result_cache_misses_total", "Reads computed and stored in the result cache", ("resource",))
+cache_evictions = Counter("result_cache_evictions_total", "Entries evicted to stay within the size limits")
+
+Key = Tuple[str, Hashable]
+
+
+class Entry:
+    def __init__(self, value: Any, tables: Tuple[str, ...], versions: Tuple[int, ...], size: int):
+        self.value = value
+        self.tables = tables
+        self.versions = versions
+        self.size = size
+        self.stored_at = time.monotonic()
+
+
+class ResultCache:
+    """
+    LRU of read results, bounded by entry count and (estimated) size. An entry is only
+    served while the versions of its tables match the ones it was computed at; values
+    are shared between requests and must be treated as read-only.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_bytes: int = int(RESULT_CACHE_MAX_MB * 1024 * 1024),
+                 ttl_seconds: float = RESULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.size = 0
+        self._entries: "OrderedDict[Key, Entry]" = OrderedDict()
+        # table -> keys of the entries read from it, for dropping them on a local write
+        self._by_table: Dict[str, Set[Key]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_compute(self, db: Session, resource: str, params: Hashable, tables: Iterable[str],
+                       compute: Callable[[], Any]) -> Any:
+        tables = tuple(sorted(tables))
+        key = (resource, params)
+        # Versions are read before the data: a write committing in between leaves the
+        # entry under the older versions, where the next read no longer matches it
+        current = TableVersionRepository(db).get_versions(list(tables))
+        versions = tuple(current.get(table, 0) for table in tables)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.versions == versions and time.monotonic() - entry.stored_at < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                cache_hits.inc(resource=resource)
+                return entry.value
+        cache_misses.inc(resource=resource)
+        value = compute()
+        self._store(key, Entry(value, tables, versions, _size_of(value)))
+        return value
+
+    def invalidate(self, tables: Iterable[str]) -> int:
+        """
+        Drops the entries read from any of the tables; other workers notice the new versions
+        """
+        with self._lock:
+            keys = set()
+            for table in tables:
+                keys |= self._by_table.get(table, set())
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+            self.size = 0
+
+    def _store(self, key: Key, entry: Entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self.size += entry.size
+            for table in entry.tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                cache_evictions.inc()
+
+    def _remove(self, key: Key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry.size
+        for table in entry.tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+
+def _size_of(value: Any) -> int:
+    # Rough deep size; shared objects (column names, small ints) are counted every time
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_size_of(k) + _size_of(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_size_of(item) for item in value)
+    return sys.getsizeof(value)
+
+
+cache = ResultCache()
+
+entries_gauge = Gauge("result_cache_entries", "Entries in the result cache", callback=lambda: len(cache))
+bytes_gauge = Gauge("result_cache_bytes", "Estimated size of the result cache", callback=lambda: cache.size)
+
+
+def prepare(db: Session):
+    TableVersionRepository(db).ensure(CACHED_TABLES)
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_versions(session: Session):
+    written = session.info.get(WRITTEN_TABLES)
+    if RESULT_CACHE and written:
+        TableVersionRepository(session).bump_many(written)
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_written(session: Session):
+    written = session.info.pop(WRITTEN_TABLES, None)
+    if RESULT_CACHE and written:
+        cache.invalidate(written)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_written(session: Session):
+    session.info.pop(WRITTEN_TABLES, None)
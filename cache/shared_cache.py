@@ -0,0 +1,314 @@
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from database.base import Base
+from metrics.metrics import Counter, Gauge
+from repositories.repositories import KEYED_TABLES, WRITTEN_KEYS
+
+logger = logging.getLogger(__name__)
+
+# Rows of hot tables and verified auth principals, stored once per host in a memory-mapped
+# file that every worker process maps. Commits that wrote through the repositories drop
+# the written rows (bulk writes: the whole table) in every worker at once; entries also
+# expire after SHARED_CACHE_TTL_SECONDS, for writes that bypass the repositories.
+
+SHARED_CACHE = os.getenv("SHARED_CACHE", "false").lower() == "true"
+# /dev/shm keeps the file in memory; the file is recreated when its layout or the cached tables' columns change
+SHARED_CACHE_PATH = os.getenv("SHARED_CACHE_PATH") or os.path.join(
+    "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "classicmodels-shared-cache"
+)
+SHARED_CACHE_MB = float(os.getenv("SHARED_CACHE_MB", "64"))
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv("SHARED_CACHE_MAX_ENTRIES", "65536"))
+SHARED_CACHE_STRIPES = int(os.getenv("SHARED_CACHE_STRIPES", "16"))
+SHARED_CACHE_TABLES = [name.strip() for name in os.getenv("SHARED_CACHE_TABLES", "products,offices,productlines").split(",") if name.strip()]
+SHARED_CACHE_TTL_SECONDS = float(os.getenv("SHARED_CACHE_TTL_SECONDS", "300"))
+# Upper bound on how long a verified token is trusted without checking it again
+SHARED_CACHE_PRINCIPAL_SECONDS = float(os.getenv("SHARED_CACHE_PRINCIPAL_SECONDS", "60"))
+
+PRINCIPALS = "principals"
+
+lookups = Counter("shared_cache_lookups_total", "Shared cache lookups by namespace and result", ("namespace", "result"))
+evictions = Counter("shared_cache_evictions_total", "Live shared cache entries evicted by this worker to make room")
+
+# File layout: a 4 KiB header page (magic, geometry, per-namespace counters), one 64-byte
+# header per stripe (ring head), the index (per stripe: sets of WAYS entries), then one
+# ring of records per stripe.
+FORMAT = 1
+MAGIC = b"CMSHC\x00\x00\x01"
+HEADER = struct.Struct("<8sQIIIQ")  # magic, fingerprint, stripes, ways, sets per stripe, ring bytes per stripe
+HEADER_SIZE = 4096
+COUNTERS_OFFSET = 512
+COUNTERS = struct.Struct("<QQ")  # per namespace: invalidated (entries of older generations are dead), written
+MAX_NAMESPACES = (HEADER_SIZE - COUNTERS_OFFSET) // COUNTERS.size
+STRIPE_SIZE = 64
+HEAD = struct.Struct("<Q")  # bytes ever written to the stripe's ring; a record at position p is live while p >= head - ring
+WAYS = 8
+INDEX_ENTRY = struct.Struct("<QQd")  # key hash (0: empty), record position, stored at
+INDEX_DTYPE = np.dtype([("hash", "<u8"), ("position", "<u8"), ("stored_at", "<f8")])
+# crc32 of everything after it, value length, key length, namespace, namespace generation, expires at (epoch seconds)
+RECORD = struct.Struct("<IIHBxQd")
+CRC = struct.Struct("<I")
+# Lock bytes (fcntl record locks, advisory): 0 guards the namespace counters, 1 + n stripe n
+COUNTERS_LOCK = 0
+
+
+def _aligned(size: int, alignment: int) -> int:
+    return (size + alignment - 1) // alignment * alignment
+
+
+class SharedCache:
+    """
+    Host-wide key/value cache in a shared memory-mapped file. Keys are (namespace, key)
+    and hash to a stripe, then to a set of WAYS index entries; values are pickled into
+    records appended to the stripe's ring, so memory stays within the file size and the
+    oldest records are overwritten first. Writers of a stripe hold its lock (a thread lock
+    and an fcntl lock on one byte of the file); readers take no lock and check the record
+    they copied instead: still inside the ring, same key, matching crc32. A worker dying
+    mid-write leaves a record that fails that check. Values are shared read-only copies.
+    """
+
+    def __init__(self, path: str, namespaces: List[str], size_bytes: int = int(SHARED_CACHE_MB * 1024 * 1024),
+                 max_entries: int = SHARED_CACHE_MAX_ENTRIES, stripes: int = SHARED_CACHE_STRIPES,
+                 ttl_seconds: float = SHARED_CACHE_TTL_SECONDS, schema: str = ""):
+        if len(namespaces) > MAX_NAMESPACES:
+            raise ValueError(f"At most {MAX_NAMESPACES} namespaces")
+        self.path = path
+        self.namespaces = {name: slot for slot, name in enumerate(namespaces)}
+        self.stripes = stripes
+        self.sets = max(1, max_entries // (stripes * WAYS))
+        self.ring = _aligned(max(size_bytes // stripes, 64 * 1024), 8)
+        self.ttl_seconds = ttl_seconds
+        self.index_offset = HEADER_SIZE + stripes * STRIPE_SIZE
+        self.set_size = WAYS * INDEX_ENTRY.size
+        self.ring_offset = _aligned(self.index_offset + stripes * self.sets * self.set_size, mmap.PAGESIZE)
+        self.size = self.ring_offset + stripes * self.ring
+        layout = repr((FORMAT, stripes, WAYS, self.sets, self.ring, namespaces, schema)).encode()
+        self.fingerprint = int.from_bytes(hashlib.blake2b(layout, digest_size=8).digest(), "little")
+        self._stripe_locks = [threading.Lock() for _ in range(stripes)]
+        self._counters_lock = threading.Lock()
+        self._fd, self._map = self._open()
+
+    def _open(self) -> Tuple[int, mmap.mmap]:
+        # Workers start together: the first one creates the file, the others map it
+        with open(self.path + ".lock", "a+b") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            header = HEADER.pack(MAGIC, self.fingerprint, self.stripes, WAYS, self.sets, self.ring)
+            if os.fstat(fd).st_size != self.size or os.pread(fd, HEADER.size, 0) != header:
+                if os.fstat(fd).st_size:
+                    # Another layout (or a deploy with other columns): start a new file, workers
+                    # still running on the old one keep their mapping of it
+                    os.close(fd)
+                    os.unlink(self.path)
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+                os.ftruncate(fd, self.size)
+                os.pwrite(fd, header, 0)
+                logger.info(f"Created shared cache {self.path} ({self.size / 1024 / 1024:.0f} MB)")
+            return fd, mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    @contextmanager
+    def _locked(self, lock_byte: int, thread_lock: threading.Lock) -> Iterator[None]:
+        # fcntl locks belong to the process, so threads of one worker also need the thread lock
+        with thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, lock_byte)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, lock_byte)
+
+    def _counters(self, slot: int) -> Tuple[int, int]:
+        return COUNTERS.unpack_from(self._map, COUNTERS_OFFSET + slot * COUNTERS.size)
+
+    def _head(self, stripe: int) -> int:
+        return HEAD.unpack_from(self._map, HEADER_SIZE + stripe * STRIPE_SIZE)[0]
+
+    def _locate(self, slot: int, key) -> Tuple[bytes, int, int, int]:
+        """
+        Key bytes, hash, stripe and index offset of the key's set
+        """
+        key_bytes = ("|".join(map(str, key)) if isinstance(key, tuple) else str(key)).encode()
+        digest = hashlib.blake2b(bytes((slot,)) + key_bytes, digest_size=8).digest()
+        key_hash = int.from_bytes(digest, "little") or 1
+        stripe = key_hash % self.stripes
+        offset = self.index_offset + (stripe * self.sets + (key_hash // self.stripes) % self.sets) * self.set_size
+        return key_bytes, key_hash, stripe, offset
+
+    def generation(self, namespace: str) -> int:
+        """
+        Moved by every write to the namespace; pass the value read before computing a value to put()
+        """
+        return self._counters(self.namespaces[namespace])[1]
+
+    def get(self, namespace: str, key) -> Optional[Any]:
+        slot = self.namespaces[namespace]
+        key_bytes, key_hash, stripe, offset = self._locate(slot, key)
+        value = self._read(slot, key_bytes, key_hash, stripe, offset)
+        lookups.inc(namespace=namespace, result="miss" if value is None else "hit")
+        return value
+
+    def _read(self, slot: int, key_bytes: bytes, key_hash: int, stripe: int, offset: int) -> Optional[Any]:
+        mm = self._map
+        for entry_hash, position, _ in INDEX_ENTRY.iter_unpack(mm[offset:offset + self.set_size]):
+            if entry_hash == key_hash:
+                break
+        else:
+            return None
+        if position + self.ring < self._head(stripe):
+            return None
+        start = self.ring_offset + stripe * self.ring + position % self.ring
+        _, value_length, key_length, record_slot, record_generation, expires_at = RECORD.unpack_from(mm, start)
+        end = start + RECORD.size + key_length + value_length
+        if end > self.ring_offset + (stripe + 1) * self.ring:
+            return None
+        record = mm[start:end]
+        # Overwritten while copying, torn by a concurrent writer, or another key with the same hash
+        if position + self.ring < self._head(stripe) or CRC.unpack_from(record)[0] != zlib.crc32(record[CRC.size:]):
+            return None
+        if record_slot != slot or record[RECORD.size:RECORD.size + key_length] != key_bytes:
+            return None
+        if record_generation != self._counters(slot)[0] or expires_at <= time.time():
+            return None
+        return pickle.loads(record[RECORD.size + key_length:])
+
+    def put(self, namespace: str, key, value: Any, generation: int, ttl_seconds: Optional[float] = None) -> bool:
+        """
+        Stores the value unless the namespace was written since `generation` (the value
+        may predate that write) or the record would take more than a quarter of the ring
+        """
+        slot = self.namespaces[namespace]
+        key_bytes, key_hash, stripe, offset = self._locate(slot, key)
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        size = RECORD.size + len(key_bytes) + len(payload)
+        if size > self.ring // 4 or len(key_bytes) > 0xFFFF:
+            return False
+        expires_at = time.time() + (self.ttl_seconds if ttl_seconds is None else ttl_seconds)
+        mm = self._map
+        with self._locked(1 + stripe, self._stripe_locks[stripe]):
+            # Checked under the stripe lock: a write's delete() of the key waits for this put
+            invalidated, written = self._counters(slot)
+            if written != generation:
+                return False
+            head = self._head(stripe)
+            if head % self.ring + size > self.ring:
+                head += self.ring - head % self.ring
+            position = head
+            # Head first: readers stop trusting the records about to be overwritten
+            HEAD.pack_into(mm, HEADER_SIZE + stripe * STRIPE_SIZE, head + size)
+            body = RECORD.pack(0, len(payload), len(key_bytes), slot, invalidated, expires_at)[CRC.size:] + key_bytes + payload
+            start = self.ring_offset + stripe * self.ring + position % self.ring
+            mm[start:start + size] = CRC.pack(zlib.crc32(body)) + body
+            # Same key, else an empty or overwritten entry, else the set's oldest entry
+            entries = list(INDEX_ENTRY.iter_unpack(mm[offset:offset + self.set_size]))
+            live = [entry_hash and entry_position + self.ring >= head + size for entry_hash, entry_position, _ in entries]
+            way = next((way for way, entry in enumerate(entries) if entry[0] == key_hash), None)
+            if way is None:
+                way = next((way for way, alive in enumerate(live) if not alive), None)
+            if way is None:
+                way = min(range(WAYS), key=lambda way: entries[way][2])
+                evictions.inc()
+            INDEX_ENTRY.pack_into(mm, offset + way * INDEX_ENTRY.size, key_hash, position, time.time())
+        return True
+
+    def delete(self, namespace: str, keys: Iterable) -> int:
+        slot = self.namespaces[namespace]
+        self._bump(slot, invalidate=False)
+        deleted = 0
+        for key in keys:
+            _, key_hash, stripe, offset = self._locate(slot, key)
+            with self._locked(1 + stripe, self._stripe_locks[stripe]):
+                for way, (entry_hash, _, _) in enumerate(INDEX_ENTRY.iter_unpack(self._map[offset:offset + self.set_size])):
+                    if entry_hash == key_hash:
+                        INDEX_ENTRY.pack_into(self._map, offset + way * INDEX_ENTRY.size, 0, 0, 0.0)
+                        deleted += 1
+        return deleted
+
+    def invalidate(self, namespace: str):
+        """
+        Every entry of the namespace, at once in every process
+        """
+        self._bump(self.namespaces[namespace], invalidate=True)
+
+    def _bump(self, slot: int, invalidate: bool):
+        with self._locked(COUNTERS_LOCK, self._counters_lock):
+            invalidated, written = self._counters(slot)
+            COUNTERS.pack_into(self._map, COUNTERS_OFFSET + slot * COUNTERS.size, invalidated + invalidate, written + 1)
+
+    def _heads(self) -> np.ndarray:
+        return np.array([self._head(stripe) for stripe in range(self.stripes)], dtype=np.uint64)
+
+    def entries(self) -> int:
+        """
+        Live index entries (expired and invalidated ones included until overwritten)
+        """
+        index = np.frombuffer(self._map, dtype=INDEX_DTYPE, count=self.stripes * self.sets * WAYS, offset=self.index_offset)
+        index = index.reshape(self.stripes, self.sets * WAYS)
+        live = (index["hash"] != 0) & (index["position"] + np.uint64(self.ring) >= self._heads()[:, None])
+        return int(live.sum())
+
+    def bytes_used(self) -> int:
+        return int(np.minimum(self._heads(), self.ring).sum())
+
+
+def table_schema(names: Iterable[str]) -> str:
+    # Part of the file's fingerprint, so rows cached with other columns are not served after a deploy
+    return repr([(name, [column.name for column in Base.metadata.tables[name].columns]) for name in names])
+
+
+cache: Optional[SharedCache] = None
+
+entries_gauge = Gauge("shared_cache_entries", "Entries in the host's shared cache", callback=lambda: cache.entries() if cache else 0)
+bytes_gauge = Gauge("shared_cache_bytes", "Bytes of the shared cache's rings holding records", callback=lambda: cache.bytes_used() if cache else 0)
+
+
+def open_cache(path: str = SHARED_CACHE_PATH, **options) -> SharedCache:
+    """
+    Maps the host's cache file (creating it if needed) and starts collecting the keys
+    written to the cached tables
+    """
+    global cache
+    if cache is None:
+        cache = SharedCache(path, SHARED_CACHE_TABLES + [PRINCIPALS], schema=table_schema(SHARED_CACHE_TABLES), **options)
+        KEYED_TABLES.update(SHARED_CACHE_TABLES)
+    return cache
+
+
+def cached_table(name: str) -> bool:
+    return cache is not None and name in SHARED_CACHE_TABLES
+
+
+@event.listens_for(Session, "after_commit")
+def _drop_written(session: Session):
+    written = session.info.pop(WRITTEN_KEYS, None)
+    if cache is None or not written:
+        return
+    for table, keys in written.items():
+        if table not in SHARED_CACHE_TABLES:
+            continue
+        if keys is None:
+            cache.invalidate(table)
+        else:
+            cache.delete(table, keys)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_written(session: Session):
+    session.info.pop(WRITTEN_KEYS, None)
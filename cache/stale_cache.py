@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from metrics.metrics import Counter, Gauge
+from repositories.repositories import WRITTEN_TABLES
+
+# Whole GET responses of catalog resources, served stale-while-revalidate by
+# StaleWhileRevalidateMiddleware. A response is fresh for SOFT_TTL_SECONDS; after that
+# it is still served at once while one background request refreshes it, and when the
+# refresh fails (database down, circuit breaker open) it keeps being served, with a
+# Warning header, until HARD_TTL_SECONDS. Writes committed in this worker drop the
+# entries of the written tables; writes in other workers show after SOFT_TTL_SECONDS.
+
+STALE_CACHE = os.getenv("STALE_CACHE", "false").lower() == "true"
+# First path segment under /api/v1, which is also the table name
+STALE_CACHE_TABLES = [name.strip() for name in os.getenv("STALE_CACHE_TABLES", "products,productlines,offices").split(",") if name.strip()]
+SOFT_TTL_SECONDS = float(os.getenv("STALE_CACHE_SOFT_TTL_SECONDS", "30"))
+HARD_TTL_SECONDS = float(os.getenv("STALE_CACHE_HARD_TTL_SECONDS", "600"))
+STALE_CACHE_MAX_ENTRIES = int(os.getenv("STALE_CACHE_MAX_ENTRIES", "1000"))
+STALE_CACHE_MAX_MB = float(os.getenv("STALE_CACHE_MAX_MB", "32"))
+
+responses_served = Counter("stale_cache_responses_total", "GET responses of cached resources by how they were answered", ("state",))
+refreshes = Counter("stale_cache_refreshes_total", "Background refreshes of stale entries", ("result",))
+
+Key = Tuple[str, str, str]
+Headers = List[Tuple[bytes, bytes]]
+
+
+class Entry:
+    def __init__(self, headers: Headers, body: bytes):
+        self.headers = headers
+        self.body = body
+        self.stored_at = time.monotonic()
+        # Set when a refresh did not get a fresh response
+        self.failed = False
+
+    def age(self) -> float:
+        return time.monotonic() - self.stored_at
+
+
+class StaleCache:
+    """
+    LRU of response bodies per (table, path, query), bounded by entry count and size.
+    Each table has a generation, moved by every local write to it: a response computed
+    before the write is not stored after it.
+    """
+
+    def __init__(self, soft_ttl: float = SOFT_TTL_SECONDS, hard_ttl: float = HARD_TTL_SECONDS,
+                 max_entries: int = STALE_CACHE_MAX_ENTRIES, max_bytes: int = int(STALE_CACHE_MAX_MB * 1024 * 1024)):
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: "OrderedDict[Key, Entry]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self._refreshing: Set[Key] = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Key) -> Optional[Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.age() >= self.hard_ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def generation(self, table: str) -> int:
+        return self._generations.get(table, 0)
+
+    def store(self, key: Key, generation: int, headers: Headers, body: bytes) -> bool:
+        if len(body) > self.max_bytes:
+            return False
+        with self._lock:
+            if self._generations.get(key[0], 0) != generation:
+                return False
+            self._remove(key)
+            self._entries[key] = Entry(headers, body)
+            self.size += len(body)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+            return True
+
+    def start_refresh(self, key: Key) -> bool:
+        """
+        Claims the key's background refresh; False while one is running
+        """
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def end_refresh(self, key: Key, refreshed: bool):
+        with self._lock:
+            self._refreshing.discard(key)
+            entry = self._entries.get(key)
+            if entry is not None and not refreshed:
+                entry.failed = True
+
+    def invalidate(self, tables: Iterable[str]) -> int:
+        with self._lock:
+            tables = set(tables)
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            keys = [key for key in self._entries if key[0] in tables]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _remove(self, key: Key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.body)
+
+
+def key_for(table: str, path: str, query_string: bytes) -> Key:
+    # Parameter order does not matter
+    query = urlencode(sorted(parse_qsl(query_string.decode("latin-1"), keep_blank_values=True)))
+    return table, path.rstrip("/"), query
+
+
+cache = StaleCache()
+
+entries_gauge = Gauge("stale_cache_entries", "Responses in the stale-while-revalidate cache", callback=lambda: len(cache))
+bytes_gauge = Gauge("stale_cache_bytes", "Size of the response bodies in the stale-while-revalidate cache", callback=lambda: cache.size)
+
+
+# Inserted first: the result cache's after_commit listener pops the written tables
+@event.listens_for(Session, "after_commit", insert=True)
+def _drop_written(session: Session):
+    written = session.info.get(WRITTEN_TABLES)
+    if STALE_CACHE and written:
+        cache.invalidate(written)
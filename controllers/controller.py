@@ -1,27 +1,37 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Body, Depends, File, Form, HTTPException, Response, UploadFile
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from services.service import (
     CustomerService, EmployeeService, OfficeService, OrderService,
-    OrderDetailService, ProductService, ProductLineService, PaymentService
+    OrderDetailService, ProductService, ProductLineService, PaymentService, ChangeFeedService,
+    JobService, ImportService, PricingAnalyticsService
 )
 from schemas.schema import (
     CustomerCreate, CustomerUpdate, CustomerResponse,
     EmployeeCreate, EmployeeUpdate, EmployeeResponse,
     OfficeCreate, OfficeUpdate, OfficeResponse,
-    OrderCreate, OrderUpdate, OrderResponse,
-    OrderDetailCreate, OrderDetailUpdate, OrderDetailResponse,
-    ProductCreate, ProductUpdate, ProductResponse,
+    OrderCreate, OrderUpdate, OrderResponse, OrderWithLinesCreate, OrderWithLinesResponse, OrderBulkUpdate,
+    OrderDetailCreate, OrderDetailUpdate, OrderDetailResponse, OrderLinesReplace, OrderLinesReplaceResponse,
+    ProductCreate, ProductUpdate, ProductResponse, ProductBulkUpdate, StockAdjustment, StockResponse,
+    ProductRecommendationsResponse,
     ProductLineCreate, ProductLineUpdate, ProductLineResponse,
     PaymentCreate, PaymentUpdate, PaymentResponse,
-    PaginatedResponse
+    PaginatedResponse, BulkUpdateResponse, ChangeFeedResponse, JobResponse, ImportResponse,
+    OrderTimeseriesResponse, PaymentTimeseriesResponse,
+    PricingDistributionResponse, PricingHistogramResponse, PricingOutliersResponse,
+    CustomerFields, EmployeeFields, OfficeFields, OrderFields, OrderDetailFields,
+    ProductFields, ProductLineFields, PaymentFields
 )
 from database.session import get_db
-from typing import List
-from auth.auth import get_current_active_user, User
+from typing import Any, Dict, List, Optional
+from datetime import date
+from auth.auth import get_current_active_user, get_current_admin_user, User
+from middleware.admission import admit_request
 
 class BaseController:
     def __init__(self, prefix: str, tags: List[str]):
-        self.router = APIRouter(prefix=prefix, tags=tags)
+        # Rate limiting and admission control run before every route of the controller
+        self.router = APIRouter(prefix=prefix, tags=tags, dependencies=[Depends(admit_request)])
         self.setup_routes()
     
     def setup_routes(self):
@@ -33,26 +43,25 @@ class CustomerController(BaseController):
         super().__init__("/customers", ["customers"])
     
     def setup_routes(self):
-        @self.router.get("/", response_model=List[CustomerResponse])
-        def get_customers(skip: int = 0, limit: int = 2, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/", response_model=List[CustomerFields], response_model_exclude_unset=True)
+        def get_customers(skip: int = 0, limit: int = 2, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = CustomerService(db)
-            return service.get_all(skip, limit)
+            return service.get_all(skip, limit, fields)
         
         @self.router.get("/paginated", response_model=PaginatedResponse)
-        def get_customers_paginated(page: int = 1, size: int = 10, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        def get_customers_paginated(page: int = 1, size: int = 10, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = CustomerService(db)
-            return service.get_paginated(page, size)
+            return service.get_paginated(page, size, fields)
         
-        @self.router.get("/{customer_number}", response_model=CustomerResponse)
-        def get_customer(customer_number: int, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/{customer_number}", response_model=CustomerFields, response_model_exclude_unset=True)
+        def get_customer(customer_number: int, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = CustomerService(db)
-            return service.get_by_id(customer_number)
+            return service.get_by_id(customer_number, fields)
         
-        @self.router.get("/{customer_number}/orders")
-        def get_customer_orders(customer_number: int, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/{customer_number}/orders", response_model=List[OrderFields], response_model_exclude_unset=True)
+        def get_customer_orders(customer_number: int, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = CustomerService(db)
-            customer = service.get_customer_with_orders(customer_number)
-            return customer.orders
+            return service.get_customer_orders(customer_number, fields)
         
         @self.router.post("/", response_model=CustomerResponse)
         def create_customer(customer: CustomerCreate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
@@ -64,6 +73,11 @@ class CustomerController(BaseController):
             service = CustomerService(db)
             return service.update(customer_number, customer)
         
+        @self.router.patch("/{customer_number}", response_model=CustomerResponse)
+        def patch_customer(customer_number: int, customer: CustomerUpdate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = CustomerService(db)
+            return service.patch(customer_number, customer)
+        
         @self.router.delete("/{customer_number}")
         def delete_customer(customer_number: int, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = CustomerService(db)
@@ -74,25 +88,25 @@ class EmployeeController(BaseController):
         super().__init__("/employees", ["employees"])
     
     def setup_routes(self):
-        @self.router.get("/", response_model=List[EmployeeResponse])
-        def get_employees(skip: int = 0, limit: int = 100, db: Session = Depends(get_db),current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/", response_model=List[EmployeeFields], response_model_exclude_unset=True)
+        def get_employees(skip: int = 0, limit: int = 100, fields: Optional[str] = None, db: Session = Depends(get_db),current_user : User = Depends(get_current_active_user)):
             service = EmployeeService(db)
-            return service.get_all(skip, limit)
+            return service.get_all(skip, limit, fields)
         
         @self.router.get("/paginated", response_model=PaginatedResponse)
-        def get_employees_paginated(page: int = 1, size: int = 10, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        def get_employees_paginated(page: int = 1, size: int = 10, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = EmployeeService(db)
-            return service.get_paginated(page, size)
+            return service.get_paginated(page, size, fields)
         
-        @self.router.get("/{employee_number}", response_model=EmployeeResponse)
-        def get_employee(employee_number: int, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/{employee_number}", response_model=EmployeeFields, response_model_exclude_unset=True)
+        def get_employee(employee_number: int, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = EmployeeService(db)
-            return service.get_by_id(employee_number)
+            return service.get_by_id(employee_number, fields)
         
-        @self.router.get("/office/{office_code}", response_model=List[EmployeeResponse])
-        def get_employees_by_office(office_code: str, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/office/{office_code}", response_model=List[EmployeeFields], response_model_exclude_unset=True)
+        def get_employees_by_office(office_code: str, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = EmployeeService(db)
-            return service.get_employees_by_office(office_code)
+            return service.get_employees_by_office(office_code, fields)
         
         @self.router.post("/", response_model=EmployeeResponse)
         def create_employee(employee: EmployeeCreate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
@@ -104,6 +118,11 @@ class EmployeeController(BaseController):
             service = EmployeeService(db)
             return service.update(employee_number, employee)
         
+        @self.router.patch("/{employee_number}", response_model=EmployeeResponse)
+        def patch_employee(employee_number: int, employee: EmployeeUpdate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = EmployeeService(db)
+            return service.patch(employee_number, employee)
+        
         @self.router.delete("/{employee_number}")
         def delete_employee(employee_number: int, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = EmployeeService(db)
@@ -114,20 +133,20 @@ class OfficeController(BaseController):
         super().__init__("/offices", ["offices"])
     
     def setup_routes(self):
-        @self.router.get("/", response_model=List[OfficeResponse])
-        def get_offices(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/", response_model=List[OfficeFields], response_model_exclude_unset=True)
+        def get_offices(skip: int = 0, limit: int = 100, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = OfficeService(db)
-            return service.get_all(skip, limit)
+            return service.get_all(skip, limit, fields)
         
         @self.router.get("/paginated", response_model=PaginatedResponse)
-        def get_offices_paginated(page: int = 1, size: int = 10, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        def get_offices_paginated(page: int = 1, size: int = 10, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = OfficeService(db)
-            return service.get_paginated(page, size)
+            return service.get_paginated(page, size, fields)
         
-        @self.router.get("/{office_code}", response_model=OfficeResponse)
-        def get_office(office_code: str, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/{office_code}", response_model=OfficeFields, response_model_exclude_unset=True)
+        def get_office(office_code: str, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = OfficeService(db)
-            return service.get_by_id(office_code)
+            return service.get_by_id(office_code, fields)
         
         @self.router.post("/", response_model=OfficeResponse)
         def create_office(office: OfficeCreate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
@@ -139,6 +158,11 @@ class OfficeController(BaseController):
             service = OfficeService(db)
             return service.update(office_code, office)
         
+        @self.router.patch("/{office_code}", response_model=OfficeResponse)
+        def patch_office(office_code: str, office: OfficeUpdate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = OfficeService(db)
+            return service.patch(office_code, office)
+        
         @self.router.delete("/{office_code}")
         def delete_office(office_code: str, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = OfficeService(db)
@@ -149,42 +173,114 @@ class OrderController(BaseController):
         super().__init__("/orders", ["orders"])
     
     def setup_routes(self):
-        @self.router.get("/", response_model=List[OrderResponse])
-        def get_orders(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/", response_model=List[OrderFields], response_model_exclude_unset=True)
+        def get_orders(
+            skip: int = 0,
+            limit: int = 100,
+            fields: Optional[str] = None,
+            sort: Optional[str] = None,
+            min_total: Optional[float] = None,
+            max_total: Optional[float] = None,
+            customer_number: Optional[int] = None,
+            order_date_from: Optional[date] = None,
+            order_date_to: Optional[date] = None,
+            required_date_from: Optional[date] = None,
+            required_date_to: Optional[date] = None,
+            shipped_date_from: Optional[date] = None,
+            shipped_date_to: Optional[date] = None,
+            late: Optional[bool] = None,
+            db: Session = Depends(get_db),
+            current_user : User = Depends(get_current_active_user)
+        ):
             service = OrderService(db)
-            return service.get_all(skip, limit)
+            date_ranges = {
+                "orderDate": (order_date_from, order_date_to),
+                "requiredDate": (required_date_from, required_date_to),
+                "shippedDate": (shipped_date_from, shipped_date_to),
+            }
+            return service.get_all(skip, limit, fields, sort, min_total, max_total, customer_number, date_ranges, late)
         
         @self.router.get("/paginated", response_model=PaginatedResponse)
-        def get_orders_paginated(page: int = 1, size: int = 10, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        def get_orders_paginated(
+            page: int = 1,
+            size: int = 10,
+            fields: Optional[str] = None,
+            sort: Optional[str] = None,
+            min_total: Optional[float] = None,
+            max_total: Optional[float] = None,
+            customer_number: Optional[int] = None,
+            order_date_from: Optional[date] = None,
+            order_date_to: Optional[date] = None,
+            required_date_from: Optional[date] = None,
+            required_date_to: Optional[date] = None,
+            shipped_date_from: Optional[date] = None,
+            shipped_date_to: Optional[date] = None,
+            late: Optional[bool] = None,
+            db: Session = Depends(get_db),
+            current_user : User = Depends(get_current_active_user)
+        ):
+            service = OrderService(db)
+            date_ranges = {
+                "orderDate": (order_date_from, order_date_to),
+                "requiredDate": (required_date_from, required_date_to),
+                "shippedDate": (shipped_date_from, shipped_date_to),
+            }
+            return service.get_paginated(page, size, fields, sort, min_total, max_total, customer_number, date_ranges, late)
+        
+        @self.router.get("/timeseries", response_model=OrderTimeseriesResponse)
+        def get_orders_timeseries(
+            bucket: str = "month",
+            field: str = "orderDate",
+            date_from: Optional[date] = None,
+            date_to: Optional[date] = None,
+            customer_number: Optional[int] = None,
+            status: Optional[str] = None,
+            db: Session = Depends(get_db),
+            current_user : User = Depends(get_current_active_user)
+        ):
             service = OrderService(db)
-            return service.get_paginated(page, size)
+            return service.get_timeseries(bucket, field, date_from, date_to, customer_number, status)
         
-        @self.router.get("/{order_number}", response_model=OrderResponse)
-        def get_order(order_number: int, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.patch("/bulk", response_model=BulkUpdateResponse)
+        def bulk_update_orders(bulk_update: OrderBulkUpdate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = OrderService(db)
-            return service.get_by_id(order_number)
+            return service.bulk_update(bulk_update)
         
-        @self.router.get("/{order_number}/details")
-        def get_order_with_details(order_number: int, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/{order_number}", response_model=OrderFields, response_model_exclude_unset=True)
+        def get_order(order_number: int, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = OrderService(db)
-            order = service.get_order_with_details(order_number)
-            return order.orderDetails
+            return service.get_by_id(order_number, fields)
         
-        @self.router.get("/customer/{customer_number}", response_model=List[OrderResponse])
-        def get_orders_by_customer(customer_number: int, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/{order_number}/details", response_model=List[OrderDetailFields], response_model_exclude_unset=True)
+        def get_order_with_details(order_number: int, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = OrderService(db)
-            return service.get_orders_by_customer(customer_number)
+            return service.get_order_details(order_number, fields)
+        
+        @self.router.get("/customer/{customer_number}", response_model=List[OrderFields], response_model_exclude_unset=True)
+        def get_orders_by_customer(customer_number: int, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = OrderService(db)
+            return service.get_orders_by_customer(customer_number, fields)
         
         @self.router.post("/", response_model=OrderResponse)
         def create_order(order: OrderCreate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = OrderService(db)
             return service.create(order)
         
+        @self.router.post("/full", response_model=OrderWithLinesResponse)
+        def create_order_with_lines(order: OrderWithLinesCreate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = OrderService(db)
+            return service.create_with_lines(order)
+        
         @self.router.put("/{order_number}", response_model=OrderResponse)
         def update_order(order_number: int, order: OrderUpdate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = OrderService(db)
             return service.update(order_number, order)
         
+        @self.router.patch("/{order_number}", response_model=OrderResponse)
+        def patch_order(order_number: int, order: OrderUpdate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = OrderService(db)
+            return service.patch(order_number, order)
+        
         @self.router.delete("/{order_number}")
         def delete_order(order_number: int, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = OrderService(db)
@@ -195,15 +291,20 @@ class OrderDetailController(BaseController):
         super().__init__("/orderdetails", ["orderdetails"])
     
     def setup_routes(self):
-        @self.router.get("/order/{order_number}", response_model=List[OrderDetailResponse])
-        def get_order_details(order_number: int, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/order/{order_number}", response_model=List[OrderDetailFields], response_model_exclude_unset=True)
+        def get_order_details(order_number: int, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = OrderDetailService(db)
+            return service.get_by_order_number(order_number, fields)
+        
+        @self.router.put("/order/{order_number}", response_model=OrderLinesReplaceResponse)
+        def replace_order_details(order_number: int, replace: OrderLinesReplace, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = OrderDetailService(db)
-            return service.get_by_order_number(order_number)
+            return service.replace_order_lines(order_number, replace)
         
-        @self.router.get("/{order_number}/{product_code}", response_model=OrderDetailResponse)
-        def get_order_detail(order_number: int, product_code: str, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/{order_number}/{product_code}", response_model=OrderDetailFields, response_model_exclude_unset=True)
+        def get_order_detail(order_number: int, product_code: str, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = OrderDetailService(db)
-            return service.get_by_composite_key(order_number, product_code)
+            return service.get_by_composite_key(order_number, product_code, fields)
         
         @self.router.post("/", response_model=OrderDetailResponse)
         def create_order_detail(order_detail: OrderDetailCreate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
@@ -211,6 +312,7 @@ class OrderDetailController(BaseController):
             return service.create(order_detail)
         
         @self.router.put("/{order_number}/{product_code}", response_model=OrderDetailResponse)
+        @self.router.patch("/{order_number}/{product_code}", response_model=OrderDetailResponse)
         def update_order_detail(
             order_number: int, 
             product_code: str, 
@@ -231,25 +333,30 @@ class ProductController(BaseController):
         super().__init__("/products", ["products"])
     
     def setup_routes(self):
-        @self.router.get("/", response_model=List[ProductResponse])
-        def get_products(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/", response_model=List[ProductFields], response_model_exclude_unset=True)
+        def get_products(skip: int = 0, limit: int = 100, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = ProductService(db)
-            return service.get_all(skip, limit)
+            return service.get_all(skip, limit, fields)
         
         @self.router.get("/paginated", response_model=PaginatedResponse)
-        def get_products_paginated(page: int = 1, size: int = 10, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        def get_products_paginated(page: int = 1, size: int = 10, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = ProductService(db)
-            return service.get_paginated(page, size)
+            return service.get_paginated(page, size, fields)
         
-        @self.router.get("/{product_code}", response_model=ProductResponse)
-        def get_product(product_code: str, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.patch("/bulk", response_model=BulkUpdateResponse)
+        def bulk_update_products(bulk_update: ProductBulkUpdate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = ProductService(db)
-            return service.get_by_id(product_code)
+            return service.bulk_update(bulk_update)
         
-        @self.router.get("/productline/{product_line}", response_model=List[ProductResponse])
-        def get_products_by_product_line(product_line: str, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/{product_code}", response_model=ProductFields, response_model_exclude_unset=True)
+        def get_product(product_code: str, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = ProductService(db)
-            return service.get_products_by_product_line(product_line)
+            return service.get_by_id(product_code, fields)
+        
+        @self.router.get("/productline/{product_line}", response_model=List[ProductFields], response_model_exclude_unset=True)
+        def get_products_by_product_line(product_line: str, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = ProductService(db)
+            return service.get_products_by_product_line(product_line, fields)
         
         @self.router.post("/", response_model=ProductResponse)
         def create_product(product: ProductCreate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
@@ -261,6 +368,21 @@ class ProductController(BaseController):
             service = ProductService(db)
             return service.update(product_code, product)
         
+        @self.router.patch("/{product_code}", response_model=ProductResponse)
+        def patch_product(product_code: str, product: ProductUpdate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = ProductService(db)
+            return service.patch(product_code, product)
+        
+        @self.router.get("/{product_code}/recommendations", response_model=ProductRecommendationsResponse)
+        def get_product_recommendations(product_code: str, limit: int = 10, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = ProductService(db)
+            return service.get_recommendations(product_code, limit)
+        
+        @self.router.post("/{product_code}/stock", response_model=StockResponse)
+        def adjust_product_stock(product_code: str, adjustment: StockAdjustment, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = ProductService(db)
+            return service.adjust_stock(product_code, adjustment.delta)
+        
         @self.router.delete("/{product_code}")
         def delete_product(product_code: str, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = ProductService(db)
@@ -271,20 +393,20 @@ class ProductLineController(BaseController):
         super().__init__("/productlines", ["productlines"])
     
     def setup_routes(self):
-        @self.router.get("/", response_model=List[ProductLineResponse])
-        def get_product_lines(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/", response_model=List[ProductLineFields], response_model_exclude_unset=True)
+        def get_product_lines(skip: int = 0, limit: int = 100, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = ProductLineService(db)
-            return service.get_all(skip, limit)
+            return service.get_all(skip, limit, fields)
         
         @self.router.get("/paginated", response_model=PaginatedResponse)
-        def get_product_lines_paginated(page: int = 1, size: int = 10, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        def get_product_lines_paginated(page: int = 1, size: int = 10, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = ProductLineService(db)
-            return service.get_paginated(page, size)
+            return service.get_paginated(page, size, fields)
         
-        @self.router.get("/{product_line}", response_model=ProductLineResponse)
-        def get_product_line(product_line: str, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/{product_line}", response_model=ProductLineFields, response_model_exclude_unset=True)
+        def get_product_line(product_line: str, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = ProductLineService(db)
-            return service.get_by_id(product_line)
+            return service.get_by_id(product_line, fields)
         
         @self.router.post("/", response_model=ProductLineResponse)
         def create_product_line(product_line: ProductLineCreate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
@@ -296,6 +418,11 @@ class ProductLineController(BaseController):
             service = ProductLineService(db)
             return service.update(product_line, product_line_update)
         
+        @self.router.patch("/{product_line}", response_model=ProductLineResponse)
+        def patch_product_line(product_line: str, product_line_update: ProductLineUpdate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = ProductLineService(db)
+            return service.patch(product_line, product_line_update)
+        
         @self.router.delete("/{product_line}")
         def delete_product_line(product_line: str, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = ProductLineService(db)
@@ -306,15 +433,42 @@ class PaymentController(BaseController):
         super().__init__("/payments", ["payments"])
     
     def setup_routes(self):
-        @self.router.get("/customer/{customer_number}", response_model=List[PaymentResponse])
-        def get_payments_by_customer(customer_number: int, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/", response_model=List[PaymentFields], response_model_exclude_unset=True)
+        def get_payments(
+            skip: int = 0,
+            limit: int = 100,
+            fields: Optional[str] = None,
+            sort: Optional[str] = None,
+            customer_number: Optional[int] = None,
+            date_from: Optional[date] = None,
+            date_to: Optional[date] = None,
+            db: Session = Depends(get_db),
+            current_user : User = Depends(get_current_active_user)
+        ):
+            service = PaymentService(db)
+            return service.get_all(skip, limit, fields, sort, customer_number, date_from, date_to)
+        
+        @self.router.get("/timeseries", response_model=PaymentTimeseriesResponse)
+        def get_payments_timeseries(
+            bucket: str = "month",
+            date_from: Optional[date] = None,
+            date_to: Optional[date] = None,
+            customer_number: Optional[int] = None,
+            db: Session = Depends(get_db),
+            current_user : User = Depends(get_current_active_user)
+        ):
+            service = PaymentService(db)
+            return service.get_timeseries(bucket, date_from, date_to, customer_number)
+        
+        @self.router.get("/customer/{customer_number}", response_model=List[PaymentFields], response_model_exclude_unset=True)
+        def get_payments_by_customer(customer_number: int, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = PaymentService(db)
-            return service.get_by_customer_number(customer_number)
+            return service.get_by_customer_number(customer_number, fields)
         
-        @self.router.get("/{customer_number}/{check_number}", response_model=PaymentResponse)
-        def get_payment(customer_number: int, check_number: str, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+        @self.router.get("/{customer_number}/{check_number}", response_model=PaymentFields, response_model_exclude_unset=True)
+        def get_payment(customer_number: int, check_number: str, fields: Optional[str] = None, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = PaymentService(db)
-            return service.get_by_composite_key(customer_number, check_number)
+            return service.get_by_composite_key(customer_number, check_number, fields)
         
         @self.router.post("/", response_model=PaymentResponse)
         def create_payment(payment: PaymentCreate, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
@@ -322,6 +476,7 @@ class PaymentController(BaseController):
             return service.create(payment)
         
         @self.router.put("/{customer_number}/{check_number}", response_model=PaymentResponse)
+        @self.router.patch("/{customer_number}/{check_number}", response_model=PaymentResponse)
         def update_payment(
             customer_number: int, 
             check_number: str, 
@@ -335,4 +490,90 @@ class PaymentController(BaseController):
         @self.router.delete("/{customer_number}/{check_number}")
         def delete_payment(customer_number: int, check_number: str, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
             service = PaymentService(db)
-            return service.delete(customer_number, check_number)
\ No newline at end of file
+            return service.delete(customer_number, check_number)
+
+class ChangeController(BaseController):
+    def __init__(self):
+        super().__init__("/changes", ["changes"])
+    
+    def setup_routes(self):
+        @self.router.get("/", response_model=ChangeFeedResponse)
+        def get_changes(since: Optional[int] = None, tables: Optional[str] = None, limit: int = 500, db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = ChangeFeedService(db)
+            return service.get_changes(since, tables, limit)
+
+class JobController(BaseController):
+    def __init__(self):
+        super().__init__("/jobs", ["jobs"])
+    
+    def setup_routes(self):
+        @self.router.get("/reports")
+        def get_reports(current_user : User = Depends(get_current_active_user)):
+            service = JobService()
+            return service.get_reports()
+        
+        @self.router.post("/{report}", response_model=JobResponse, status_code=202)
+        def submit_job(report: str, response: Response, params: Dict[str, Any] = Body(default={}), current_user : User = Depends(get_current_active_user)):
+            service = JobService()
+            job, created = service.submit(report, params, current_user.username)
+            if not created:
+                response.status_code = 200
+            return job
+        
+        @self.router.get("/{job_id}", response_model=JobResponse)
+        def get_job(job_id: str, current_user : User = Depends(get_current_active_user)):
+            service = JobService()
+            return service.get(job_id, current_user)
+        
+        @self.router.get("/{job_id}/result")
+        def download_job_result(job_id: str, current_user : User = Depends(get_current_active_user)):
+            service = JobService()
+            path, filename = service.get_result(job_id, current_user)
+            return FileResponse(path, media_type="text/csv", filename=filename)
+        
+        @self.router.delete("/{job_id}", response_model=JobResponse)
+        def cancel_job(job_id: str, current_user : User = Depends(get_current_active_user)):
+            service = JobService()
+            return service.cancel(job_id, current_user)
+
+class AnalyticsController(BaseController):
+    def __init__(self):
+        super().__init__("/analytics", ["analytics"])
+    
+    def setup_routes(self):
+        @self.router.get("/pricing/distribution", response_model=PricingDistributionResponse)
+        def get_pricing_distribution(metric: str = "margin", group_by: Optional[str] = None, percentiles: Optional[str] = None,
+                                     db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = PricingAnalyticsService(db)
+            return service.get_distribution(metric, group_by, percentiles)
+        
+        @self.router.get("/pricing/histogram", response_model=PricingHistogramResponse)
+        def get_pricing_histogram(
+            metric: str = "margin",
+            group_by: Optional[str] = None,
+            group: Optional[str] = None,
+            bins: int = 20,
+            min_value: Optional[float] = None,
+            max_value: Optional[float] = None,
+            db: Session = Depends(get_db),
+            current_user : User = Depends(get_current_active_user)
+        ):
+            service = PricingAnalyticsService(db)
+            return service.get_histogram(metric, group_by, group, bins, min_value, max_value)
+        
+        @self.router.get("/pricing/outliers", response_model=PricingOutliersResponse, response_model_exclude_unset=True)
+        def get_pricing_outliers(metric: str = "margin", group_by: Optional[str] = None, k: float = 1.5, limit: int = 100,
+                                 db: Session = Depends(get_db), current_user : User = Depends(get_current_active_user)):
+            service = PricingAnalyticsService(db)
+            return service.get_outliers(metric, group_by, k, limit)
+
+class AdminController(BaseController):
+    def __init__(self):
+        super().__init__("/admin", ["admin"])
+    
+    def setup_routes(self):
+        @self.router.post("/import", response_model=ImportResponse)
+        def import_files(files: List[UploadFile] = File(...), table: Optional[str] = Form(None), drop_indexes: bool = Form(False),
+                         restart: bool = Form(False), current_user : User = Depends(get_current_admin_user)):
+            service = ImportService()
+            return service.run([(file.filename, file.file) for file in files], table, drop_indexes, restart)
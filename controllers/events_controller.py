@@ -0,0 +1,28 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+
+from auth.auth import User, get_current_active_user
+from events import events
+
+class OrderEventsController:
+    def __init__(self):
+        # Not behind admission control: a stream holds no database connection but would keep its slot for hours
+        self.router = APIRouter(tags=["orders"], prefix="/orders")
+        self._setup_routes()
+    
+    def _setup_routes(self):
+        @self.router.get("/events")
+        async def stream_order_events(customer_number: Optional[int] = None, status: Optional[str] = None, current_user : User = Depends(get_current_active_user)):
+            # Server-sent events: order.created, order.updated (with previousStatus), order.deleted
+            statuses = [value.strip() for value in status.split(",") if value.strip()] if status else None
+            try:
+                subscription = events.hub.subscribe(customer_number, statuses)
+            except events.TooManySubscribers:
+                raise HTTPException(status_code=503, detail="Too many open event streams", headers={"Retry-After": "30"})
+            return StreamingResponse(
+                events.stream(subscription, events.hub),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from metrics import metrics
+
+class MetricsController:
+    def __init__(self):
+        self.router = APIRouter(tags=["Metrics"], prefix="/metrics")
+        self._setup_routes()
+    
+    def _setup_routes(self):
+        @self.router.get("", response_class=PlainTextResponse)
+        async def get_metrics():
+            # Prometheus text format; not behind admission control so it stays scrapeable under load
+            return metrics.render()
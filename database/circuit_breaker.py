@@ -0,0 +1,149 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from database import timeouts
+from metrics.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Stops sending statements to a database that keeps failing: after FAILURES failed
+# connects, lost connections or statements stopped by their deadline in a row, the
+# engine's statements are rejected right away (503) for RESET_SECONDS; then one
+# request probes the database and closes the breaker again if it gets through.
+
+CIRCUIT_BREAKER = os.getenv("CIRCUIT_BREAKER", "true").lower() == "true"
+FAILURES = int(os.getenv("CIRCUIT_BREAKER_FAILURES", "5"))
+RESET_SECONDS = float(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", "30"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+breaker_trips = Counter("db_circuit_breaker_trips_total", "Times a database circuit breaker opened")
+breaker_rejected = Counter("db_circuit_breaker_rejected_total", "Connects and statements rejected by an open circuit breaker")
+
+
+class DatabaseUnavailable(Exception):
+    """
+    The database's circuit breaker is open (answered with 503)
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Database circuit breaker open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker. While half open only the probing thread gets through;
+    if its outcome never arrives another probe is allowed after reset_seconds.
+    """
+
+    def __init__(self, failures: int = FAILURES, reset_seconds: float = RESET_SECONDS):
+        self.max_failures = failures
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        """
+        Raises DatabaseUnavailable unless the caller may use the database
+        """
+        if self.state == CLOSED:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN and self._probe == threading.get_ident():
+                return
+            if self.state != CLOSED and now - self.opened_at >= self.reset_seconds:
+                # Next probe: restarts the wait, so a lost probe is retried after reset_seconds
+                self.state, self.opened_at, self._probe = HALF_OPEN, now, threading.get_ident()
+                logger.info("Database circuit breaker half open, probing")
+                return
+            if self.state == CLOSED:
+                return
+        breaker_rejected.inc()
+        raise DatabaseUnavailable(self.retry_after())
+
+    def record_success(self):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            if self.state == HALF_OPEN and self._probe != threading.get_ident():
+                return
+            if self.state != CLOSED:
+                logger.info("Database circuit breaker closed")
+            self.state, self.failures, self._probe = CLOSED, 0, None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.max_failures):
+                self.state, self.opened_at, self._probe = OPEN, time.monotonic(), None
+                breaker_trips.inc()
+                logger.warning(f"Database circuit breaker open after {self.failures} failures, "
+                               f"rejecting statements for {self.reset_seconds:.0f}s")
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+
+# One breaker per engine (shards fail independently), keyed by the engine's dialect
+# instance: the only handle every event below has
+_breakers: Dict[object, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker_for(dialect) -> CircuitBreaker:
+    breaker = _breakers.get(dialect)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(dialect, CircuitBreaker())
+    return breaker
+
+
+breakers_open = Gauge("db_circuit_breakers_open", "Database circuit breakers currently open or half open",
+                      callback=lambda: sum(breaker.state != CLOSED for breaker in list(_breakers.values())))
+
+
+def _do_connect(dialect, connection_record, cargs, cparams):
+    breaker_for(dialect).check()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    breaker_for(conn.dialect).check()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    breaker_for(conn.dialect).record_success()
+
+
+def _handle_error(context):
+    error = context.original_exception
+    if context.connection is None or context.is_disconnect:
+        # Connect failures and lost connections
+        breaker_for(context.dialect).record_failure()
+    elif timeouts.interrupted(error):
+        # Deadline exceeded; a client hanging up says nothing about the database
+        state = timeouts.current_deadline()
+        if state is None or not state.cancelled:
+            breaker_for(context.dialect).record_failure()
+    return None
+
+
+def install(target=Engine):
+    """
+    Hook the breaker on `target` (every engine by default)
+    """
+    if not event.contains(target, "before_cursor_execute", _before_cursor_execute):
+        event.listen(target, "do_connect", _do_connect)
+        event.listen(target, "before_cursor_execute", _before_cursor_execute)
+        event.listen(target, "after_cursor_execute", _after_cursor_execute)
+        event.listen(target, "handle_error", _handle_error)
@@ -0,0 +1,138 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Union
+import logging
+import re
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# A statement run this many times with different parameters in one request is reported as N+1
+N_PLUS_ONE_THRESHOLD = 5
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+class QueryStats:
+    """
+    Statements and database time collected for one request (or one `track_queries` block)
+    """
+
+    def __init__(self, endpoint: Optional[str] = None):
+        self.endpoint = endpoint
+        self.count = 0
+        self.db_time = 0.0
+        # normalized statement -> [executions, distinct parameter sets]
+        self.statements: Dict[str, List] = {}
+
+    def record(self, statement: str, parameters, elapsed: float):
+        self.count += 1
+        self.db_time += elapsed
+        key = _WHITESPACE.sub(" ", _LITERALS.sub("?", statement)).strip()
+        entry = self.statements.setdefault(key, [0, set()])
+        entry[0] += 1
+        entry[1].add(repr(parameters) if parameters is not None else statement)
+
+    def n_plus_one(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> Dict[str, int]:
+        """
+        Statements repeated at least `threshold` times that only differ in their parameters
+        """
+        return {
+            statement: executions
+            for statement, (executions, parameter_sets) in self.statements.items()
+            if executions >= threshold and len(parameter_sets) > 1
+        }
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("query_stats", default=None)
+
+# Called with the finished QueryStats of every tracked request (used by assert_query_budget)
+_listeners: List[Callable[[QueryStats], None]] = []
+
+
+def current_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
+
+
+@contextmanager
+def track_queries(endpoint: Optional[str] = None) -> Iterator[QueryStats]:
+    stats = QueryStats(endpoint)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+        for listener in list(_listeners):
+            listener(stats)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current_stats.get() is not None:
+        context._query_stats_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    started = getattr(context, "_query_stats_started", None)
+    if stats is not None and started is not None:
+        stats.record(statement, parameters, time.perf_counter() - started)
+
+
+def install(target=Engine):
+    """
+    Hook the statement counters on `target` (every engine by default)
+    """
+    if not event.contains(target, "before_cursor_execute", _before_cursor_execute):
+        event.listen(target, "before_cursor_execute", _before_cursor_execute)
+        event.listen(target, "after_cursor_execute", _after_cursor_execute)
+
+
+def log_request_stats(stats: QueryStats, warn_threshold: int):
+    repeated = stats.n_plus_one()
+    for statement, executions in repeated.items():
+        logger.warning(f"Possible N+1 on {stats.endpoint}: {executions}x {statement[:200]}")
+    if stats.count > warn_threshold:
+        logger.warning(f"{stats.endpoint} ran {stats.count} statements ({stats.db_time * 1000:.1f} ms in the database)")
+
+
+@contextmanager
+def assert_query_budget(budget: Union[int, Dict[str, int]], allow_n_plus_one: bool = False) -> Iterator[List[QueryStats]]:
+    """
+    Test helper: fail when a request (or code run directly inside the block) exceeds its
+    statement budget or shows an N+1 pattern.
+
+        with assert_query_budget({"GET /api/v1/orders/{order_number}/details": 2, "*": 5}):
+            client.get("/api/v1/orders/10100/details", headers=headers)
+
+    Works with TestClient because finished requests are reported through a listener,
+    not through the caller's context.
+    """
+    captured: List[QueryStats] = []
+    _listeners.append(captured.append)
+    try:
+        with track_queries("<direct>") as direct:
+            yield captured
+    finally:
+        _listeners.remove(captured.append)
+    captured = [stats for stats in captured if stats is not direct]
+    if direct.count:
+        captured.append(direct)
+
+    failures = []
+    for stats in captured:
+        if isinstance(budget, int):
+            limit = budget
+        else:
+            limit = budget.get(stats.endpoint, budget.get("*"))
+        if limit is not None and stats.count > limit:
+            statements = "\n    ".join(f"{executions}x {statement}" for statement, (executions, _) in stats.statements.items())
+            failures.append(f"{stats.endpoint}: {stats.count} statements, budget {limit}\n    {statements}")
+        if not allow_n_plus_one:
+            for statement, executions in stats.n_plus_one().items():
+                failures.append(f"{stats.endpoint}: N+1, {executions}x {statement}")
+    if failures:
+        raise AssertionError("Query budget exceeded:\n" + "\n".join(failures))
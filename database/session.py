@@ -1,4 +1,5 @@
 from .base import SessionLocal
+from .sharding import close_sessions
 
 def get_db():
     """
@@ -8,4 +9,6 @@ def get_db():
     try:
         yield db
     finally:
+        # Shard sessions the request opened (SHARDS)
+        close_sessions(db)
         db.close()
\ No newline at end of file
@@ -0,0 +1,411 @@
+"""
+Horizontal sharding of customer data by sales territory (SHARDS).
+
+A customer lives on the shard of its sales rep's office territory, together with its
+orders, order lines and payments. The home database (DATABASE_URL, or the MySQL
+settings) keeps the reference tables (offices, employees, product lines, products),
+the change feed, the table versions and the shard directory. Shards hold their share
+of the customer tables plus a replica of the reference tables, updated row by row
+after every commit that writes them, so shard-local joins (reports) work.
+
+    SHARDS=NA=sqlite:///./shards/na.db,EMEA=sqlite:///./shards/emea.db,APAC|Japan=sqlite:///./shards/apac.db
+
+An entry is territory[|territory...]=url and is named after its first territory.
+Customers without a sales rep, or of a territory no entry lists, go to SHARD_DEFAULT
+(the first shard by default). Without SHARDS everything stays in the home database.
+
+Writes are not atomic across databases. A session writing sharded rows commits the
+shard and the home database (change feed, table versions, stock) one after the other,
+in no fixed order, and a new customer's or order's directory entry is committed before
+both, in a transaction of its own. A failure between these commits leaves:
+
+- a dangling directory entry (the row was never written): lookups find no row;
+- changes and version bumps at home for a write the shard does not have;
+- or a shard write without its changes and version bumps: the change feed misses it
+  and caches serve the old data until their TTL.
+
+`python -m scripts.shard_data --reconcile` deletes dangling entries, adds the entries
+of rows that have none, logs a "delete" for changed rows that do not exist and bumps
+the versions of the sharded tables. A missing change cannot be detected afterwards.
+"""
+import contextvars
+import heapq
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, TypeVar
+
+from sqlalchemy import Table, create_engine, delete, event, func, insert, select, tuple_, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
+
+from database.base import Base, engine as home_engine
+from models.models import Employee, Office, ShardKey, ShardSequence
+
+logger = logging.getLogger(__name__)
+
+SHARDS = os.getenv("SHARDS", "")
+SHARD_DEFAULT = os.getenv("SHARD_DEFAULT", "")
+# Threads running the per-shard queries of fanned-out reads, shared by all requests
+SHARD_FANOUT_WORKERS = int(os.getenv("SHARD_FANOUT_WORKERS", "16"))
+SHARD_DIRECTORY_CACHE_SIZE = int(os.getenv("SHARD_DIRECTORY_CACHE_SIZE", "100000"))
+
+SHARDED_TABLES = ("customers", "orders", "orderdetails", "payments")
+# Parents first, the order replicas are written in
+REPLICATED_TABLES = ("offices", "employees", "productlines", "products")
+
+# Sharded table -> (directory naming its shard, column of the row holding the directory key)
+SHARD_KEYS = {
+    "customers": ("customers", "customerNumber"),
+    "orders": ("orders", "orderNumber"),
+    "orderdetails": ("orders", "orderNumber"),
+    "payments": ("customers", "customerNumber"),
+}
+# New rows go to the shard of their parent (customers: of their sales rep's territory)
+PARENT_KEYS = {
+    "orders": ("customers", "customerNumber"),
+    "orderdetails": ("orders", "orderNumber"),
+    "payments": ("customers", "customerNumber"),
+}
+# Tables whose rows get a directory entry (and their number from the home sequence)
+DIRECTORIES = ("customers", "orders")
+
+# session.info keys: shard of a shard session, shard sessions opened for a session,
+# reference rows written in the session's open transaction
+SHARD = "shard"
+SHARD_SESSIONS = "shard_sessions"
+REPLICATED_ROWS = "replicated_rows"
+
+T = TypeVar("T")
+
+def parse_shards(spec: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """
+    "NA=url,APAC|Japan=url" -> ({shard: url}, {territory: shard})
+    """
+    urls: Dict[str, str] = {}
+    territories: Dict[str, str] = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        names, _, url = entry.partition("=")
+        names = [name.strip() for name in names.split("|") if name.strip()]
+        if not names or not url.strip():
+            raise ValueError(f"Invalid SHARDS entry: {entry} (use territory[|territory...]=url)")
+        urls[names[0]] = url.strip()
+        for territory in names:
+            territories[territory] = names[0]
+    return urls, territories
+
+def key_criteria(table: Table, keys: Iterable[Tuple]):
+    columns = list(table.primary_key)
+    keys = list(keys)
+    if len(columns) == 1:
+        return columns[0].in_([key[0] for key in keys])
+    return tuple_(*columns).in_(keys)
+
+class ShardRouter:
+    def __init__(self, urls: Dict[str, str], territories: Dict[str, str], default: Optional[str] = None,
+                 home: Engine = home_engine, workers: int = SHARD_FANOUT_WORKERS):
+        if not urls:
+            raise ValueError("No shards configured")
+        self.engines: Dict[str, Engine] = {
+            # SQLite connections are shared across the fan-out threads
+            name: create_engine(url, connect_args={"check_same_thread": False} if url.startswith("sqlite") else {})
+            for name, url in urls.items()
+        }
+        self.names = list(self.engines)
+        self.territories = territories
+        self.default = default or self.names[0]
+        if self.default not in self.engines:
+            raise ValueError(f"SHARD_DEFAULT {self.default} is not one of the shards ({', '.join(self.names)})")
+        self.home = home
+        self.workers = workers
+        self._directory: Dict[Tuple[str, Any], str] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def create_schema(self):
+        tables = [Base.metadata.tables[name] for name in REPLICATED_TABLES + SHARDED_TABLES]
+        for engine in self.engines.values():
+            Base.metadata.create_all(bind=engine, tables=tables)
+
+    def session(self, db: Session, shard: str, local: bool = False) -> Session:
+        """
+        Session of one shard, opened for `db` and closed with it (close_sessions). The
+        sharded tables are bound to the shard and everything else to the database of
+        `db`, so a write records its changes and table versions at home in the same
+        session; local sessions read the shard alone, reference replicas included.
+        """
+        sessions = db.info.setdefault(SHARD_SESSIONS, {})
+        session = sessions.get((shard, local))
+        if session is None:
+            engine = self.engines[shard]
+            if local:
+                session = Session(bind=engine, autoflush=False)
+            else:
+                binds = {Base.metadata.tables[name]: engine for name in SHARDED_TABLES}
+                session = Session(bind=db.get_bind(), binds=binds, autoflush=False)
+            session.info[SHARD] = shard
+            sessions[(shard, local)] = session
+        return session
+
+    def fan_out(self, db: Session, call: Callable[[Session], T], local: bool = False) -> List[T]:
+        """
+        call(session) on every shard in parallel, one thread and session per shard;
+        results in shard order
+        """
+        sessions = [self.session(db, name, local) for name in self.names]
+        if len(sessions) == 1:
+            return [call(sessions[0])]
+        # Each call runs in a copy of the caller's context, so the request's query deadline and statistics apply
+        futures = [self._pool().submit(contextvars.copy_context().run, call, session) for session in sessions]
+        return [future.result() for future in futures]
+
+    def shard_of(self, db: Session, directory: str, key) -> Optional[str]:
+        """
+        Shard of a customer or order number (None: unknown); cached, as entries only change when a
+        dangling one is taken over
+        """
+        shard = self._directory.get((directory, key))
+        if shard is None:
+            shard = db.execute(
+                select(ShardKey.shard).where(ShardKey.tableName == directory, ShardKey.keyValue == key)
+            ).scalar()
+            if shard is not None:
+                self._remember(directory, key, shard)
+        return shard
+
+    def shard_of_row(self, db: Session, table_name: str, row: Mapping[str, Any]) -> Optional[str]:
+        directory, column = SHARD_KEYS[table_name]
+        return self.shard_of(db, directory, row[column])
+
+    def place(self, db: Session, table_name: str, data: Dict[str, Any]) -> Session:
+        """
+        Session of the shard a new row of `table_name` goes to. New customers and orders
+        get their number from the home sequence (filled into `data` unless given) and a
+        directory entry, committed first (register).
+        """
+        if table_name == "customers":
+            shard = self.territory_shard(db, data.get("salesRepEmployeeNumber"))
+        else:
+            directory, column = PARENT_KEYS[table_name]
+            # An unknown parent fails (or not) on the default shard as it would in one database
+            shard = self.shard_of(db, directory, data.get(column)) or self.default
+        if table_name in DIRECTORIES:
+            column = SHARD_KEYS[table_name][1]
+            if data.get(column) is None:
+                data[column] = self.allocate(table_name)
+            shard = self.register(table_name, data[column], shard)
+        return self.session(db, shard)
+
+    def register(self, directory: str, key, shard: str) -> str:
+        """
+        Commits the directory entry of a new customer/order in a transaction of its own,
+        before the row is written, so no row is ever without its entry. Returns the shard
+        the row goes to: that of an existing entry whose row exists, so a duplicate number
+        fails there as it would in one database. A dangling entry (left by a write that
+        rolled back or never committed) is taken over.
+        """
+        with self.home.begin() as conn:
+            current = conn.execute(
+                select(ShardKey.shard).where(ShardKey.tableName == directory, ShardKey.keyValue == key)
+            ).scalar()
+            if current is None:
+                conn.execute(insert(ShardKey).values(tableName=directory, keyValue=key, shard=shard))
+            elif current != shard:
+                if self.has_row(current, directory, key):
+                    return current
+                conn.execute(
+                    update(ShardKey).where(ShardKey.tableName == directory, ShardKey.keyValue == key).values(shard=shard)
+                )
+        self._remember(directory, key, shard)
+        return shard
+
+    def has_row(self, shard: str, directory: str, key) -> bool:
+        column = Base.metadata.tables[directory].c[SHARD_KEYS[directory][1]]
+        with self.engines[shard].connect() as conn:
+            return conn.execute(select(column).where(column == key)).first() is not None
+
+    def territory_shard(self, db: Session, employee_number: Optional[int]) -> str:
+        if employee_number is None:
+            return self.default
+        territory = db.execute(
+            select(Office.territory).join(Employee, Employee.officeCode == Office.officeCode)
+            .where(Employee.employeeNumber == employee_number)
+        ).scalar()
+        return self.territories.get(territory, self.default)
+
+    def allocate(self, table_name: str) -> int:
+        """
+        Next customer/order number, taken in a short transaction of its own so the
+        sequence row is not locked for the caller's whole transaction (a rollback
+        leaves a gap, like AUTO_INCREMENT)
+        """
+        for _ in range(3):
+            try:
+                with self.home.begin() as conn:
+                    bumped = conn.execute(
+                        update(ShardSequence).where(ShardSequence.tableName == table_name)
+                        .values(lastValue=ShardSequence.lastValue + 1)
+                    ).rowcount
+                    if not bumped:
+                        last = conn.execute(
+                            select(func.max(ShardKey.keyValue)).where(ShardKey.tableName == table_name)
+                        ).scalar() or 0
+                        conn.execute(insert(ShardSequence).values(tableName=table_name, lastValue=last + 1))
+                    return conn.execute(
+                        select(ShardSequence.lastValue).where(ShardSequence.tableName == table_name)
+                    ).scalar()
+            except IntegrityError:
+                # Another worker created the sequence row first
+                continue
+        raise RuntimeError(f"Could not allocate a {table_name} number")
+
+    def replicate(self, written: Mapping[str, Optional[Iterable[Tuple]]]):
+        """
+        Copies the current home rows of the written keys to every shard (None: the whole
+        table); keys without a home row are deleted from the replicas. Rows are updated
+        in place rather than deleted and re-inserted, so no ON DELETE rule fires.
+        """
+        batches = []
+        with self.home.connect() as conn:
+            for name in REPLICATED_TABLES:
+                if name not in written:
+                    continue
+                table = Base.metadata.tables[name]
+                keys = written[name]
+                statement = select(table) if keys is None else select(table).where(key_criteria(table, keys))
+                rows = [dict(row) for row in conn.execute(statement).mappings()]
+                batches.append((table, keys, rows))
+        columns = {table.name: [column.name for column in table.primary_key] for table, _, _ in batches}
+        for engine in self.engines.values():
+            with engine.begin() as conn:
+                for table, keys, rows in batches:
+                    present = {tuple(row[name] for name in columns[table.name]) for row in rows}
+                    if keys is None:
+                        stale = {tuple(row) for row in conn.execute(select(*table.primary_key))} - present
+                    else:
+                        stale = set(keys) - present
+                    for row in rows:
+                        criteria = [column == row[column.name] for column in table.primary_key]
+                        if not conn.execute(update(table).where(*criteria).values(**row)).rowcount:
+                            conn.execute(insert(table).values(**row))
+                    if stale:
+                        conn.execute(delete(table).where(key_criteria(table, stale)))
+
+    def _remember(self, directory: str, key, shard: str):
+        with self._lock:
+            if len(self._directory) >= SHARD_DIRECTORY_CACHE_SIZE:
+                self._directory.pop(next(iter(self._directory)))
+            self._directory[(directory, key)] = shard
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="shard-fanout")
+        return self._executor
+
+def _from_env() -> Optional[ShardRouter]:
+    if not SHARDS.strip():
+        return None
+    urls, territories = parse_shards(SHARDS)
+    return ShardRouter(urls, territories, SHARD_DEFAULT or None)
+
+# None without SHARDS
+router: Optional[ShardRouter] = _from_env()
+
+def router_for(db: Session, table_name: Optional[str] = None) -> Optional[ShardRouter]:
+    """
+    The router, for sessions of the home database (not of a shard) and, when given, a sharded table
+    """
+    if router is None or SHARD in db.info or (table_name is not None and table_name not in SHARDED_TABLES):
+        return None
+    return router
+
+def same_database(db: Session, *tables: Table) -> bool:
+    return len({db.get_bind(clause=table) for table in tables}) == 1
+
+def close_sessions(db: Session):
+    for session in db.info.pop(SHARD_SESSIONS, {}).values():
+        session.close()
+
+def note_written(db: Session, table: Table, keys: Iterable[Tuple]):
+    """
+    Notes reference rows written in the session's transaction, copied to the shards after commit
+    """
+    if router is not None and table.name in REPLICATED_TABLES:
+        db.info.setdefault(REPLICATED_ROWS, {}).setdefault(table.name, set()).update(keys)
+
+@event.listens_for(Session, "after_commit")
+def _replicate_written(session: Session):
+    written = session.info.pop(REPLICATED_ROWS, None)
+    if not written or router is None:
+        return
+    try:
+        router.replicate(written)
+    except Exception:
+        # The home commit stands; the replicas catch up with scripts/shard_data.py --sync-reference
+        logger.exception(f"Replicating {', '.join(sorted(written))} to the shards failed")
+
+@event.listens_for(Session, "after_rollback")
+def _forget_written(session: Session):
+    session.info.pop(REPLICATED_ROWS, None)
+
+class _Descending:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other: "_Descending") -> bool:
+        return other.value < self.value
+
+    def __eq__(self, other) -> bool:
+        return self.value == other.value
+
+def sort_columns(order_by: List[Any]) -> List[Tuple[str, bool]]:
+    """
+    ORM columns, optionally .asc()/.desc() -> [(attribute name, descending)]
+    """
+    columns = []
+    for clause in order_by:
+        descending = isinstance(clause, UnaryExpression) and clause.modifier is operators.desc_op
+        column = clause.element if isinstance(clause, UnaryExpression) else clause
+        columns.append((column.key, descending))
+    return columns
+
+def merge_sorted(results: List[List[Any]], order_by: List[Any], skip: int = 0, limit: Optional[int] = None) -> List[Any]:
+    """
+    One page out of per-shard results that are each sorted by `order_by` and hold
+    (at least) their first skip + limit rows
+    """
+    columns = sort_columns(order_by)
+
+    def key(item) -> Tuple:
+        values = []
+        for name, descending in columns:
+            value = getattr(item, name)
+            # NULLs first ascending and last descending, as MySQL and SQLite sort them
+            value = (value is not None, value)
+            values.append(_Descending(value) if descending else value)
+        return tuple(values)
+    return list(islice(heapq.merge(*results, key=key), skip, None if limit is None else skip + limit))
+
+def merge_groups(results: List[Iterable[Mapping[str, Any]]], key: str, sums: List[str]) -> List[Dict[str, Any]]:
+    """
+    Per-shard rows grouped by `key` -> one row per key with the `sums` columns added up, in key order
+    """
+    merged: Dict[Any, Dict[str, Any]] = {}
+    for rows in results:
+        for row in rows:
+            current = merged.get(row[key])
+            if current is None:
+                merged[row[key]] = dict(row)
+                continue
+            for name in sums:
+                current[name] = (current[name] or 0) + (row[name] or 0)
+    return [merged[value] for value in sorted(merged)]
@@ -0,0 +1,201 @@
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+import logging
+import os
+import re
+import time
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from metrics.metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Default deadline for all statements of one request, in milliseconds (0 disables it)
+QUERY_TIMEOUT_MS = int(os.getenv("QUERY_TIMEOUT_MS", "10000"))
+
+# Per-route overrides, "path fragment=ms" pairs matched in order against the route path,
+# e.g. QUERY_TIMEOUT_ROUTES="/paginated=20000,/orderdetails=3000"
+QUERY_TIMEOUT_ROUTES: List[Tuple[str, int]] = [
+    (fragment.strip(), int(ms))
+    for fragment, _, ms in (pair.partition("=") for pair in os.getenv("QUERY_TIMEOUT_ROUTES", "").split(","))
+    if fragment.strip() and ms.strip()
+]
+
+# SQLite calls the progress handler every this many virtual machine instructions
+SQLITE_PROGRESS_STEPS = 1000
+
+# MySQL errors for MAX_EXECUTION_TIME exceeded and KILL QUERY
+_MYSQL_INTERRUPTED = {3024, 1317}
+_SELECT = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+
+query_timeouts = Counter("query_timeouts_total", "Requests answered with 504 after a query deadline", ("endpoint",))
+queries_cancelled = Counter("queries_cancelled_total", "Requests whose queries were cancelled after the client disconnected")
+
+
+class QueryTimeout(Exception):
+    """
+    A statement ran past the request's query deadline (answered with 504)
+    """
+
+
+class QueryCancelled(Exception):
+    """
+    A statement was interrupted because the client went away
+    """
+
+
+class QueryDeadline:
+    """
+    Query deadline and cancellation state of one request. The timeout is resolved at the
+    first statement, when routing has run and the route path is known.
+    """
+
+    def __init__(self, scope: Dict):
+        self.scope = scope
+        self.started = time.monotonic()
+        self.cancelled = False
+        self._deadline: Optional[float] = None
+        self._resolved = False
+        # DBAPI connections currently executing a statement for this request
+        self.running: List = []
+
+    @property
+    def endpoint(self) -> str:
+        route = self.scope.get("route")
+        return f"{self.scope.get('method')} {route.path if route else self.scope.get('path')}"
+
+    def deadline(self) -> Optional[float]:
+        if not self._resolved:
+            route = self.scope.get("route")
+            self._deadline = resolve_timeout(route.path if route else self.scope.get("path", ""))
+            if self._deadline is not None:
+                self._deadline = self.started + self._deadline
+            self._resolved = True
+        return self._deadline
+
+    def remaining(self) -> Optional[float]:
+        deadline = self.deadline()
+        return None if deadline is None else deadline - time.monotonic()
+
+    def expired(self) -> bool:
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def cancel(self, engine: Engine):
+        """
+        Interrupts the statements running for this request. Blocking (MySQL needs a
+        second connection for KILL QUERY), so call it from a worker thread.
+        """
+        self.cancelled = True
+        for dbapi_connection in list(self.running):
+            if hasattr(dbapi_connection, "interrupt"):
+                # sqlite3: safe to call from another thread
+                dbapi_connection.interrupt()
+                continue
+            connection_id = getattr(dbapi_connection, "connection_id", None)
+            if connection_id is None:
+                continue
+            try:
+                with engine.connect() as conn:
+                    conn.execute(text(f"KILL QUERY {int(connection_id)}"))
+            except Exception as e:
+                logger.warning(f"Could not cancel query on connection {connection_id}: {e}")
+
+
+_current_deadline: ContextVar[Optional[QueryDeadline]] = ContextVar("query_deadline", default=None)
+
+
+def resolve_timeout(path: str) -> Optional[float]:
+    """
+    Timeout in seconds for a route path, or None when it has no deadline
+    """
+    timeout_ms = QUERY_TIMEOUT_MS
+    for fragment, ms in QUERY_TIMEOUT_ROUTES:
+        if fragment in path:
+            timeout_ms = ms
+            break
+    return timeout_ms / 1000 if timeout_ms > 0 else None
+
+
+def current_deadline() -> Optional[QueryDeadline]:
+    return _current_deadline.get()
+
+
+def start_request(scope: Dict) -> Tuple[QueryDeadline, object]:
+    state = QueryDeadline(scope)
+    return state, _current_deadline.set(state)
+
+
+def end_request(token):
+    _current_deadline.reset(token)
+
+
+def _sqlite_progress_handler() -> int:
+    # Runs in the thread executing the statement, so it sees that request's context
+    state = _current_deadline.get()
+    if state is not None and (state.cancelled or state.expired()):
+        return 1
+    return 0
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    state = _current_deadline.get()
+    if state is None:
+        return statement, parameters
+    if state.cancelled:
+        raise QueryCancelled(state.endpoint)
+    remaining = state.remaining()
+    if remaining is not None and remaining <= 0:
+        raise QueryTimeout(state.endpoint)
+
+    dbapi_connection = conn.connection.dbapi_connection
+    state.running.append(dbapi_connection)
+    if conn.dialect.name == "sqlite":
+        if not conn.connection.info.get("progress_handler"):
+            dbapi_connection.set_progress_handler(_sqlite_progress_handler, SQLITE_PROGRESS_STEPS)
+            conn.connection.info["progress_handler"] = True
+    elif conn.dialect.name == "mysql" and remaining is not None and _SELECT.match(statement):
+        # Optimizer hint, only honoured for SELECT; writes are bounded by KILL QUERY on disconnect
+        statement = _SELECT.sub(f"SELECT /*+ MAX_EXECUTION_TIME({max(1, int(remaining * 1000))}) */", statement, count=1)
+    return statement, parameters
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _forget(conn)
+
+
+def _forget(conn):
+    state = _current_deadline.get()
+    if state is not None and conn.connection.dbapi_connection in state.running:
+        state.running.remove(conn.connection.dbapi_connection)
+
+
+def interrupted(error: BaseException) -> bool:
+    """
+    The DBAPI error of a statement stopped by the deadline or a cancellation
+    """
+    return "interrupted" in str(error).lower() or getattr(error, "errno", None) in _MYSQL_INTERRUPTED
+
+
+def _handle_error(context):
+    state = _current_deadline.get()
+    if state is None or context.connection is None:
+        return None
+    _forget(context.connection)
+    if not interrupted(context.original_exception):
+        return None
+    if state.cancelled:
+        return QueryCancelled(state.endpoint)
+    return QueryTimeout(state.endpoint)
+
+
+def install(target=Engine):
+    """
+    Hook the deadline and cancellation events on `target` (every engine by default)
+    """
+    if not event.contains(target, "before_cursor_execute", _before_cursor_execute):
+        event.listen(target, "before_cursor_execute", _before_cursor_execute, retval=True)
+        event.listen(target, "after_cursor_execute", _after_cursor_execute)
+        event.listen(target, "handle_error", _handle_error)
@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Set
+
+from metrics.metrics import Counter, Gauge
+
+logger = logging.getLogger(__name__)
+
+# Push of order changes to dashboards (GET /api/v1/orders/events, server-sent events).
+# The hub is per worker process: with several uvicorn workers a client only sees the
+# writes handled by the worker it is connected to.
+
+# Events a subscriber may have waiting; one that falls further behind is disconnected
+EVENTS_QUEUE_SIZE = int(os.getenv("ORDER_EVENTS_QUEUE_SIZE", "256"))
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv("ORDER_EVENTS_MAX_SUBSCRIBERS", "10000"))
+# Idle streams get a comment line this often so proxies do not close them
+EVENTS_KEEPALIVE_SECONDS = float(os.getenv("ORDER_EVENTS_KEEPALIVE_SECONDS", "15"))
+# Events written to the stream in one chunk when a subscriber has a backlog
+EVENTS_BATCH_SIZE = 64
+KEEPALIVE = ": keepalive\n\n"
+
+subscribers_gauge = Gauge("order_event_subscribers", "Open order event streams")
+events_published = Counter("order_events_published_total", "Order events published", ("type",))
+events_delivered = Counter("order_events_delivered_total", "Order events queued for a subscriber")
+slow_consumers = Counter("order_event_slow_consumers_total", "Streams closed because the subscriber fell behind")
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    def __init__(self, customer_number: Optional[int], statuses: Optional[Iterable[str]], max_queue: int):
+        self.customer_number = customer_number
+        self.statuses = frozenset(statuses) if statuses else None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        # A status filter also sees the change that moves an order out of the status
+        return self.statuses is None or event["status"] in self.statuses or event.get("previousStatus") in self.statuses
+
+
+class EventHub:
+    """
+    In-process fan-out of order events. publish() may be called from any thread (sync
+    endpoints run in the threadpool); delivery runs on the event loop. Each event is
+    encoded once for all subscribers, and subscribers are indexed by customer so an
+    event only visits the streams that can match it. Every subscriber has a bounded
+    queue: one that falls behind is dropped with an overflow event instead of slowing
+    down publishing or growing memory.
+    """
+
+    def __init__(self, max_queue: int = EVENTS_QUEUE_SIZE, max_subscribers: int = EVENTS_MAX_SUBSCRIBERS):
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self.count = 0
+        # customerNumber -> subscriptions; None holds the ones without a customer filter
+        self._by_customer: Dict[Optional[int], Set[Subscription]] = defaultdict(set)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._keepalive: Optional[asyncio.Task] = None
+
+    @property
+    def active(self) -> bool:
+        return self.count > 0
+
+    def subscribe(self, customer_number: Optional[int] = None, statuses: Optional[Iterable[str]] = None) -> Subscription:
+        if self.count >= self.max_subscribers:
+            raise TooManySubscribers()
+        self._loop = asyncio.get_running_loop()
+        if self._keepalive is None or self._keepalive.done():
+            self._keepalive = self._loop.create_task(self._send_keepalives())
+        subscription = Subscription(customer_number, statuses, self.max_queue)
+        self._by_customer[customer_number].add(subscription)
+        self.count += 1
+        subscribers_gauge.set(self.count)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        group = self._by_customer.get(subscription.customer_number)
+        if group is None or subscription not in group:
+            return
+        group.discard(subscription)
+        if not group:
+            del self._by_customer[subscription.customer_number]
+        self.count -= 1
+        subscribers_gauge.set(self.count)
+
+    def publish(self, event_type: str, order: Dict[str, Any], previous_status: Optional[str] = None):
+        """
+        Queues an order event for delivery; a no-op while nobody is subscribed
+        """
+        loop = self._loop
+        if not self.count or loop is None:
+            return
+        event = {"type": event_type, **order}
+        if previous_status is not None:
+            event["previousStatus"] = previous_status
+        frame = _frame(event_type, json.dumps(event, default=str))
+        events_published.inc(type=event_type)
+        try:
+            loop.call_soon_threadsafe(self._dispatch, event, frame)
+        except RuntimeError:
+            # Event loop already closed (shutdown)
+            pass
+
+    def _dispatch(self, event: Dict[str, Any], frame: str):
+        delivered = 0
+        for customer_number in (event.get("customerNumber"), None):
+            for subscription in list(self._by_customer.get(customer_number, ())):
+                if not subscription.matches(event):
+                    continue
+                try:
+                    subscription.queue.put_nowait(frame)
+                    delivered += 1
+                except asyncio.QueueFull:
+                    self._drop(subscription)
+        if delivered:
+            events_delivered.inc(delivered)
+
+    async def _send_keepalives(self):
+        # One timer for all streams instead of a timeout around every queue read
+        while self.count:
+            await asyncio.sleep(EVENTS_KEEPALIVE_SECONDS)
+            for group in list(self._by_customer.values()):
+                for subscription in list(group):
+                    if subscription.queue.empty():
+                        subscription.queue.put_nowait(KEEPALIVE)
+    
+    def _drop(self, subscription: Subscription):
+        # The stream sees the flag at its next read, skips the backlog and closes
+        subscription.overflowed = True
+        self.unsubscribe(subscription)
+        slow_consumers.inc()
+        logger.warning(f"Dropping slow order event subscriber (customer={subscription.customer_number})")
+
+
+def _frame(event_type: str, payload: str) -> str:
+    return f"event: {event_type}\ndata: {payload}\n\n"
+
+
+async def stream(subscription: Subscription, hub: "EventHub") -> AsyncIterator[str]:
+    """
+    Server-sent events for one subscription; unsubscribes when the client goes away
+    """
+    try:
+        yield ": subscribed\n\n"
+        while True:
+            frame = await subscription.queue.get()
+            if subscription.overflowed:
+                yield _frame("overflow", json.dumps({"detail": "Too far behind, reload the orders and reconnect"}))
+                return
+            frames = [frame]
+            while len(frames) < EVENTS_BATCH_SIZE and not subscription.queue.empty():
+                frames.append(subscription.queue.get_nowait())
+            yield "".join(frames)
+    finally:
+        hub.unsubscribe(subscription)
+
+
+hub = EventHub()
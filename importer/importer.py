@@ -0,0 +1,404 @@
+import csv
+import hashlib
+import io
+import itertools
+import logging
+import os
+import re
+import time
+from datetime import date, datetime
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Column, Table
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from database.base import Base
+from models.models import Customer, Employee, Office, Order, OrderDetail, Payment, Product, ProductLine
+from repositories.repositories import ImportCheckpointRepository, OrderRepository, TableVersionRepository
+
+logger = logging.getLogger(__name__)
+
+# Bulk import of SQL dumps (INSERT statements, like data_dump.sql or mysqldump output) and
+# CSV files (one table per file, header row with column names) into the ClassicModels
+# tables. Files are parsed as streams, rows go in with batched multi-row INSERTs, and the
+# progress per table is committed with every chunk, so an interrupted import resumes
+# after the last committed chunk when the same files are imported again.
+
+IMPORT_TABLES = {
+    model.__tablename__: model.__table__
+    for model in (Customer, Employee, Office, Order, OrderDetail, Product, ProductLine, Payment)
+}
+# Parents before children: offices, productlines, employees, products, customers, orders, payments, orderdetails
+IMPORT_ORDER = [table.name for table in Base.metadata.sorted_tables if table.name in IMPORT_TABLES]
+
+READ_CHUNK_BYTES = 1 << 20
+# CSV null marker (MySQL's); empty fields are null too in nullable columns
+CSV_NULL = "\\N"
+
+
+class InvalidImportFile(Exception):
+    pass
+
+
+class ImportConflict(Exception):
+    """
+    The database rejected a chunk of rows (duplicate keys, missing parent rows)
+    """
+
+
+class Source:
+    """
+    One input file as a binary stream: a SQL dump, or a CSV file holding one table
+    """
+
+    def __init__(self, name: str, stream: BinaryIO, table: Optional[str] = None):
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in (".sql", ".csv"):
+            raise InvalidImportFile(f"{name}: expected a .sql or .csv file")
+        self.name = name
+        self.stream = stream
+        self.format = extension[1:]
+        self.table = table or (os.path.splitext(os.path.basename(name))[0] if self.format == "csv" else None)
+        if self.table is not None and self.table not in IMPORT_TABLES:
+            raise InvalidImportFile(f"{name}: unknown table {self.table}")
+
+
+def import_id(sources: List[Source]) -> str:
+    """
+    Identifies an import by the content of its files, so importing them again resumes it
+    """
+    digest = hashlib.sha256()
+    for source in sources:
+        digest.update(f"{source.format}:{source.table}:".encode())
+        source.stream.seek(0)
+        for chunk in iter(lambda: source.stream.read(READ_CHUNK_BYTES), b""):
+            digest.update(chunk)
+        source.stream.seek(0)
+    return digest.hexdigest()[:32]
+
+
+# --- Values ---
+
+def _converter(column: Column) -> Callable[[str], Any]:
+    python_type = column.type.python_type
+    if python_type is int:
+        return int
+    if python_type is float:
+        return float
+    if python_type is date:
+        return lambda value: date.fromisoformat(value[:10])
+    if python_type is datetime:
+        return datetime.fromisoformat
+    return str
+
+
+def _row_builder(table: Table, columns: List[str], source: str) -> Callable[[List[Optional[str]], int], Dict[str, Any]]:
+    unknown = [name for name in columns if name not in table.c]
+    if unknown:
+        raise InvalidImportFile(f"{source}: unknown column(s) for {table.name}: {', '.join(unknown)}")
+    converters = [_converter(table.c[name]) for name in columns]
+
+    def build(values: List[Optional[str]], number: int) -> Dict[str, Any]:
+        if len(values) != len(columns):
+            raise InvalidImportFile(f"{source}: {table.name} row {number} has {len(values)} values, expected {len(columns)}")
+        try:
+            return {
+                name: None if value is None else convert(value)
+                for name, convert, value in zip(columns, converters, values)
+            }
+        except ValueError as e:
+            raise InvalidImportFile(f"{source}: {table.name} row {number}: {e}")
+    return build
+
+
+# --- CSV ---
+
+def _csv_rows(source: Source) -> Iterator[Dict[str, Any]]:
+    table = IMPORT_TABLES[source.table]
+    source.stream.seek(0)
+    text = io.TextIOWrapper(source.stream, encoding="utf-8-sig", newline="")
+    try:
+        reader = csv.reader(text)
+        header = next(reader, None)
+        if not header:
+            return
+        header = [name.strip() for name in header]
+        build = _row_builder(table, header, source.name)
+        nullable = [table.c[name].nullable for name in header]
+        for number, values in enumerate(reader, start=1):
+            values = [
+                None if value == CSV_NULL or (value == "" and is_nullable) else value
+                for value, is_nullable in zip(values, nullable)
+            ] if len(values) == len(header) else values
+            yield build(values, number)
+    finally:
+        # Leave the underlying stream open for the caller
+        text.detach()
+
+
+# --- SQL dumps ---
+
+_STRING = rb"'(?:[^'\\]|\\.|'')*+'"
+_NAME = rb'`[^`]++`|"[^"]++"|\w++'
+_COMMENT = rb"--[^\n]*+\n|\#[^\n]*+\n|/\*.*?\*/"
+# One statement up to its ;, skipping over strings, quoted names and comments. A
+# statement cut off at the end of the buffer does not match (possessive, no backtracking).
+_STATEMENT = re.compile(
+    rb"(?:[^'\"`;/\#-]++|" + _STRING + rb'|"(?:[^"\\]|\\.)*+"|`[^`]*+`|' + _COMMENT + rb"|-(?!-)|/(?!\*))*+;",
+    re.DOTALL,
+)
+_BLANK = re.compile(rb"(?:\s++|--[^\n]*+\n?|\#[^\n]*+\n?|/\*.*?\*/)*+", re.DOTALL)
+# INSERT [IGNORE] INTO [schema.]table [(column, ...)] VALUES
+_INSERT_HEAD = re.compile(
+    rb"(?:\s++|" + _COMMENT + rb")*+(?:INSERT|REPLACE)\s++(?:(?:LOW_PRIORITY|DELAYED|HIGH_PRIORITY|IGNORE)\s++)*+INTO\s*+"
+    rb"(?:(?:" + _NAME + rb")\s*+\.\s*+)?(" + _NAME + rb")\s*+(?:\(([^)]*+)\)\s*+)?VALUES?\s*+",
+    re.IGNORECASE | re.DOTALL,
+)
+_VALUE = re.compile(_STRING + rb"|[^\s,'()]++")
+# One parenthesized row of literals and the , or ; after it
+_ROW = re.compile(rb"\s*+\(\s*+((?:(?:" + _STRING + rb"|[^\s,'()]++)\s*+(?:,\s*+)?)*+)\)\s*+(,|;|\Z)")
+_LITERALS = {b"NULL": None, b"null": None, b"TRUE": "1", b"true": "1", b"FALSE": "0", b"false": "0"}
+
+_ESCAPES = {b"0": b"\0", b"b": b"\b", b"n": b"\n", b"r": b"\r", b"t": b"\t", b"Z": b"\x1a"}
+_ESCAPE = re.compile(rb"\\(.)|''", re.DOTALL)
+
+
+def _unescape(token: bytes) -> str:
+    body = token[1:-1]
+    if b"\\" in body or b"''" in body:
+        body = _ESCAPE.sub(lambda m: _ESCAPES.get(m.group(1), m.group(1)) if m.group(1) is not None else b"'", body)
+    return body.decode("utf-8")
+
+
+def _identifier(token: bytes) -> str:
+    return token.strip().strip(b'`"').decode("utf-8")
+
+
+def _statements(stream: BinaryIO, offset: int = 0) -> Iterator[Tuple[int, bytes]]:
+    """
+    (byte offset, text) of every statement from offset on, reading the stream in chunks.
+    A statement is only taken once its terminating ; is in the buffer.
+    """
+    stream.seek(offset)
+    buffer = b""
+    pos = 0
+    eof = False
+    while True:
+        match = _STATEMENT.match(buffer, pos)
+        if match is not None:
+            yield offset + pos, match.group()
+            pos = match.end()
+            continue
+        if eof:
+            if _BLANK.fullmatch(buffer, pos) is None:
+                # Last statement without ;
+                yield offset + pos, buffer[pos:]
+            return
+        # Read at least as much as is left over, so a long statement is rescanned only a few times
+        chunk = stream.read(max(READ_CHUNK_BYTES, len(buffer) - pos))
+        offset += pos
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        eof = not chunk
+
+
+def _positional_columns(table: Table, count: int, source: str) -> List[str]:
+    # INSERT without a column list: the values are the leading columns in model order, the
+    # columns left out must have a default (dumps made before the orders' totals existed)
+    columns = list(table.columns)
+    omitted = columns[count:]
+    if count > len(columns) or any(column.default is None and not column.nullable for column in omitted):
+        raise InvalidImportFile(f"{source}: {table.name} rows have {count} values, expected {len(columns)}")
+    return [column.name for column in columns[:count]]
+
+
+def scan_sql(stream: BinaryIO) -> Dict[str, List[int]]:
+    """
+    First pass over a dump: byte offsets of every INSERT statement, by table. Other
+    statements (CREATE, DROP, SET, ...) are skipped; the schema comes from the models.
+    """
+    offsets: Dict[str, List[int]] = {}
+    for offset, statement in _statements(stream):
+        head = _INSERT_HEAD.match(statement)
+        if head is not None:
+            offsets.setdefault(_identifier(head.group(1)), []).append(offset)
+    return offsets
+
+
+def _sql_rows(source: Source, table: Table, offsets: List[int]) -> Iterator[Dict[str, Any]]:
+    """
+    Rows of the table's INSERT statements; the statements of other tables between them are skipped
+    """
+    wanted = set(offsets)
+    builders: Dict[Any, Callable[[List[Optional[str]], int], Dict[str, Any]]] = {}
+    number = 0
+    for offset, statement in _statements(source.stream, offsets[0]):
+        if offset not in wanted:
+            continue
+        head = _INSERT_HEAD.match(statement)
+        columns = tuple(_identifier(name) for name in head.group(2).split(b",")) if head.group(2) else None
+        pos = head.end()
+        while True:
+            row = _ROW.match(statement, pos)
+            if row is None:
+                raise InvalidImportFile(f"{source.name}: cannot parse {table.name} values at byte {offset + pos}")
+            values = [
+                _unescape(value) if value[0] == 39 else _LITERALS[value] if value in _LITERALS else value.decode()
+                for value in _VALUE.findall(row.group(1))
+            ]
+            key = columns or len(values)
+            build = builders.get(key)
+            if build is None:
+                build = builders[key] = _row_builder(
+                    table, list(columns) if columns else _positional_columns(table, len(values), source.name), source.name
+                )
+            number += 1
+            yield build(values, number)
+            pos = row.end()
+            if row.group(2) != b",":
+                break
+        if offset == offsets[-1]:
+            return
+
+
+# --- Loading ---
+
+def _batched(rows: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    while True:
+        batch = list(itertools.islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class TableResult:
+    def __init__(self, table: str, resumed_from: int = 0):
+        self.table = table
+        self.resumed_from = resumed_from
+        self.rows = 0
+        self.seconds = 0.0
+        self.skipped = False
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "table": self.table, "rows": self.rows, "resumedFrom": self.resumed_from,
+            "alreadyImported": self.skipped, "seconds": round(self.seconds, 3), "rowsPerSec": round(self.rows_per_sec, 1),
+        }
+
+
+def _log_progress(result: TableResult):
+    logger.info(f"Import {result.table}: {result.resumed_from + result.rows:,} rows, {result.rows_per_sec:,.0f} rows/s")
+
+
+class Importer:
+    """
+    Loads the sources table by table in foreign key order. Every batch_size rows are one
+    multi-row INSERT; every commit_rows rows the transaction commits together with the
+    table's checkpoint. With drop_indexes the secondary indexes of a table are dropped
+    before its load and rebuilt after it.
+    """
+
+    def __init__(self, engine: Engine, batch_size: int = 5000, commit_rows: int = 50000, drop_indexes: bool = False,
+                 progress: Callable[[TableResult], None] = _log_progress):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.commit_rows = max(commit_rows, batch_size)
+        self.drop_indexes = drop_indexes
+        self.progress = progress
+
+    def run(self, sources: List[Source], import_key: Optional[str] = None, restart: bool = False) -> List[TableResult]:
+        Base.metadata.create_all(bind=self.engine)
+        import_key = import_key or import_id(sources)
+        plan = self._plan(sources)
+        results = []
+        order_numbers: List[int] = []
+        with Session(self.engine) as db:
+            checkpoints = ImportCheckpointRepository(db)
+            if restart:
+                checkpoints.reset(import_key)
+            done = checkpoints.get(import_key)
+            for name in IMPORT_ORDER:
+                if name not in plan:
+                    continue
+                checkpoint = done.get(name)
+                result = TableResult(name, checkpoint.rowsLoaded if checkpoint else 0)
+                results.append(result)
+                if checkpoint is not None and checkpoint.finishedAt is not None:
+                    result.skipped = True
+                    continue
+                self._load(db, import_key, IMPORT_TABLES[name], plan[name], result, order_numbers)
+            loaded = [result.table for result in results if result.rows]
+            order_results = [result for result in results if result.table in (Order.__tablename__, OrderDetail.__tablename__)]
+            if any(result.rows for result in order_results):
+                # Dumps and CSV exports may lack the denormalized totals, or the lines came
+                # separately; a resumed import also covers the lines of the interrupted run
+                resumed = any(result.resumed_from for result in order_results)
+                number_range = None if resumed else (min(order_numbers), max(order_numbers))
+                OrderRepository(db).refresh_totals(number_range=number_range)
+            if loaded:
+                # Caches and snapshots of other workers notice the import by the version
+                TableVersionRepository(db).bump_many(loaded)
+            db.commit()
+        return results
+
+    def _plan(self, sources: List[Source]) -> Dict[str, List[Tuple[Source, Optional[List[int]]]]]:
+        plan: Dict[str, List[Tuple[Source, Optional[List[int]]]]] = {}
+        for source in sources:
+            if source.format == "csv":
+                plan.setdefault(source.table, []).append((source, None))
+                continue
+            for table, offsets in scan_sql(source.stream).items():
+                if table not in IMPORT_TABLES:
+                    logger.warning(f"{source.name}: skipping rows of unknown table {table}")
+                elif source.table is None or table == source.table:
+                    plan.setdefault(table, []).append((source, offsets))
+        return plan
+
+    def _rows(self, table: Table, parts: List[Tuple[Source, Optional[List[int]]]]) -> Iterator[Dict[str, Any]]:
+        for source, offsets in parts:
+            yield from _csv_rows(source) if offsets is None else _sql_rows(source, table, offsets)
+
+    def _load(self, db: Session, import_key: str, table: Table, parts: List[Tuple[Source, Optional[List[int]]]],
+              result: TableResult, order_numbers: List[int]):
+        if self.drop_indexes:
+            for index in table.indexes:
+                index.drop(bind=db.connection(), checkfirst=True)
+            db.commit()
+        checkpoints = ImportCheckpointRepository(db)
+        # Rows committed by an earlier, interrupted run are parsed again but not inserted
+        rows = itertools.islice(self._rows(table, parts), result.resumed_from, None)
+        statement = table.insert()
+        started = time.perf_counter()
+        uncommitted = 0
+        for batch in _batched(rows, self.batch_size):
+            try:
+                db.execute(statement, batch)
+            except DBAPIError as e:
+                db.rollback()
+                first = result.resumed_from + result.rows + 1
+                raise ImportConflict(f"{table.name} rows {first}-{first + len(batch) - 1}: {e.orig}")
+            if "orderNumber" in table.c:
+                numbers = [row["orderNumber"] for row in batch]
+                order_numbers.extend((min(numbers), max(numbers)))
+            result.rows += len(batch)
+            uncommitted += len(batch)
+            if uncommitted >= self.commit_rows:
+                checkpoints.save(import_key, table.name, result.resumed_from + result.rows)
+                db.commit()
+                uncommitted = 0
+                result.seconds = time.perf_counter() - started
+                self.progress(result)
+        checkpoints.save(import_key, table.name, result.resumed_from + result.rows, finished=True)
+        db.commit()
+        # Also restores indexes dropped by an interrupted run with drop_indexes
+        for index in table.indexes:
+            index.create(bind=db.connection(), checkfirst=True)
+        db.commit()
+        result.seconds = time.perf_counter() - started
+        self.progress(result)
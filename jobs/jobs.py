@@ -0,0 +1,320 @@
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import sharding
+from database.base import SQLALCHEMY_DATABASE_URL, connect_args
+from metrics.metrics import Counter, Gauge, Summary
+
+logger = logging.getLogger(__name__)
+
+# Background report jobs (POST /api/v1/jobs/{report}). Reports run on their own thread
+# pool and connection pool, so a long export never holds a request thread or one of the
+# request pool's connections. Job state lives in memory and in a JSON file next to the
+# result, so every worker process on the host can answer status and download requests.
+
+JOBS_WORKERS = int(os.getenv("JOBS_WORKERS", "2"))
+# Connections of the jobs' own pool; defaults to one per worker
+JOBS_DB_CONNECTIONS = int(os.getenv("JOBS_DB_CONNECTIONS", str(JOBS_WORKERS)))
+JOBS_MAX_QUEUED = int(os.getenv("JOBS_MAX_QUEUED", "20"))
+JOBS_DIR = os.getenv("JOBS_DIR", "job_results")
+# Results (and their job state) are deleted this long after the job finished
+JOBS_RESULT_TTL_SECONDS = float(os.getenv("JOBS_RESULT_TTL_SECONDS", "3600"))
+JOBS_CLEANUP_INTERVAL_SECONDS = 60
+# Unfinished jobs of other processes older than this are assumed lost (process restarted)
+JOBS_ABANDONED_SECONDS = 24 * 3600
+
+# Progress is written to the state file at most this often
+PROGRESS_WRITE_SECONDS = 1.0
+
+jobs_submitted = Counter("jobs_submitted_total", "Report jobs submitted", ("report",))
+jobs_deduplicated = Counter("jobs_deduplicated_total", "Report requests answered with an existing job", ("report",))
+jobs_finished = Counter("jobs_finished_total", "Report jobs finished", ("report", "status"))
+jobs_running = Gauge("jobs_running", "Report jobs running")
+jobs_queued = Gauge("jobs_queued", "Report jobs waiting for a worker")
+job_seconds = Summary("job_duration_seconds", "Run time of report jobs")
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+# Runs the report query on the jobs' session: (columns, row count or None, rows)
+ReportQuery = Callable[[Session], Tuple[List[str], Optional[int], Iterable[Tuple]]]
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobNotLocal(Exception):
+    """
+    The job runs in another worker process, only that process can stop it
+    """
+
+
+class Job:
+    def __init__(self, report: str, params: Dict[str, Any], key: str, owner: str):
+        self.id = uuid.uuid4().hex
+        self.report = report
+        self.params = params
+        self.key = key
+        self.owner = owner
+        self.status = QUEUED
+        self.rows = 0
+        self.total: Optional[int] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = False
+
+    @property
+    def progress(self) -> Optional[float]:
+        if self.status == SUCCEEDED:
+            return 1.0
+        if not self.total:
+            return None
+        return round(min(self.rows / self.total, 1.0), 4)
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        return self.finished_at + JOBS_RESULT_TTL_SECONDS if self.finished_at is not None else None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id, "report": self.report, "params": self.params, "key": self.key, "owner": self.owner,
+            "status": self.status, "rows": self.rows, "total": self.total, "progress": self.progress,
+            "error": self.error, "created_at": self.created_at, "started_at": self.started_at,
+            "finished_at": self.finished_at, "expires_at": self.expires_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Job":
+        job = cls(data["report"], data["params"], data["key"], data["owner"])
+        for name in ("id", "status", "rows", "total", "error", "created_at", "started_at", "finished_at"):
+            setattr(job, name, data[name])
+        return job
+
+
+def job_key(report: str, params: Dict[str, Any], owner: str) -> str:
+    """
+    Identical requests (same user, same report, same parameters) share one job
+    """
+    canonical = json.dumps({"report": report, "params": params, "owner": owner}, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+class JobManager:
+    """
+    Runs report jobs on a bounded thread pool with its own connection pool, deduplicates
+    identical jobs while they are queued, running or their result is still on disk, and
+    deletes results JOBS_RESULT_TTL_SECONDS after they finished.
+    """
+
+    def __init__(self, workers: int = JOBS_WORKERS, db_connections: int = JOBS_DB_CONNECTIONS,
+                 max_queued: int = JOBS_MAX_QUEUED, directory: str = JOBS_DIR):
+        self.workers = workers
+        self.db_connections = db_connections
+        self.max_queued = max_queued
+        self.directory = directory
+        self._jobs: Dict[str, Job] = {}
+        self._by_key: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._sessions: Optional[sessionmaker] = None
+        self._cleaner: Optional[threading.Thread] = None
+
+    def _start(self):
+        # Lazily, so importing the app does not open the jobs' pool or threads
+        if self._executor is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        engine = create_engine(
+            SQLALCHEMY_DATABASE_URL, connect_args=connect_args, pool_size=self.db_connections, max_overflow=0
+        )
+        self._sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="report-job")
+        self._cleaner = threading.Thread(target=self._clean_periodically, name="report-job-cleanup", daemon=True)
+        self._cleaner.start()
+
+    def submit(self, report: str, params: Dict[str, Any], query: ReportQuery, owner: str) -> Tuple[Job, bool]:
+        """
+        Returns the job and whether it was created (False: an identical job already exists)
+        """
+        key = job_key(report, params, owner)
+        with self._lock:
+            self._start()
+            existing = self._find_by_key(key)
+            if existing is not None:
+                jobs_deduplicated.inc(report=report)
+                return existing, False
+            waiting = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            if waiting >= self.max_queued:
+                raise JobQueueFull()
+            job = Job(report, params, key, owner)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+            self._save(job)
+        jobs_submitted.inc(report=report)
+        jobs_queued.inc()
+        self._executor.submit(self._run, job, query)
+        return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        # Submitted through another worker process
+        return self._load(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Stops a queued or running job at its next batch of rows; a finished job's result is deleted
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job.status in FINISHED:
+            self._delete(job)
+            return job
+        if job.id not in self._jobs:
+            raise JobNotLocal()
+        job.cancel_requested = True
+        return job
+
+    def result_path(self, job: Job) -> str:
+        return os.path.join(self.directory, f"{job.id}.csv")
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _find_by_key(self, key: str) -> Optional[Job]:
+        job_id = self._by_key.get(key)
+        job = self._jobs.get(job_id) if job_id else None
+        if job is None or job.status in (FAILED, CANCELLED) or job.cancel_requested:
+            return None
+        if job.status == SUCCEEDED and (not os.path.exists(self.result_path(job)) or job.expires_at <= time.time()):
+            return None
+        return job
+
+    def _run(self, job: Job, query: ReportQuery):
+        jobs_queued.dec()
+        if job.cancel_requested:
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._save(job)
+        jobs_running.inc()
+        partial = self.result_path(job) + ".part"
+        try:
+            with self._sessions() as db, open(partial, "w", newline="") as out:
+                try:
+                    columns, job.total, rows = query(db)
+                    writer = csv.writer(out)
+                    writer.writerow(columns)
+                    saved = time.monotonic()
+                    for row in rows:
+                        writer.writerow(row)
+                        job.rows += 1
+                        if job.rows % 1000 == 0:
+                            if job.cancel_requested:
+                                break
+                            if time.monotonic() - saved >= PROGRESS_WRITE_SECONDS:
+                                self._save(job)
+                                saved = time.monotonic()
+                finally:
+                    # Shard sessions the report opened (SHARDS)
+                    sharding.close_sessions(db)
+            if job.cancel_requested:
+                os.remove(partial)
+                self._finish(job, CANCELLED)
+                return
+            os.replace(partial, self.result_path(job))
+            self._finish(job, SUCCEEDED)
+        except Exception as e:
+            logger.error(f"Report job {job.id} ({job.report}) failed: {e}", exc_info=True)
+            if os.path.exists(partial):
+                os.remove(partial)
+            job.error = str(e)
+            self._finish(job, FAILED)
+        finally:
+            jobs_running.dec()
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        if job.started_at is not None:
+            job_seconds.observe(job.finished_at - job.started_at)
+        jobs_finished.inc(report=job.report, status=status)
+        self._save(job)
+
+    def _save(self, job: Job):
+        # Written to a temporary file and renamed, so readers never see half a state
+        path = self._state_path(job.id)
+        with open(path + ".tmp", "w") as f:
+            json.dump(job.to_dict(), f)
+        os.replace(path + ".tmp", path)
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._state_path(job_id)) as f:
+                return Job.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _delete(self, job: Job):
+        with self._lock:
+            self._jobs.pop(job.id, None)
+            if self._by_key.get(job.key) == job.id:
+                del self._by_key[job.key]
+        for path in (self.result_path(job), self._state_path(job.id)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def cleanup(self) -> int:
+        """
+        Deletes expired results and their state, including those of other worker processes
+        """
+        now = time.time()
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".part") and os.path.getmtime(path) < now - JOBS_ABANDONED_SECONDS:
+                os.remove(path)
+                continue
+            if not name.endswith(".json"):
+                continue
+            job = self._load(name[:-len(".json")])
+            if job is None:
+                continue
+            expired = job.expires_at is not None and job.expires_at <= now
+            abandoned = job.status not in FINISHED and job.id not in self._jobs and job.created_at < now - JOBS_ABANDONED_SECONDS
+            if expired or abandoned:
+                self._delete(job)
+                removed += 1
+        return removed
+
+    def _clean_periodically(self):
+        while True:
+            time.sleep(JOBS_CLEANUP_INTERVAL_SECONDS)
+            try:
+                removed = self.cleanup()
+                if removed:
+                    logger.info(f"Removed {removed} expired report job results")
+            except Exception as e:
+                logger.warning(f"Report job cleanup failed: {e}")
+
+
+manager = JobManager()
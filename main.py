@@ -2,15 +2,48 @@ from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from routes.routes import setup_routes 
-from middleware.middleware import RequestLoggingMiddleware
-from database.base import engine, Base
+from middleware.middleware import RequestLoggingMiddleware, QueryStatsMiddleware, ProfilingMiddleware, QueryDeadlineMiddleware, StaleWhileRevalidateMiddleware
+from database.base import engine, Base, SessionLocal
+from database import circuit_breaker, sharding
+from cache import reference_snapshot, result_cache, shared_cache, stale_cache
+from recommendations import recommendations
+from analytics import pricing
+from database.timeouts import QueryTimeout, QueryCancelled, query_timeouts
+from database.circuit_breaker import DatabaseUnavailable
 from database.session import get_db
 import uvicorn
 import logging
+import math
+import os
+
+# Reject statements to a database that keeps failing instead of waiting on it
+if circuit_breaker.CIRCUIT_BREAKER:
+    circuit_breaker.install()
 
 # Create database tables
 get_db()
 Base.metadata.create_all(bind=engine)
+if sharding.router is not None:
+    sharding.router.create_schema()
+
+# Load reference tables (offices, product lines) into memory
+if reference_snapshot.REFERENCE_SNAPSHOT:
+    with SessionLocal() as db:
+        reference_snapshot.load_all(db)
+
+# Hot rows and verified tokens stored once per host, in a file mapped by every worker
+if shared_cache.SHARED_CACHE:
+    shared_cache.open_cache()
+
+# Co-purchase matrix for product recommendations, built in the background; SQL answers until it is ready
+if recommendations.RECOMMENDATIONS:
+    recommendations.rebuild_in_background()
+
+# Version rows of the cached tables and the pricing columns, so concurrent first writes do not race to create them
+with SessionLocal() as db:
+    if result_cache.RESULT_CACHE:
+        result_cache.prepare(db)
+    pricing.prepare(db)
 
 # Setup logging
 logging.basicConfig(
@@ -27,6 +60,16 @@ app = FastAPI(
 )
 
 # Add middleware
+if os.getenv("PROFILING", "false").lower() == "true":
+    app.add_middleware(ProfilingMiddleware)
+if os.getenv("QUERY_STATS", "false").lower() == "true":
+    app.add_middleware(QueryStatsMiddleware)
+# Around every layer that queries, so they all run with the request's query deadline
+app.add_middleware(QueryDeadlineMiddleware)
+# Catalog reads from memory, also while the database is down; outside the deadline, so its refreshes get their own
+if stale_cache.STALE_CACHE:
+    app.add_middleware(StaleWhileRevalidateMiddleware)
+# Outermost, so responses from the stale cache are logged and get the CORS headers too
 app.add_middleware(RequestLoggingMiddleware)
 app.add_middleware(
     CORSMiddleware,
@@ -39,7 +82,32 @@ app.add_middleware(
 # Include routes
 app.include_router(setup_routes(), prefix="/api/v1")
 
-# Error handler
+# Error handlers
+@app.exception_handler(QueryTimeout)
+async def query_timeout_handler(request: Request, exc: QueryTimeout):
+    query_timeouts.inc(endpoint=str(exc))
+    logger.warning(f"Query deadline exceeded: {exc}")
+    return JSONResponse(
+        status_code=504,
+        content={"detail": "Database query timed out"},
+    )
+
+@app.exception_handler(DatabaseUnavailable)
+async def database_unavailable_handler(request: Request, exc: DatabaseUnavailable):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Database unavailable, retry later"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+@app.exception_handler(QueryCancelled)
+async def query_cancelled_handler(request: Request, exc: QueryCancelled):
+    # The client is gone, nobody reads this response
+    return JSONResponse(
+        status_code=499,
+        content={"detail": "Client closed request"},
+    )
+
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Global exception: {exc}", exc_info=True)
@@ -0,0 +1,111 @@
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+# In-process metrics in the Prometheus text format, served by GET /api/v1/metrics.
+# Values are per worker process; scrape every worker (or run one) for exact totals.
+
+LabelValues = Tuple[str, ...]
+
+# Every metric registers itself here on creation, in render order
+REGISTRY: List["Metric"] = []
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down; with `callback` it is read at scrape time instead
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = (), callback: Optional[Callable[[], float]] = None):
+        super().__init__(name, description, labels)
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        if self.callback is not None:
+            return [(self.name, (), float(self.callback()))]
+        return super().samples()
+
+
+class Summary(Metric):
+    """
+    Count and sum of observations (e.g. seconds spent waiting), enough for rates and averages
+    """
+    kind = "summary"
+
+    def __init__(self, name: str, description: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, description, labels)
+        self._counts: Dict[LabelValues, int] = {}
+
+    def observe(self, amount: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def count(self, **labels) -> int:
+        return self._counts.get(self._key(labels), 0)
+
+    def samples(self) -> List[Tuple[str, LabelValues, float]]:
+        with self._lock:
+            return ([(f"{self.name}_sum", key, value) for key, value in self._values.items()]
+                    + [(f"{self.name}_count", key, count) for key, count in self._counts.items()])
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, values, value in metric.samples():
+            lines.append(f"{name}{_format_labels(metric.labels, values)} {value:g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from fastapi import Depends, HTTPException, Request
+
+from auth.auth import User, get_current_active_user
+from database.base import engine
+from metrics.metrics import Counter, Gauge, Summary
+
+logger = logging.getLogger(__name__)
+
+# Routes whose path contains one of these fragments draw from the "heavy" rate-limit budget;
+# "/jobs/{report}" is the route submitting a report job (exports included), not its polling
+HEAVY_ENDPOINTS = ("/paginated", "/jobs/{report}")
+
+admission_in_flight = Gauge("admission_in_flight", "Requests holding an admission slot")
+admission_queued = Gauge("admission_queued", "Requests waiting for an admission slot")
+admission_rejected = Counter("admission_rejected_total", "Requests rejected with 503", ("reason",))
+admission_wait = Summary("admission_wait_seconds", "Time spent waiting for an admission slot")
+rate_limited = Counter("rate_limited_total", "Requests rejected with 429", ("budget",))
+requests_admitted = Counter("requests_admitted_total", "Requests admitted", ("budget",))
+pool_checked_out = Gauge("db_pool_checked_out", "Connections checked out of the pool",
+                         callback=lambda: getattr(engine.pool, "checkedout", lambda: 0)())
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Bounds the number of requests using the database at once. Requests beyond
+    `max_concurrent` wait in a queue of at most `max_queue` entries for up to
+    `queue_timeout` seconds; when the queue is full they are rejected right away
+    instead of piling up on the connection pool's checkout timeout.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._loop = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # A semaphore belongs to one event loop (TestClient may start several)
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent - self.in_flight)
+            self._loop = loop
+        return self._semaphore
+
+    async def acquire(self):
+        semaphore = self._get_semaphore()
+        if semaphore.locked():
+            if self.waiting >= self.max_queue:
+                raise Overloaded("queue_full")
+            self.waiting += 1
+            admission_queued.inc()
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise Overloaded("queue_timeout")
+            finally:
+                self.waiting -= 1
+                admission_queued.dec()
+                admission_wait.observe(time.perf_counter() - started)
+        else:
+            await semaphore.acquire()
+        self.in_flight += 1
+        admission_in_flight.inc()
+
+    def release(self):
+        self.in_flight -= 1
+        admission_in_flight.dec()
+        self._get_semaphore().release()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Takes one token; returns 0 on success, otherwise the seconds until one is available
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    One token bucket per (username, budget)
+    """
+
+    def __init__(self, budgets: Dict[str, Tuple[float, float]]):
+        self.budgets = budgets
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+
+    def check(self, username: str, budget: str) -> float:
+        bucket = self._buckets.get((username, budget))
+        if bucket is None:
+            rate, burst = self.budgets[budget]
+            bucket = self._buckets[(username, budget)] = TokenBucket(rate, burst)
+        return bucket.take()
+
+
+def budget_for(path: str) -> str:
+    return "heavy" if any(fragment in path for fragment in HEAVY_ENDPOINTS) else "default"
+
+
+def _retry_after(seconds: float) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(seconds)))}
+
+
+# Configuration, read once at import like the rest of the app settings
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+RATE_LIMITING = os.getenv("RATE_LIMITING", "true").lower() == "true"
+
+# Defaults match the QueuePool defaults (pool_size 5 + max_overflow 10)
+admission = AdmissionController(
+    max_concurrent=int(os.getenv("ADMISSION_MAX_CONCURRENT", "15")),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", "50")),
+    queue_timeout=float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "5")),
+)
+rate_limiter = RateLimiter({
+    "default": (float(os.getenv("RATE_LIMIT_RPS", "20")), float(os.getenv("RATE_LIMIT_BURST", "40"))),
+    "heavy": (float(os.getenv("RATE_LIMIT_HEAVY_RPS", "2")), float(os.getenv("RATE_LIMIT_HEAVY_BURST", "5"))),
+})
+
+
+@asynccontextmanager
+async def admitted(username: Optional[str], path: str, description: str) -> AsyncIterator[None]:
+    """
+    Per-user rate limit (429; skipped without a username), then a slot in the admission
+    queue (503), both raised as HTTPException. The slot is held for the block.
+    """
+    budget = budget_for(path)
+
+    if RATE_LIMITING and username is not None:
+        wait = rate_limiter.check(username, budget)
+        if wait:
+            rate_limited.inc(budget=budget)
+            raise HTTPException(status_code=429, detail="Too many requests", headers=_retry_after(wait))
+
+    if not ADMISSION_CONTROL:
+        requests_admitted.inc(budget=budget)
+        yield
+        return
+
+    try:
+        await admission.acquire()
+    except Overloaded as e:
+        admission_rejected.inc(reason=e.reason)
+        logger.warning(f"Rejecting {description}: {e.reason}")
+        raise HTTPException(status_code=503, detail="Server is busy, retry later",
+                            headers=_retry_after(admission.queue_timeout))
+    requests_admitted.inc(budget=budget)
+    try:
+        yield
+    finally:
+        admission.release()
+
+
+async def admit_request(request: Request, current_user: User = Depends(get_current_active_user)):
+    """
+    Router dependency: admitted() for the route. The slot is held until the endpoint and
+    its `get_db` session are done. Background refreshes of the stale cache are not
+    charged to the user's rate limit.
+    """
+    route = request.scope.get("route")
+    username = None if getattr(request.state, "cache_refresh", False) else current_user.username
+    async with admitted(username, route.path if route else request.url.path, f"{request.method} {request.url.path}"):
+        yield
@@ -1,8 +1,19 @@
-from fastapi import Request, Response
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import FileResponse, JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
+import asyncio
 import time
-from typing import Callable
+from contextlib import nullcontext
+from typing import Callable, Optional
 import logging
+import os
+import uuid
+from auth.auth import User, get_principal, get_username_from_token
+from cache import stale_cache
+from database import query_stats, timeouts
+from database.base import engine
+from middleware import admission
+from middleware.profiler import SamplingProfiler, save_profile
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -29,6 +40,284 @@ class RequestLoggingMiddleware(BaseHTTPMiddleware):
         
         return response
 
+class QueryStatsMiddleware(BaseHTTPMiddleware):
+    """
+    Counts SQL statements and database time per request and flags N+1 patterns.
+    QUERY_STATS_HEADERS=true also returns the numbers as response headers (dev only).
+    """
+    def __init__(self, app, headers: bool = None, warn_threshold: int = None):
+        super().__init__(app)
+        self.headers = headers if headers is not None else os.getenv("QUERY_STATS_HEADERS", "false").lower() == "true"
+        self.warn_threshold = warn_threshold if warn_threshold is not None else int(os.getenv("QUERY_STATS_WARN_THRESHOLD", "20"))
+        query_stats.install()
+
+    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        with query_stats.track_queries() as stats:
+            response = await call_next(request)
+            
+            # The route is only known once routing has run
+            route = request.scope.get("route")
+            stats.endpoint = f"{request.method} {route.path if route else request.url.path}"
+            query_stats.log_request_stats(stats, self.warn_threshold)
+            
+            if self.headers:
+                response.headers["X-DB-Query-Count"] = str(stats.count)
+                response.headers["X-DB-Time"] = f"{stats.db_time:.6f}"
+                repeated = stats.n_plus_one()
+                if repeated:
+                    response.headers["X-DB-N-Plus-One"] = str(sum(repeated.values()))
+        
+        return response
+
+class ProfilingMiddleware(BaseHTTPMiddleware):
+    """
+    Profiles a single request on demand: `X-Profile: 1` (or `?profile=1`) stores a
+    speedscope profile in PROFILE_DIR, `download` returns it as the response instead.
+    Only users listed in PROFILE_ALLOWED_USERS can trigger it; other requests pay a
+    header lookup and nothing else.
+    """
+    def __init__(self, app, allowed_users: str = None, directory: str = None, interval_ms: float = None):
+        super().__init__(app)
+        allowed_users = allowed_users if allowed_users is not None else os.getenv("PROFILE_ALLOWED_USERS", "admin")
+        self.allowed_users = {user.strip() for user in allowed_users.split(",") if user.strip()}
+        self.directory = directory or os.getenv("PROFILE_DIR", "profiles")
+        self.interval = (interval_ms if interval_ms is not None else float(os.getenv("PROFILE_INTERVAL_MS", "1"))) / 1000
+
+    def _requested_by(self, request: Request) -> str:
+        mode = request.headers.get("x-profile") or request.query_params.get("profile")
+        if not mode:
+            return None
+        authorization = request.headers.get("authorization", "")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or get_username_from_token(token) not in self.allowed_users:
+            logger.warning(f"Ignoring profile request for {request.url.path}: user not allowed")
+            return None
+        return mode
+
+    async def dispatch(self, request: Request, call_next: Callable) -> Response:
+        mode = self._requested_by(request)
+        if mode is None:
+            return await call_next(request)
+        
+        profile_id = uuid.uuid4().hex[:12]
+        fmt = request.headers.get("x-profile-format") or request.query_params.get("profile_format", "speedscope")
+        profiler = SamplingProfiler(self.interval)
+        
+        # Reuse the statement counters of QueryStatsMiddleware when it is installed
+        stats = query_stats.current_stats()
+        tracking = nullcontext(stats) if stats is not None else query_stats.track_queries()
+        query_stats.install()
+        with tracking as stats:
+            profiler.start()
+            try:
+                response = await call_next(request)
+            finally:
+                profiler.stop()
+        
+        route = request.scope.get("route")
+        name = f"{request.method} {route.path if route else request.url.path}"
+        summary = {
+            "profile_id": profile_id,
+            "endpoint": name,
+            "status_code": response.status_code,
+            "wall_time": round(profiler.duration, 6),
+            "samples": len(profiler.samples),
+            "interval": self.interval,
+            "db_statements": stats.count,
+            "db_time": round(stats.db_time, 6),
+            "layers": profiler.layer_split(),
+        }
+        path = save_profile(profiler, self.directory, profile_id, name, fmt, summary)
+        logger.info(f"Profile {profile_id} for {name}: {summary}")
+        
+        if mode == "download":
+            return FileResponse(path, filename=os.path.basename(path), headers={"X-Profile-Id": profile_id})
+        
+        response.headers["X-Profile-Id"] = profile_id
+        response.headers["X-Profile-Path"] = path
+        response.headers["X-Profile-DB-Time"] = f"{stats.db_time:.6f}"
+        return response
+
+class QueryDeadlineMiddleware:
+    """
+    Gives every request a query deadline (QUERY_TIMEOUT_MS, QUERY_TIMEOUT_ROUTES) and
+    interrupts its running statements when the client disconnects, so the pooled
+    connection is released instead of finishing work nobody will read.
+
+    A plain ASGI middleware: it has to read `receive` itself to notice the disconnect
+    while a sync endpoint is still running, which BaseHTTPMiddleware does not allow.
+    """
+    def __init__(self, app):
+        self.app = app
+        timeouts.install()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        state, token = timeouts.start_request(scope)
+        messages = asyncio.Queue(maxsize=1)
+        response_complete = False
+        
+        async def watch_disconnect():
+            # Reads one message ahead of the app; the disconnect is acted on before it is queued
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    if not response_complete:
+                        timeouts.queries_cancelled.inc()
+                        logger.info(f"Client disconnected, cancelling queries of {state.endpoint}")
+                        await asyncio.to_thread(state.cancel, engine)
+                    await messages.put(message)
+                    return
+                await messages.put(message)
+        
+        async def wrapped_receive():
+            if watcher.done() and messages.empty():
+                return {"type": "http.disconnect"}
+            return await messages.get()
+        
+        async def wrapped_send(message):
+            nonlocal response_complete
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                response_complete = True
+            await send(message)
+        
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await self.app(scope, wrapped_receive, wrapped_send)
+        finally:
+            watcher.cancel()
+            timeouts.end_request(token)
+
+class StaleWhileRevalidateMiddleware:
+    """
+    Answers GET requests for the resources in STALE_CACHE_TABLES from cache.stale_cache:
+    fresh entries as they are, stale ones (past the soft TTL) right away with
+    `Warning: 110` while one background request refreshes them, and with `Warning: 111`
+    once a refresh failed, until the hard TTL. Cached answers carry `Age`. Only requests
+    with a valid token of an active user are answered from the cache; any other goes
+    through, and gets its 401, as usual. Answers from the cache count against the user's
+    rate limit and take an admission slot, like the endpoint they stand in for.
+
+    Outside QueryDeadlineMiddleware, so a refresh runs with its own query deadline, and
+    inside CORS and request logging, so cached answers get their headers too.
+    """
+    def __init__(self, app, prefix: str = "/api/v1"):
+        self.app = app
+        self.prefix = prefix.rstrip("/") + "/"
+        self.tables = set(stale_cache.STALE_CACHE_TABLES)
+        # Running refreshes; the event loop only keeps weak references to tasks
+        self._refreshes = set()
+
+    async def __call__(self, scope, receive, send):
+        table = self._table(scope)
+        user = _active_user(scope) if table is not None else None
+        if user is None:
+            return await self.app(scope, receive, send)
+        
+        key = stale_cache.key_for(table, scope["path"], scope.get("query_string", b""))
+        entry = stale_cache.cache.get(key)
+        if entry is None:
+            stale_cache.responses_served.inc(state="miss")
+            await self._fetch(scope, receive, send, key)
+            return
+        
+        try:
+            async with admission.admitted(user.username, scope["path"], f"GET {scope['path']}"):
+                await self._answer(scope, key, entry, send)
+        except HTTPException as e:
+            response = JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+            await response(scope, receive, send)
+    
+    async def _answer(self, scope, key, entry: stale_cache.Entry, send):
+        if entry.age() < stale_cache.cache.soft_ttl:
+            stale_cache.responses_served.inc(state="fresh")
+            return await _send_entry(send, entry, None)
+        
+        if stale_cache.cache.start_refresh(key):
+            # Made for the user, not by them: not charged to their rate limit
+            state = {**(scope.get("state") or {}), "cache_refresh": True}
+            refresh_scope = {**scope, "headers": list(scope["headers"]), "state": state}
+            task = asyncio.create_task(self._refresh(refresh_scope, key))
+            self._refreshes.add(task)
+            task.add_done_callback(self._refreshes.discard)
+        if entry.failed:
+            stale_cache.responses_served.inc(state="failed")
+            return await _send_entry(send, entry, b'111 - "Revalidation Failed"')
+        stale_cache.responses_served.inc(state="stale")
+        return await _send_entry(send, entry, b'110 - "Response is Stale"')
+    
+    def _table(self, scope) -> Optional[str]:
+        if scope["type"] != "http" or scope["method"] != "GET" or not scope["path"].startswith(self.prefix):
+            return None
+        table = scope["path"][len(self.prefix):].split("/", 1)[0]
+        return table if table in self.tables else None
+    
+    async def _fetch(self, scope, receive, send, key) -> bool:
+        """
+        Runs the request and stores a 200 JSON response; `send` None for a background refresh
+        """
+        # Read before the request: a write committed meanwhile moves it and the response is not stored
+        generation = stale_cache.cache.generation(key[0])
+        status, headers, chunks = None, [], []
+        
+        async def capture(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = [(name, value) for name, value in message.get("headers", []) if name.lower() == b"content-type"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            if send is not None:
+                await send(message)
+        
+        await self.app(scope, receive, capture)
+        if status != 200 or not any(value.startswith(b"application/json") for _, value in headers):
+            return False
+        return stale_cache.cache.store(key, generation, headers, b"".join(chunks))
+    
+    async def _refresh(self, scope, key):
+        done = asyncio.Event()
+        requested = False
+        
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # Nobody disconnects a background request
+            await done.wait()
+            return {"type": "http.disconnect"}
+        
+        refreshed = False
+        try:
+            refreshed = await self._fetch(scope, receive, None, key)
+        except Exception as e:
+            logger.warning(f"Refreshing {scope['path']} failed: {e}")
+        finally:
+            done.set()
+            stale_cache.cache.end_refresh(key, refreshed)
+            stale_cache.refreshes.inc(result="ok" if refreshed else "failed")
+
+def _active_user(scope) -> Optional[User]:
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            user = get_principal(token) if scheme.lower() == "bearer" else None
+            return user if user is not None and not user.disabled else None
+    return None
+
+async def _send_entry(send, entry: stale_cache.Entry, warning: Optional[bytes]):
+    headers = entry.headers + [
+        (b"content-length", str(len(entry.body)).encode()),
+        (b"age", str(int(entry.age())).encode()),
+    ]
+    if warning is not None:
+        headers.append((b"warning", warning))
+    await send({"type": "http.response.start", "status": 200, "headers": headers})
+    await send({"type": "http.response.body", "body": entry.body})
+
 class CORSMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next: Callable) -> Response:
         response = await call_next(request)
@@ -0,0 +1,139 @@
+import json
+import os
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_PROFILER_FILE = os.path.abspath(__file__)
+
+# Layers of this app, by top-level directory
+LAYERS = ("controllers", "services", "repositories", "auth", "middleware", "database")
+_DB_MARKERS = (os.sep + "sqlalchemy" + os.sep, os.sep + "mysql" + os.sep, "sqlite3")
+
+Frame = Tuple[str, str, int]
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every thread from a background thread.
+
+    Sync endpoints run in the threadpool, so a per-thread profiler such as cProfile
+    would miss them. Only stacks that pass through this app's code are kept, which
+    drops idle workers and the event loop; on a busy worker, stacks of concurrent
+    requests can still show up.
+    """
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.samples: List[List[Frame]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.started = 0.0
+        self.duration = 0.0
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                in_app = False
+                while frame is not None:
+                    code = frame.f_code
+                    filename = code.co_filename
+                    if filename == _PROFILER_FILE:
+                        break
+                    if filename.startswith(ROOT) and os.sep + "site-packages" + os.sep not in filename:
+                        in_app = True
+                    stack.append((code.co_name, filename, code.co_firstlineno))
+                    frame = frame.f_back
+                else:
+                    if in_app:
+                        stack.reverse()
+                        self.samples.append(stack)
+
+    def layer_split(self) -> Dict[str, float]:
+        """
+        Seconds attributed to each app layer (innermost app frame wins) and to SQL
+        (any database driver or SQLAlchemy frame below the app frames)
+        """
+        split: Dict[str, float] = {}
+        for stack in self.samples:
+            layer = "other"
+            for name, filename, _ in stack:
+                relative = os.path.relpath(filename, ROOT) if filename.startswith(ROOT) else ""
+                top = relative.split(os.sep, 1)[0]
+                if top in LAYERS:
+                    layer = top
+            if any(marker in filename for _, filename, _ in stack for marker in _DB_MARKERS):
+                layer = "sql"
+            split[layer] = split.get(layer, 0.0) + self.interval
+        return {layer: round(seconds, 6) for layer, seconds in sorted(split.items())}
+
+    def to_speedscope(self, name: str, extra: Optional[Dict] = None) -> Dict:
+        frames: List[Dict] = []
+        index: Dict[Frame, int] = {}
+        samples = []
+        for stack in self.samples:
+            sample = []
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                sample.append(index[frame])
+            samples.append(sample)
+        profile = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "classicmodels-request-profiler",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": round(len(samples) * self.interval, 6),
+                "samples": samples,
+                "weights": [self.interval] * len(samples),
+            }],
+        }
+        if extra:
+            profile["metadata"] = extra
+        return profile
+
+    def to_collapsed(self) -> str:
+        """
+        Folded stacks, the input format of flamegraph.pl and speedscope
+        """
+        counts: Dict[str, int] = {}
+        for stack in self.samples:
+            key = ";".join(f"{name} ({os.path.basename(filename)}:{line})" for name, filename, line in stack)
+            counts[key] = counts.get(key, 0) + 1
+        return "\n".join(f"{key} {count}" for key, count in counts.items()) + "\n"
+
+
+def save_profile(profiler: SamplingProfiler, directory: str, profile_id: str, name: str, fmt: str, extra: Dict) -> str:
+    os.makedirs(directory, exist_ok=True)
+    if fmt == "collapsed":
+        path = os.path.join(directory, f"{profile_id}.collapsed.txt")
+        with open(path, "w") as f:
+            f.write(profiler.to_collapsed())
+    else:
+        path = os.path.join(directory, f"{profile_id}.speedscope.json")
+        with open(path, "w") as f:
+            json.dump(profiler.to_speedscope(name, extra), f)
+    return path
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Text
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, DateTime, Index, Text
 from sqlalchemy.orm import relationship
 from database.base import Base
 
@@ -60,6 +60,14 @@ class Office(Base):
 
 class Order(Base):
     __tablename__ = "orders"
+    # Date range filters and /orders/timeseries; (customerNumber, orderDate) serves a
+    # customer's orders alone and within a date range
+    __table_args__ = (
+        Index("ix_orders_customer_orderDate", "customerNumber", "orderDate"),
+        Index("ix_orders_orderDate", "orderDate"),
+        Index("ix_orders_requiredDate", "requiredDate"),
+        Index("ix_orders_shippedDate", "shippedDate"),
+    )
     
     orderNumber = Column(Integer, primary_key=True, index=True)
     orderDate = Column(Date, nullable=False)
@@ -68,6 +76,14 @@ class Order(Base):
     status = Column(String(15), nullable=False)
     comments = Column(Text)
     customerNumber = Column(Integer, ForeignKey("customers.customerNumber", ondelete="CASCADE"), nullable=False)
+    # Denormalized from orderdetails, refreshed in the same transaction as every line write
+    # (check and repair with scripts/order_totals.py)
+    totalAmount = Column(Float, nullable=False, default=0, server_default="0", index=True)
+    lineCount = Column(Integer, nullable=False, default=0, server_default="0")
+    itemCount = Column(Integer, nullable=False, default=0, server_default="0")
+    # Moved by every write to the order or its lines; PUT /orderdetails/order/{orderNumber}
+    # only applies when the client's version is still current
+    version = Column(Integer, nullable=False, default=1, server_default="1")
     
     customer = relationship("Customer", back_populates="orders", passive_deletes=True)
     orderDetails = relationship("OrderDetail", back_populates="order", passive_deletes=True)
@@ -92,7 +108,8 @@ class Product(Base):
     productLine = Column(String(50), ForeignKey("productlines.productLine", ondelete="CASCADE"), nullable=False)
     productScale = Column(String(10), nullable=False)
     productVendor = Column(String(50), nullable=False)
-    productDescription = Column(Text, nullable=False)
+    # info["heavy"]: deferred on list endpoints unless requested with ?fields=
+    productDescription = Column(Text, nullable=False, info={"heavy": True})
     quantityInStock = Column(Integer, nullable=False)
     buyPrice = Column(Float, nullable=False)
     MSRP = Column(Float, nullable=False)
@@ -104,16 +121,70 @@ class ProductLine(Base):
     __tablename__ = "productlines"
     
     productLine = Column(String(50), primary_key=True, index=True)
-    textDescription = Column(String(4000))
-    htmlDescription = Column(Text)
+    textDescription = Column(String(4000), info={"heavy": True})
+    htmlDescription = Column(Text, info={"heavy": True})
     image = Column(String(100))
     
     products = relationship("Product", back_populates="productLineInfo", passive_deletes=True)
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        Index("ix_payments_customer_paymentDate", "customerNumber", "paymentDate"),
+        Index("ix_payments_paymentDate", "paymentDate"),
+    )
     
     customerNumber = Column(Integer, ForeignKey("customers.customerNumber", ondelete="CASCADE"), primary_key=True)
     checkNumber = Column(String(50), primary_key=True)
     paymentDate = Column(Date, nullable=False)
     amount = Column(Float, nullable=False)
+
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+    
+    # Bumped on every write to the named table; in-process snapshots and caches poll it
+    tableName = Column(String(64), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class Change(Base):
+    __tablename__ = "changes"
+    # AUTOINCREMENT keeps SQLite from reusing ids after a purge; the id is the feed cursor
+    __table_args__ = (
+        Index("ix_changes_table_id", "tableName", "id"),
+        {"sqlite_autoincrement": True},
+    )
+    
+    # One row per create/update/delete, written in the transaction of the write itself
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    tableName = Column(String(64), nullable=False)
+    # Primary key values as strings joined by "|", in primary key column order
+    rowKey = Column(String(255), nullable=False)
+    operation = Column(String(10), nullable=False)
+    changedAt = Column(DateTime, nullable=False, index=True)
+
+class ImportCheckpoint(Base):
+    __tablename__ = "import_checkpoints"
+    
+    # Progress of a bulk import per table, committed in the same transaction as the rows,
+    # so an interrupted import resumes exactly after the last committed chunk
+    importId = Column(String(64), primary_key=True)
+    tableName = Column(String(64), primary_key=True)
+    rowsLoaded = Column(Integer, nullable=False, default=0)
+    updatedAt = Column(DateTime, nullable=False)
+    finishedAt = Column(DateTime)
+
+class ShardKey(Base):
+    __tablename__ = "shard_keys"
+    
+    # Shard directory (SHARDS): the shard holding each customer and order; order lines
+    # follow their order and payments their customer. Rows are never moved or reused.
+    tableName = Column(String(64), primary_key=True)
+    keyValue = Column(Integer, primary_key=True)
+    shard = Column(String(32), nullable=False)
+
+class ShardSequence(Base):
+    __tablename__ = "shard_sequences"
+    
+    # Last customer/order number handed out; shards cannot each autoincrement their own
+    tableName = Column(String(64), primary_key=True)
+    lastValue = Column(Integer, nullable=False, default=0)
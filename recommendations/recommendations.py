@@ -0,0 +1,303 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter as Tally, defaultdict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy.orm import Session
+
+from database import sharding
+from database.base import SessionLocal
+from metrics.metrics import Gauge
+from repositories.repositories import OrderDetailRepository
+
+logger = logging.getLogger(__name__)
+
+# "Frequently bought together" from a product x product co-purchase matrix held in memory
+# (GET /api/v1/products/{code}/recommendations). Without it the endpoint counts the
+# co-purchases of the one product in SQL on every request.
+RECOMMENDATIONS = os.getenv("RECOMMENDATIONS", "false").lower() == "true"
+# The matrix is rebuilt from orderdetails this often, in the background; the rebuild picks
+# up what the in-process updates miss (line changes and deletes, cancellations, imports,
+# writes handled by other workers)
+REBUILD_SECONDS = float(os.getenv("RECOMMENDATIONS_REBUILD_SECONDS", "3600"))
+# Co-purchases counted since the last rebuild, kept beside the matrix until there are this many
+MERGE_PAIRS = int(os.getenv("RECOMMENDATIONS_MERGE_PAIRS", "10000"))
+# Order lines read from the database per batch while building
+BUILD_BATCH_SIZE = 100000
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+
+
+class CoPurchaseMatrix:
+    """
+    counts[i, j]: orders containing both products i and j; the diagonal holds the
+    orders containing product i. Symmetric, sparse (CSR), built once and then only
+    replaced by a summed copy, so readers never see it change.
+    """
+
+    def __init__(self, codes: List[str], counts: sparse.csr_matrix, lines: int, orders: int):
+        self.codes = codes
+        self.index = {code: position for position, code in enumerate(codes)}
+        # Position of each product in product code order, to break ties between equal counts
+        self.code_rank = np.argsort(np.argsort(np.array(codes))) if codes else np.empty(0, dtype=np.int64)
+        self.counts = counts
+        self.lines = lines
+        self.orders = orders
+
+    @classmethod
+    def build(cls, batches: Iterable[Sequence[Tuple[int, str]]]) -> "CoPurchaseMatrix":
+        """
+        From (orderNumber, productCode) lines: the order x product incidence matrix B,
+        then counts = B.T @ B. Product codes are numbered per batch with np.unique, so
+        Python only touches the distinct codes of a batch, not every line.
+        """
+        index: Dict[str, int] = {}
+        order_parts, product_parts = [], []
+        for batch in batches:
+            if not batch:
+                continue
+            codes, positions = np.unique(np.array([line[1] for line in batch]), return_inverse=True)
+            numbers = np.array([index.setdefault(str(code), len(index)) for code in codes], dtype=np.int32)
+            order_parts.append(np.fromiter((line[0] for line in batch), dtype=np.int64, count=len(batch)))
+            product_parts.append(numbers[positions.ravel()])
+        if not order_parts:
+            return cls.empty()
+        order_numbers = np.concatenate(order_parts)
+        products = np.concatenate(product_parts)
+        del order_parts, product_parts
+        # Order numbers -> consecutive rows
+        orders, rows = np.unique(order_numbers, return_inverse=True)
+        incidence = sparse.csr_matrix(
+            (np.ones(len(products), dtype=np.int32), (rows.ravel(), products)), shape=(len(orders), len(index))
+        )
+        # A product appears once per order (primary key), but a repeated line must not count twice
+        incidence.data[:] = 1
+        counts = (incidence.T @ incidence).tocsr()
+        counts.sort_indices()
+        return cls(list(index), counts, len(products), len(orders))
+
+    @classmethod
+    def empty(cls) -> "CoPurchaseMatrix":
+        return cls([], sparse.csr_matrix((0, 0), dtype=np.int32), 0, 0)
+
+    @property
+    def nbytes(self) -> int:
+        return self.counts.data.nbytes + self.counts.indices.nbytes + self.counts.indptr.nbytes
+
+    def merged(self, pending: Dict[str, Tally]) -> "CoPurchaseMatrix":
+        """
+        A copy with the pending counts added; products first seen in `pending` are appended
+        """
+        codes = list(self.codes)
+        index = dict(self.index)
+        for code in sorted(set(pending) | {other for row in pending.values() for other in row}):
+            if code not in index:
+                index[code] = len(codes)
+                codes.append(code)
+        rows, columns, values = [], [], []
+        for code, row in pending.items():
+            for other, count in row.items():
+                rows.append(index[code])
+                columns.append(index[other])
+                values.append(count)
+        size = len(codes)
+        counts = self.counts.copy()
+        counts.resize((size, size))
+        counts = (counts + sparse.csr_matrix((values, (rows, columns)), shape=(size, size), dtype=np.int32)).tocsr()
+        counts.sort_indices()
+        added_orders = sum(row.get(code, 0) for code, row in pending.items())
+        return CoPurchaseMatrix(codes, counts, self.lines + added_orders, self.orders)
+
+    def top(self, code: str, limit: int, pending: Dict[str, int]) -> Tuple[int, List[Tuple[str, int]]]:
+        """
+        Orders containing the product and its `limit` most co-purchased products with
+        their counts (ties by product code), `pending` counts added; selected with NumPy
+        on the product's CSR row
+        """
+        position = self.index.get(code, -1)
+        if position >= 0:
+            start, end = self.counts.indptr[position], self.counts.indptr[position + 1]
+            others = self.counts.indices[start:end]
+            counts = self.counts.data[start:end].astype(np.int64)
+        else:
+            others, counts = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64)
+        # Pending counts of products in the matrix are summed into the row; products the
+        # matrix does not know yet are few and merged in Python below
+        new = [(other, count) for other, count in pending.items() if other not in self.index and other != code]
+        known = [(self.index[other], count) for other, count in pending.items() if other in self.index]
+        if known:
+            others, inverse = np.unique(np.concatenate([others, [other for other, _ in known]]), return_inverse=True)
+            counts = np.bincount(inverse.ravel(), weights=np.concatenate([counts, [count for _, count in known]])).astype(np.int64)
+        own = int(counts[others == position].sum()) if position >= 0 else pending.get(code, 0)
+        keep = (others != position) & (counts > 0)
+        others, counts = others[keep], counts[keep]
+        if len(counts) > limit:
+            # Only the products with at least the limit-th largest count need sorting
+            threshold = np.partition(counts, len(counts) - limit)[len(counts) - limit]
+            others, counts = others[counts >= threshold], counts[counts >= threshold]
+        ordered = np.lexsort((self.code_rank[others], -counts))[:limit]
+        together = [(self.codes[other], count) for other, count in zip(others[ordered].tolist(), counts[ordered].tolist())]
+        if new:
+            together = sorted(together + new, key=lambda item: (-item[1], item[0]))[:limit]
+        return own, together
+
+
+def rank(code: str, row: Dict[str, int], limit: int) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    Co-purchase counts of a product (its own entry: orders containing it) -> the orders
+    containing it and the `limit` products bought with it most often; ties by product code
+    """
+    together = sorted(((other, count) for other, count in row.items() if other != code and count > 0),
+                      key=lambda item: (-item[1], item[0]))[:limit]
+    return _recommendations(row.get(code, 0), together)
+
+
+def _recommendations(orders: int, together: List[Tuple[str, int]]) -> Tuple[int, List[Dict[str, Any]]]:
+    # confidence: share of the product's orders that also contain the recommended one
+    return orders, [
+        {"productCode": other, "orders": count, "confidence": round(count / orders, 4) if orders else 0.0}
+        for other, count in together
+    ]
+
+
+class Recommender:
+    """
+    Serves co-purchase counts from a CoPurchaseMatrix. Orders created in this process are
+    counted right away in a small overlay (pending), folded into a new matrix once it
+    holds MERGE_PAIRS pairs; everything else is picked up by the periodic rebuild, which
+    runs in a background thread while the old matrix keeps serving.
+    """
+
+    def __init__(self, rebuild_seconds: float = REBUILD_SECONDS, merge_pairs: int = MERGE_PAIRS):
+        self.rebuild_seconds = rebuild_seconds
+        self.merge_pairs = merge_pairs
+        self.matrix: Optional[CoPurchaseMatrix] = None
+        self.built_at = 0.0
+        self.build_seconds = 0.0
+        self._pending: Dict[str, Tally] = defaultdict(Tally)
+        self._pending_pairs = 0
+        # Baskets added while a rebuild runs, added again to the rebuilt matrix
+        self._during_rebuild: Optional[List[Tuple[List[str], List[str]]]] = None
+        self._rebuilding = False
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.matrix is not None
+
+    def build(self, batches: Iterable[Sequence[Tuple[int, str]]]):
+        with self._lock:
+            self._during_rebuild = []
+        started = time.perf_counter()
+        try:
+            matrix = CoPurchaseMatrix.build(batches)
+        except Exception:
+            with self._lock:
+                self._during_rebuild = None
+            raise
+        with self._lock:
+            # Lines committed while the scan ran may be counted twice; the next rebuild corrects them
+            replay, self._during_rebuild = self._during_rebuild, None
+            self.matrix = matrix
+            self._pending = defaultdict(Tally)
+            self._pending_pairs = 0
+            for added, existing in replay:
+                self._count(added, existing)
+            self.build_seconds = time.perf_counter() - started
+            self.built_at = time.time()
+        logger.info(f"Built co-purchase matrix: {matrix.lines} lines, {matrix.orders} orders, {len(matrix.codes)} products, "
+                    f"{matrix.counts.nnz} pairs, {matrix.nbytes / 2 ** 20:.1f} MiB in {self.build_seconds:.1f}s")
+
+    def start_rebuild(self, session_factory: Callable[[], Session], batches: Callable[[Session], Iterable]) -> bool:
+        """
+        Rebuilds in a background thread unless a rebuild is already running
+        """
+        with self._lock:
+            if self._rebuilding:
+                return False
+            self._rebuilding = True
+
+        def run():
+            db = session_factory()
+            try:
+                self.build(batches(db))
+            except Exception as e:
+                logger.error(f"Co-purchase matrix rebuild failed: {e}", exc_info=True)
+                # Retried after another REBUILD_SECONDS, not on every request
+                self.built_at = time.time()
+            finally:
+                sharding.close_sessions(db)
+                db.close()
+                self._rebuilding = False
+        threading.Thread(target=run, name="recommendations-rebuild", daemon=True).start()
+        return True
+
+    def stale(self) -> bool:
+        return time.time() - self.built_at >= self.rebuild_seconds
+
+    def add(self, added: List[str], existing: List[str]):
+        """
+        Counts products added to an order: each with every other product of the order
+        """
+        if not added:
+            return
+        with self._lock:
+            if self._during_rebuild is not None:
+                self._during_rebuild.append((list(added), list(existing)))
+            if self.matrix is None:
+                return
+            self._count(added, existing)
+            if self._pending_pairs >= self.merge_pairs:
+                self.matrix = self.matrix.merged(self._pending)
+                self._pending = defaultdict(Tally)
+                self._pending_pairs = 0
+
+    def _count(self, added: List[str], existing: List[str]):
+        basket = set(existing) | set(added)
+        for code in set(added):
+            self._pending[code][code] += 1
+            for other in basket - {code}:
+                self._pending[code][other] += 1
+                if other not in added:
+                    self._pending[other][code] += 1
+                self._pending_pairs += 1
+
+    def recommend(self, code: str, limit: int) -> Optional[Tuple[int, List[Dict[str, Any]]]]:
+        """
+        rank() of the product from the matrix, pending counts included; None: not built yet
+        """
+        with self._lock:
+            matrix = self.matrix
+            pending = dict(self._pending.get(code, ()))
+        if matrix is None:
+            return None
+        return _recommendations(*matrix.top(code, limit, pending))
+
+    def stats(self) -> Dict[str, Any]:
+        matrix = self.matrix or CoPurchaseMatrix.empty()
+        return {
+            "products": len(matrix.codes),
+            "orders": matrix.orders,
+            "lines": matrix.lines,
+            "pairs": matrix.counts.nnz,
+            "matrixBytes": matrix.nbytes,
+            "pendingPairs": self._pending_pairs,
+            "buildSeconds": round(self.build_seconds, 3),
+        }
+
+
+recommender = Recommender()
+
+matrix_bytes_gauge = Gauge("recommendations_matrix_bytes", "Size of the co-purchase matrix",
+                           callback=lambda: recommender.matrix.nbytes if recommender.matrix is not None else 0)
+build_seconds_gauge = Gauge("recommendations_build_seconds", "Duration of the last co-purchase matrix build",
+                            callback=lambda: recommender.build_seconds)
+
+
+def rebuild_in_background() -> bool:
+    return recommender.start_rebuild(SessionLocal, lambda db: OrderDetailRepository(db).get_product_lines(BUILD_BATCH_SIZE))
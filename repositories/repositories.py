@@ -1,145 +1,1251 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from models.models import Customer, Employee, Office, Order, OrderDetail, Product, ProductLine, Payment
-from typing import List, Dict, Any, Optional, Tuple, Type
+from sqlalchemy.orm import Session, aliased, defer, load_only
+from sqlalchemy import Date, DateTime, String, Table, and_, bindparam, cast, delete, exists, func, insert, literal, or_, select, tuple_, type_coerce, update
+from sqlalchemy.sql import Executable, Select
+from database import sharding
+from models.models import Change, Customer, Employee, ImportCheckpoint, Office, Order, OrderDetail, Product, ProductLine, Payment, TableVersion
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Set, Tuple, Type
 from sqlalchemy.ext.declarative import DeclarativeMeta
+from sqlalchemy.exc import IntegrityError
+from datetime import date, datetime
+import heapq
 import math
+import os
+import threading
+
+# Record every create/update/delete in the `changes` table (GET /changes)
+CHANGE_FEED = os.getenv("CHANGE_FEED", "true").lower() == "true"
+
+# session.info key of the tables written in the session's open transaction
+WRITTEN_TABLES = "written_tables"
+# session.info key of the row keys written per table (None: rows not known), collected
+# only for KEYED_TABLES, which caches of single rows fill (see cache.shared_cache)
+WRITTEN_KEYS = "written_keys"
+KEYED_TABLES: Set[str] = set()
+
+# Lines of orders in these statuses hold no stock (the dump uses Indonesian statuses)
+CANCELLED_STATUSES = ("Cancelled", "Dibatalkan")
+
+# Time buckets of the timeseries endpoints; a bucket is labelled with its first day (weeks start on Monday)
+TIME_BUCKETS = ("day", "week", "month")
+
+def date_bucket(column, bucket: str, dialect: str):
+    """
+    SQL expression truncating a date column to the first day of its day/week/month bucket
+    """
+    if dialect == "sqlite":
+        modifiers = {"day": (), "week": ("weekday 0", "-6 days"), "month": ("start of month",)}[bucket]
+        expression = func.date(column, *modifiers)
+    elif dialect in ("mysql", "mariadb"):
+        offset = {"day": 0, "week": func.weekday(column), "month": func.dayofmonth(column) - 1}[bucket]
+        expression = func.subdate(func.date(column), offset)
+    elif dialect == "postgresql":
+        expression = func.date_trunc(bucket, column)
+    else:
+        raise ValueError(f"Time buckets are not supported on {dialect}")
+    # SQLite returns text; the Date type parses it back into a date
+    return type_coerce(expression, Date)
+
+class InsufficientStock(Exception):
+    def __init__(self, product_code: str):
+        super().__init__(f"Insufficient stock for product {product_code}")
+        self.product_code = product_code
+
+class VersionConflict(Exception):
+    def __init__(self, order_number: int, version: int, expected: int):
+        super().__init__(f"Order {order_number} was changed: it is at version {version}, not {expected}")
+        self.version = version
+
+# Statements kept per model; ?fields= selections add one entry each
+STATEMENT_CACHE_SIZE = 256
+
+class ModelStatements:
+    """
+    Primary key metadata and read statements of one model, built once and shared by
+    every repository instance (repositories are created per request). Statements take
+    their values as bound parameters, so a call neither rebuilds the statement nor
+    recomputes the key SQLAlchemy finds its compiled form under.
+    """
+    
+    def __init__(self, model: Type[DeclarativeMeta]):
+        self.model = model
+        columns = list(model.__table__.primary_key)
+        # Composite keys (order details, payments) take a tuple in primary key order
+        self.primary_key = [getattr(model, column.key) for column in columns]
+        self.key_params = [f"pk_{column.key}" for column in columns]
+        self.composite = len(columns) > 1
+        self.heavy = [getattr(model, column.key) for column in model.__table__.columns if column.info.get("heavy")]
+        self.count = select(func.count(self.primary_key[0]))
+        self._statements: Dict[Any, Executable] = {}
+        self._lock = threading.Lock()
+    
+    def key_values(self, id_value) -> Dict[str, Any]:
+        values = id_value if self.composite else (id_value,)
+        return dict(zip(self.key_params, values))
+    
+    def key_criteria(self) -> List[Any]:
+        return [attribute == bindparam(name) for attribute, name in zip(self.primary_key, self.key_params)]
+    
+    def select(self, fields: Optional[List[str]] = None, list_view: bool = False) -> Select:
+        """
+        SELECT restricted to `fields` (primary key columns are always loaded). Without
+        fields, list views defer the heavy text columns and single-row reads load everything.
+        """
+        return self.statement(("select",), fields, list_view, lambda: self._build_select(fields, list_view))
+    
+    def statement(self, name: Tuple, fields: Optional[List[str]], list_view: bool, build: Callable[[], Executable]) -> Executable:
+        # Column order does not change the statement, so it is not part of the key
+        key = (name, frozenset(fields) if fields else None, list_view and not fields)
+        statement = self._statements.get(key)
+        if statement is None:
+            # Built outside the lock (builders read the cache themselves); request threads
+            # share the cache and iterating it for eviction while another thread inserts raises
+            built = build()
+            with self._lock:
+                statement = self._statements.get(key)
+                if statement is None:
+                    if len(self._statements) >= STATEMENT_CACHE_SIZE:
+                        self._statements.pop(next(iter(self._statements)), None)
+                    statement = self._statements[key] = built
+        return statement
+    
+    def _build_select(self, fields: Optional[List[str]], list_view: bool) -> Select:
+        statement = select(self.model)
+        if fields:
+            return statement.options(load_only(*[getattr(self.model, name) for name in fields]))
+        if list_view and self.heavy:
+            return statement.options(*[defer(column) for column in self.heavy])
+        return statement
+
+_model_statements: Dict[Type[DeclarativeMeta], ModelStatements] = {}
+
+def model_statements(model: Type[DeclarativeMeta]) -> ModelStatements:
+    statements = _model_statements.get(model)
+    if statements is None:
+        statements = _model_statements[model] = ModelStatements(model)
+    return statements
 
 class BaseRepository:
     def __init__(self, db: Session, model: Type[DeclarativeMeta]):
         self.db = db
         self.model = model
+        self.statements = model_statements(model)
+        self.change_log = ChangeLogRepository(db)
+        # Home sessions of sharded tables route each call to the shard(s) holding the rows
+        self.router = sharding.router_for(db, model.__tablename__)
     
-    def get_all(self, skip: int = 0, limit: int = 100) -> List[Any]:
-        return self.db.query(self.model).offset(skip).limit(limit).all()
+    def get_all(self, skip: int = 0, limit: Optional[int] = 100, fields: Optional[List[str]] = None,
+                criteria: Optional[List[Any]] = None, order_by: Optional[List[Any]] = None) -> List[Any]:
+        if self.router:
+            return self._sharded_page(skip, limit, fields, criteria, order_by)[0]
+        if not criteria and not order_by and limit is not None:
+            # Plain list page: one statement per field selection, offset and limit bound
+            statement = self.statements.statement(("all",), fields, True, lambda: self._select(fields, list_view=True)
+                                                  .offset(bindparam("offset")).limit(bindparam("limit")))
+            return self.db.execute(statement, {"offset": skip, "limit": limit}).scalars().all()
+        statement = self._select(fields, list_view=True).where(*(criteria or [])).order_by(*(order_by or []))
+        return self.db.execute(statement.offset(skip).limit(limit)).scalars().all()
         
-    def get_paginated(self, page: int = 1, size: int = 10) -> Tuple[List[Any], int, int]:
-        total = self.db.query(func.count(self.model.__table__.c.get(list(self.model.__table__.primary_key)[0].name))).scalar()
+    def get_paginated(self, page: int = 1, size: int = 10, fields: Optional[List[str]] = None,
+                      criteria: Optional[List[Any]] = None, order_by: Optional[List[Any]] = None) -> Tuple[List[Any], int, int]:
+        if self.router:
+            items, total = self._sharded_page((page - 1) * size, size, fields, criteria, order_by, with_count=True)
+            return items, total, math.ceil(total / size)
+        total = self.count(criteria)
         pages = math.ceil(total / size)
         
-        items = self.db.query(self.model).offset((page - 1) * size).limit(size).all()
+        items = self.get_all((page - 1) * size, size, fields, criteria, order_by)
         return items, total, pages
+    
+    def count(self, criteria: Optional[List[Any]] = None) -> int:
+        statement = self.statements.count.where(*criteria) if criteria else self.statements.count
+        return self.db.execute(statement).scalar()
+    
+    def stream_columns(self, fields: List[str], batch_size: int = 100000) -> Iterator[List[Any]]:
+        """
+        The given columns of every row as plain rows, streamed in batches; shard after shard (SHARDS)
+        """
+        if self.router:
+            for shard in self.router.names:
+                yield from self._on_shard(self.router.session(self.db, shard, local=True)).stream_columns(fields, batch_size)
+            return
+        # On the session's connection: plain rows, without the ORM result processing (half the time)
+        result = self.db.connection().execute(
+            select(*[self._column(name) for name in fields]).execution_options(yield_per=batch_size)
+        )
+        yield from result.partitions()
         
-    def get_by_id(self, id_value) -> Any:
-        return self.db.query(self.model).filter(
-            getattr(self.model, self._get_primary_key_name()) == id_value
-        ).first()
+    def get_by_id(self, id_value, fields: Optional[List[str]] = None) -> Any:
+        if self.router:
+            repository = self._routed(id_value)
+            return repository.get_by_id(id_value, fields) if repository else None
+        statement = self.statements.statement(("by_id",), fields, False, lambda: self._select(fields).where(*self.statements.key_criteria()))
+        return self.db.execute(statement, self.statements.key_values(id_value)).scalars().first()
     
     def create(self, data: Dict[str, Any]) -> Any:
+        if self.router:
+            return self._placed(data).create(data)
         db_item = self.model(**data)
         self.db.add(db_item)
+        self.db.flush()
+        self._on_write(self._primary_key_of(db_item))
+        self.change_log.record(self.model.__table__, "insert", [self._key_tuple(self._primary_key_of(db_item))])
         self.db.commit()
         self.db.refresh(db_item)
         return db_item
     
-    def update(self, id_value, data: Dict[str, Any]) -> Optional[Any]:
-        db_item = self.get_by_id(id_value)
-        if not db_item:
+    def update(self, id_value, data: Dict[str, Any], skip_none: bool = True) -> Optional[Any]:
+        """
+        Single UPDATE ... WHERE pk; RETURNING gives back the row in the same round trip
+        where the backend supports it, otherwise the row is re-read once after commit.
+        With skip_none (PUT) None values are ignored, without it (PATCH) they clear the column.
+        """
+        if self.router:
+            repository = self._routed(id_value, data)
+            return repository.update(id_value, data, skip_none) if repository else None
+        values = self._column_values(data, skip_none)
+        if not values:
+            return self.get_by_id(id_value)
+        
+        statement = update(self.model).where(*self._primary_key_criteria(id_value)).values(**values)
+        if self.db.get_bind().dialect.update_returning:
+            db_item = self.db.execute(
+                statement.returning(self.model).execution_options(synchronize_session=False)
+            ).scalar_one_or_none()
+            if db_item is None:
+                self.db.rollback()
+                return None
+            self._on_write(id_value)
+            self.change_log.record(self.model.__table__, "update", [self._key_tuple(id_value)])
+            # Keep the returned values loaded instead of expiring them on commit
+            self.db.expunge(db_item)
+            self.db.commit()
+            return db_item
+        
+        result = self.db.execute(statement.execution_options(synchronize_session=False))
+        if result.rowcount == 0:
+            self.db.rollback()
             return None
-            
-        for key, value in data.items():
-            if hasattr(db_item, key) and value is not None:
-                setattr(db_item, key, value)
-                
+        self._on_write(id_value)
+        self.change_log.record(self.model.__table__, "update", [self._key_tuple(id_value)])
         self.db.commit()
-        self.db.refresh(db_item)
-        return db_item
+        return self.get_by_id(id_value)
+    
+    def update_where(self, filters: Dict[str, Any], data: Dict[str, Any]) -> int:
+        """
+        Bulk UPDATE of every row matching the equality filters; returns the row count
+        """
+        if self.router:
+            return sum(self._on_every_shard(lambda repository: repository.update_where(filters, data)))
+        criteria = [self._column(name) == value for name, value in filters.items()]
+        values = self._column_values(data, skip_none=True)
+        self.change_log.record_where(self.model.__table__, "update", criteria)
+        result = self.db.execute(
+            update(self.model).where(*criteria).values(**values).execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+        return result.rowcount
     
     def delete(self, id_value) -> bool:
-        db_item = self.get_by_id(id_value)
-        if not db_item:
-            return False
-            
-        self.db.delete(db_item)
+        if self.router:
+            repository = self._routed(id_value)
+            return repository.delete(id_value) if repository else False
+        # Logged before the DELETE, while the row (and the rows its foreign keys cascade to) still exist
+        self.change_log.record_where(self.model.__table__, "delete", self._primary_key_criteria(id_value))
+        result = self.db.execute(
+            delete(self.model).where(*self._primary_key_criteria(id_value)).execution_options(synchronize_session=False)
+        )
+        if result.rowcount > 0:
+            self._on_write(id_value)
         self.db.commit()
-        return True
+        return result.rowcount > 0
+    
+    def _on_write(self, id_value):
+        """
+        Called inside the transaction of a single-row create/update/delete, before commit;
+        repositories override it to keep derived data in sync
+        """
+        pass
+    
+    def _primary_key_of(self, db_item):
+        values = tuple(getattr(db_item, attribute.key) for attribute in self.statements.primary_key)
+        return values if self.statements.composite else values[0]
+    
+    def _key_tuple(self, id_value) -> Tuple:
+        return id_value if isinstance(id_value, tuple) else (id_value,)
+    
+    def _select(self, fields: Optional[List[str]] = None, list_view: bool = False) -> Select:
+        return self.statements.select(fields, list_view)
+    
+    def _select_where(self, name: str, fields: Optional[List[str]], list_view: bool, build: Callable[[Select], Select]) -> Select:
+        """
+        Cached statement of a repository read: build() adds the criteria, with bindparam() for the values
+        """
+        return self.statements.statement((type(self).__name__, name), fields, list_view,
+                                         lambda: build(self._select(fields, list_view)))
+    
+    def _primary_key_criteria(self, id_value) -> List[Any]:
+        values = id_value if self.statements.composite else (id_value,)
+        return [attribute == value for attribute, value in zip(self.statements.primary_key, values)]
+    
+    def _on_shard(self, session: Session) -> "BaseRepository":
+        return type(self)(session)
+    
+    def _on_shard_of(self, directory: str, key) -> Optional["BaseRepository"]:
+        """
+        This repository on the shard of a customer or order number (None: unknown number)
+        """
+        shard = self.router.shard_of(self.db, directory, key)
+        return self._on_shard(self.router.session(self.db, shard)) if shard is not None else None
+    
+    def _routed(self, id_value, data: Optional[Dict[str, Any]] = None) -> Optional["BaseRepository"]:
+        """
+        This repository on the shard holding the row; rows cannot move to a parent on another shard
+        """
+        key = dict(zip((attribute.key for attribute in self.statements.primary_key), self._key_tuple(id_value)))
+        directory, column = sharding.SHARD_KEYS[self.model.__tablename__]
+        repository = self._on_shard_of(directory, key[column])
+        parent = sharding.PARENT_KEYS.get(self.model.__tablename__)
+        if repository is not None and data and parent and data.get(parent[1]) is not None:
+            if self.router.shard_of(self.db, parent[0], data[parent[1]]) not in (None, repository.db.info[sharding.SHARD]):
+                raise ValueError(f"{parent[1]} {data[parent[1]]} is on another shard")
+        return repository
+    
+    def _placed(self, data: Dict[str, Any]) -> "BaseRepository":
+        return self._on_shard(self.router.place(self.db, self.model.__tablename__, data))
+    
+    def _on_every_shard(self, call: Callable[["BaseRepository"], Any]) -> List[Any]:
+        return self.router.fan_out(self.db, lambda session: call(self._on_shard(session)))
+    
+    def _sharded_page(self, skip: int, limit: Optional[int], fields: Optional[List[str]], criteria: Optional[List[Any]],
+                      order_by: Optional[List[Any]], with_count: bool = False) -> Tuple[List[Any], int]:
+        """
+        Every shard sorts and returns its first skip + limit rows, the merge keeps one page;
+        the primary key orders unsorted lists so pages are stable across shards
+        """
+        order_by = list(order_by or self.statements.primary_key)
+        if fields:
+            # The merge reads the sort columns, keep them loaded
+            fields = list(dict.fromkeys(fields + [name for name, _ in sharding.sort_columns(order_by)]))
+        top = None if limit is None else skip + limit
+        results = self._on_every_shard(lambda repository: (
+            repository.count(criteria) if with_count else 0,
+            repository.get_all(0, top, fields, criteria, order_by),
+        ))
+        items = sharding.merge_sorted([items for _, items in results], order_by, skip, limit)
+        return items, sum(total for total, _ in results)
+    
+    def _column(self, name: str):
+        if name not in self.model.__table__.c:
+            raise ValueError(f"Unknown column: {name}")
+        return getattr(self.model, name)
+    
+    def _column_values(self, data: Dict[str, Any], skip_none: bool) -> Dict[str, Any]:
+        values = {}
+        for key, value in data.items():
+            if key not in self.model.__table__.c or (value is None and skip_none):
+                continue
+            if value is None and not self.model.__table__.c[key].nullable:
+                raise ValueError(f"{key} cannot be null")
+            values[key] = value
+        return values
     
-    def _get_primary_key_name(self) -> str:
-        return list(self.model.__table__.primary_key)[0].name
-
 class CustomerRepository(BaseRepository):
     def __init__(self, db: Session):
         super().__init__(db, Customer)
     
     def get_by_customer_number(self, customer_number: int) -> Customer:
-        return self.db.query(Customer).filter(Customer.customerNumber == customer_number).first()
+        return self.get_by_id(customer_number)
     
     def get_with_orders(self, customer_number: int) -> Customer:
-        return self.db.query(Customer).filter(
-            Customer.customerNumber == customer_number
-        ).first()
+        return self.get_by_id(customer_number)
 
 class EmployeeRepository(BaseRepository):
     def __init__(self, db: Session):
         super().__init__(db, Employee)
     
     def get_by_employee_number(self, employee_number: int) -> Employee:
-        return self.db.query(Employee).filter(Employee.employeeNumber == employee_number).first()
+        return self.get_by_id(employee_number)
     
-    def get_by_office_code(self, office_code: str) -> List[Employee]:
-        return self.db.query(Employee).filter(Employee.officeCode == office_code).all()
+    def get_by_office_code(self, office_code: str, fields: Optional[List[str]] = None) -> List[Employee]:
+        statement = self._select_where("by_office", fields, True, lambda s: s.where(Employee.officeCode == bindparam("office_code")))
+        return self.db.execute(statement, {"office_code": office_code}).scalars().all()
 
 class OfficeRepository(BaseRepository):
     def __init__(self, db: Session):
         super().__init__(db, Office)
     
     def get_by_office_code(self, office_code: str) -> Office:
-        return self.db.query(Office).filter(Office.officeCode == office_code).first()
+        return self.get_by_id(office_code)
 
 class OrderRepository(BaseRepository):
     def __init__(self, db: Session):
         super().__init__(db, Order)
     
     def get_by_order_number(self, order_number: int) -> Order:
-        return self.db.query(Order).filter(Order.orderNumber == order_number).first()
+        return self.get_by_id(order_number)
     
-    def get_by_customer(self, customer_number: int) -> List[Order]:
-        return self.db.query(Order).filter(Order.customerNumber == customer_number).all()
+    def get_by_customer(self, customer_number: int, fields: Optional[List[str]] = None) -> List[Order]:
+        if self.router:
+            repository = self._on_shard_of("customers", customer_number)
+            return repository.get_by_customer(customer_number, fields) if repository else []
+        statement = self._select_where("by_customer", fields, True, lambda s: s.where(Order.customerNumber == bindparam("customer_number")))
+        return self.db.execute(statement, {"customer_number": customer_number}).scalars().all()
     
     def get_orders_with_details(self, order_number: int) -> Order:
-        return self.db.query(Order).filter(Order.orderNumber == order_number).first()
+        return self.get_by_id(order_number)
+    
+    def get_status(self, order_number: int) -> Optional[str]:
+        if self.router:
+            repository = self._routed(order_number)
+            return repository.get_status(order_number) if repository else None
+        # Column read, so no Order instance enters the session ahead of an UPDATE ... RETURNING
+        return self.db.execute(select(Order.status).where(Order.orderNumber == order_number)).scalar()
+    
+    def get_statuses(self, criteria: List[Any]) -> Dict[int, str]:
+        if self.router:
+            return {number: status for statuses in self._on_every_shard(lambda repository: repository.get_statuses(criteria))
+                    for number, status in statuses.items()}
+        return {number: status for number, status in self.db.execute(select(Order.orderNumber, Order.status).where(*criteria))}
+    
+    def update(self, id_value, data: Dict[str, Any], skip_none: bool = True) -> Optional[Any]:
+        if self.router:
+            repository = self._routed(id_value, data)
+            return repository.update(id_value, data, skip_none) if repository else None
+        # Cancelling releases the lines' stock, un-cancelling reserves it again; the
+        # status flip is a conditional UPDATE so two concurrent cancels release once
+        status = data.get("status")
+        if status is not None:
+            try:
+                self._apply_stock_transition(id_value, status)
+            except InsufficientStock:
+                self.db.rollback()
+                raise
+        if self._column_values(data, skip_none):
+            data = {**data, "version": Order.version + 1}
+        return super().update(id_value, data, skip_none)
+    
+    def update_where(self, filters: Dict[str, Any], data: Dict[str, Any]) -> int:
+        return super().update_where(filters, {**data, "version": Order.version + 1})
+    
+    def delete(self, id_value) -> bool:
+        if self.router:
+            repository = self._routed(id_value)
+            return repository.delete(id_value) if repository else False
+        # Lines go with the order (ON DELETE CASCADE), give their stock back first
+        ProductRepository(self.db).release_order_stock(id_value)
+        return super().delete(id_value)
+    
+    def _apply_stock_transition(self, order_number: int, status: str):
+        cancelling = status in CANCELLED_STATUSES
+        flipped = self.db.execute(
+            update(Order)
+            .where(Order.orderNumber == order_number,
+                   Order.status.in_(CANCELLED_STATUSES) if not cancelling else Order.status.notin_(CANCELLED_STATUSES))
+            .values(status=status)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not flipped:
+            return
+        products = ProductRepository(self.db)
+        if cancelling:
+            products.release_order_stock(order_number, include_cancelled=True)
+        else:
+            lines = self.db.execute(
+                select(OrderDetail.productCode, OrderDetail.quantityOrdered).where(OrderDetail.orderNumber == order_number)
+            ).all()
+            products.reserve_stock(dict(lines))
+    
+    def create_with_lines(self, order_data: Dict[str, Any], lines: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        if self.router:
+            return self._placed(order_data).create_with_lines(order_data, lines)
+        # One INSERT for the order, one executemany for all lines, one commit
+        result = self.db.execute(insert(Order.__table__).values(**order_data))
+        order_number = result.inserted_primary_key[0]
+        lines = [{**line, "orderNumber": order_number} for line in lines]
+        if order_data.get("status") not in CANCELLED_STATUSES:
+            try:
+                ProductRepository(self.db).reserve_stock({line["productCode"]: line["quantityOrdered"] for line in lines})
+            except InsufficientStock:
+                self.db.rollback()
+                raise
+        self.db.execute(insert(OrderDetail.__table__), lines)
+        self.refresh_totals([order_number])
+        self.change_log.record(Order.__table__, "insert", [(order_number,)])
+        self.change_log.record(OrderDetail.__table__, "insert", [(order_number, line["productCode"]) for line in lines])
+        self.db.commit()
+        totals = {
+            "totalAmount": sum(line["quantityOrdered"] * line["priceEach"] for line in lines),
+            "lineCount": len(lines),
+            "itemCount": sum(line["quantityOrdered"] for line in lines),
+        }
+        return {**order_data, **totals, "orderNumber": order_number}, lines
+    
+    def refresh_totals(self, order_numbers: Optional[List[int]] = None, number_range: Optional[Tuple[int, int]] = None,
+                       bump_version: bool = False) -> int:
+        """
+        Recomputes totalAmount/lineCount/itemCount from orderdetails with one UPDATE
+        (correlated subqueries), for the given orders, an inclusive orderNumber range,
+        or every order; bump_version also moves their version (a line write).
+        Does not commit, so it joins the caller's transaction.
+        """
+        lines = OrderDetail.__table__
+        same_order = lines.c.orderNumber == Order.orderNumber
+        statement = update(Order).values(
+            totalAmount=select(func.coalesce(func.sum(lines.c.quantityOrdered * lines.c.priceEach), 0)).where(same_order).scalar_subquery(),
+            lineCount=select(func.count()).where(same_order).scalar_subquery(),
+            itemCount=select(func.coalesce(func.sum(lines.c.quantityOrdered), 0)).where(same_order).scalar_subquery(),
+        )
+        if bump_version:
+            statement = statement.values(version=Order.version + 1)
+        if order_numbers is not None:
+            statement = statement.where(Order.orderNumber.in_(order_numbers))
+        if number_range is not None:
+            statement = statement.where(Order.orderNumber.between(*number_range))
+        return self.db.execute(statement.execution_options(synchronize_session=False)).rowcount
+    
+    def timeseries(self, bucket: str, date_column: str, criteria: Optional[List[Any]] = None) -> List[Any]:
+        """
+        Orders per time bucket of `date_column`: count, summed totalAmount and itemCount
+        (from the denormalized totals, so no join with orderdetails)
+        """
+        if self.router:
+            points = sharding.merge_groups(
+                self._on_every_shard(lambda repository: repository.timeseries(bucket, date_column, criteria)),
+                "start", ["count", "totalAmount", "itemCount"]
+            )
+            return [{**point, "totalAmount": round(point["totalAmount"], 2)} for point in points]
+        column = self._column(date_column)
+        start = date_bucket(column, bucket, self.db.get_bind().dialect.name).label("start")
+        statement = (
+            select(
+                start,
+                func.count().label("count"),
+                func.round(func.coalesce(func.sum(Order.totalAmount), 0), 2).label("totalAmount"),
+                func.coalesce(func.sum(Order.itemCount), 0).label("itemCount"),
+            )
+            .where(column.isnot(None), *(criteria or []))
+            .group_by(start)
+            .order_by(start)
+        )
+        return list(self.db.execute(statement).mappings())
+    
+    def find_total_mismatches(self, number_range: Optional[Tuple[int, int]] = None, limit: Optional[int] = None) -> List[Any]:
+        """
+        Orders whose stored totals differ from their lines (amount compared to the cent)
+        """
+        lines = OrderDetail.__table__
+        computed = (
+            select(
+                lines.c.orderNumber,
+                func.sum(lines.c.quantityOrdered * lines.c.priceEach).label("amount"),
+                func.count().label("line_count"),
+                func.sum(lines.c.quantityOrdered).label("item_count"),
+            )
+            .group_by(lines.c.orderNumber)
+            .subquery()
+        )
+        statement = (
+            select(
+                Order.orderNumber, Order.totalAmount, Order.lineCount, Order.itemCount,
+                func.coalesce(computed.c.amount, 0).label("expectedAmount"),
+                func.coalesce(computed.c.line_count, 0).label("expectedLines"),
+                func.coalesce(computed.c.item_count, 0).label("expectedItems"),
+            )
+            .outerjoin(computed, computed.c.orderNumber == Order.orderNumber)
+            .where(or_(
+                func.abs(Order.totalAmount - func.coalesce(computed.c.amount, 0)) >= 0.005,
+                Order.lineCount != func.coalesce(computed.c.line_count, 0),
+                Order.itemCount != func.coalesce(computed.c.item_count, 0),
+            ))
+            .order_by(Order.orderNumber)
+        )
+        if number_range is not None:
+            statement = statement.where(Order.orderNumber.between(*number_range))
+        if limit is not None:
+            statement = statement.limit(limit)
+        return list(self.db.execute(statement))
 
 class OrderDetailRepository(BaseRepository):
     def __init__(self, db: Session):
         super().__init__(db, OrderDetail)
     
-    def get_by_composite_key(self, order_number: int, product_code: str) -> OrderDetail:
-        return self.db.query(OrderDetail).filter(
-            OrderDetail.orderNumber == order_number,
-            OrderDetail.productCode == product_code
-        ).first()
+    def create(self, data: Dict[str, Any]) -> Any:
+        if self.router:
+            return self._placed(data).create(data)
+        # Reserve first: a failed reservation leaves nothing to undo
+        if self._lock_order(data["orderNumber"]):
+            try:
+                ProductRepository(self.db).reserve_stock({data["productCode"]: data["quantityOrdered"]})
+            except InsufficientStock:
+                self.db.rollback()
+                raise
+        return super().create(data)
+    
+    def update(self, id_value, data: Dict[str, Any], skip_none: bool = True) -> Optional[Any]:
+        if self.router:
+            repository = self._routed(id_value, data)
+            return repository.update(id_value, data, skip_none) if repository else None
+        quantity = data.get("quantityOrdered")
+        if quantity is not None:
+            # Reserve or release the difference to the stored quantity
+            order_number, product_code = id_value
+            held, holds = self._held_quantity(id_value)
+            adjusted = 0
+            if held is not None:
+                delta = quantity - held
+                adjusted = self.db.execute(
+                    update(Product)
+                    .where(Product.productCode == product_code, Product.quantityInStock >= delta, *holds)
+                    .values(quantityInStock=Product.quantityInStock - delta)
+                    .execution_options(synchronize_session=False)
+                ).rowcount
+            if not adjusted and self._order_active(order_number) and self.get_by_id(id_value) is not None:
+                self.db.rollback()
+                raise InsufficientStock(product_code)
+            if adjusted:
+                self.change_log.record(Product.__table__, "update", [(product_code,)])
+        return super().update(id_value, data, skip_none)
+    
+    def delete(self, id_value) -> bool:
+        if self.router:
+            repository = self._routed(id_value)
+            return repository.delete(id_value) if repository else False
+        _, product_code = id_value
+        held, holds = self._held_quantity(id_value)
+        released = 0
+        if held is not None:
+            released = self.db.execute(
+                update(Product)
+                .where(Product.productCode == product_code, *holds)
+                .values(quantityInStock=Product.quantityInStock + held)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+        if released:
+            self.change_log.record(Product.__table__, "update", [(product_code,)])
+        return super().delete(id_value)
     
-    def get_by_order_number(self, order_number: int) -> List[OrderDetail]:
-        return self.db.query(OrderDetail).filter(
-            OrderDetail.orderNumber == order_number
-        ).all()
+    def _held_quantity(self, id_value) -> Tuple[Any, List[Any]]:
+        """
+        Stock the line holds and the criteria under which it holds it, for an UPDATE of
+        products: a subquery read inside the UPDATE itself or, with lines on a shard and
+        products at home (SHARDS), the value read beforehand (None: holds nothing)
+        """
+        order_number, _ = id_value
+        if sharding.same_database(self.db, Product.__table__, OrderDetail.__table__):
+            held = select(OrderDetail.quantityOrdered).where(*self._primary_key_criteria(id_value)).scalar_subquery()
+            return held, [exists().where(*self._primary_key_criteria(id_value)), self._active_order_clause(order_number)]
+        # Not atomic across the two databases: concurrent changes of one line may both read the old quantity
+        held = self.db.execute(
+            select(OrderDetail.quantityOrdered)
+            .where(*self._primary_key_criteria(id_value), self._active_order_clause(order_number))
+        ).scalar()
+        return held, []
+    
+    def _on_write(self, id_value):
+        # Keep the order's denormalized totals in the same transaction as the line write
+        order_number, _ = id_value
+        OrderRepository(self.db).refresh_totals([order_number], bump_version=True)
+        self.change_log.record(Order.__table__, "update", [(order_number,)])
+    
+    def replace_order_lines(self, order_number: int, version: int, lines: List[Dict[str, Any]],
+                            default_prices: Dict[str, float]) -> Optional[Dict[str, Any]]:
+        """
+        Makes `lines` the order's whole line set, provided the order is still at `version`:
+        lines missing from it are deleted, new ones inserted and changed ones updated, one
+        batched statement each, with the stock difference reserved or given back and the
+        totals refreshed, in one transaction. A line without priceEach keeps its stored
+        price (new lines get default_prices). Returns None when the order does not exist;
+        raises VersionConflict or InsufficientStock after rolling back.
+        """
+        if self.router:
+            repository = self._on_shard_of("orders", order_number)
+            return repository.replace_order_lines(order_number, version, lines, default_prices) if repository else None
+        # Moving the version first locks the order row: concurrent writers of the order
+        # wait for this transaction, and a stale version changes nothing
+        bumped = self.db.execute(
+            update(Order)
+            .where(Order.orderNumber == order_number, Order.version == version)
+            .values(version=Order.version + 1)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not bumped:
+            current = self.db.execute(select(Order.version).where(Order.orderNumber == order_number)).scalar()
+            self.db.rollback()
+            if current is None:
+                return None
+            raise VersionConflict(order_number, current, version)
+        
+        table = OrderDetail.__table__
+        stored = {
+            row.productCode: row
+            for row in self.db.execute(
+                select(table.c.productCode, table.c.quantityOrdered, table.c.priceEach, table.c.orderLineNumber)
+                .where(table.c.orderNumber == order_number)
+            )
+        }
+        new_lines, inserts, updates = [], [], []
+        for line in lines:
+            row = stored.get(line["productCode"])
+            if line.get("priceEach") is None:
+                line = {**line, "priceEach": row.priceEach if row is not None else default_prices[line["productCode"]]}
+            line = {**line, "orderNumber": order_number}
+            new_lines.append(line)
+            if row is None:
+                inserts.append(line)
+            elif (row.quantityOrdered, row.priceEach, row.orderLineNumber) != (line["quantityOrdered"], line["priceEach"], line["orderLineNumber"]):
+                updates.append(line)
+        wanted = {line["productCode"] for line in new_lines}
+        deletes = [product_code for product_code in stored if product_code not in wanted]
+        
+        if self._order_active(order_number):
+            # Only the difference moves; a negative quantity gives stock back
+            deltas = {line["productCode"]: line["quantityOrdered"] for line in new_lines}
+            for product_code, row in stored.items():
+                deltas[product_code] = deltas.get(product_code, 0) - row.quantityOrdered
+            deltas = {product_code: delta for product_code, delta in deltas.items() if delta}
+            if deltas:
+                try:
+                    ProductRepository(self.db).reserve_stock(deltas)
+                except InsufficientStock:
+                    self.db.rollback()
+                    raise
+        if deletes:
+            self.db.execute(delete(table).where(table.c.orderNumber == order_number, table.c.productCode.in_(deletes)))
+            self.change_log.record(table, "delete", [(order_number, product_code) for product_code in deletes])
+        if updates:
+            # No values(): the SET clause comes from the other keys of the parameter sets
+            self.db.execute(
+                update(table).where(table.c.orderNumber == bindparam("line_order"), table.c.productCode == bindparam("line_product")),
+                [
+                    {"line_order": order_number, "line_product": line["productCode"], "quantityOrdered": line["quantityOrdered"],
+                     "priceEach": line["priceEach"], "orderLineNumber": line["orderLineNumber"]}
+                    for line in updates
+                ],
+            )
+            self.change_log.record(table, "update", [(order_number, line["productCode"]) for line in updates])
+        if inserts:
+            self.db.execute(insert(table), inserts)
+            self.change_log.record(table, "insert", [(order_number, line["productCode"]) for line in inserts])
+        OrderRepository(self.db).refresh_totals([order_number])
+        self.change_log.record(Order.__table__, "update", [(order_number,)])
+        self.db.commit()
+        return {
+            "orderNumber": order_number,
+            "version": version + 1,
+            "totalAmount": sum(line["quantityOrdered"] * line["priceEach"] for line in new_lines),
+            "lineCount": len(new_lines),
+            "itemCount": sum(line["quantityOrdered"] for line in new_lines),
+            "inserted": [line["productCode"] for line in inserts],
+            "updated": [line["productCode"] for line in updates],
+            "deleted": deletes,
+            "orderDetails": new_lines,
+        }
+    
+    def _active_order_clause(self, order_number: int):
+        return exists().where(Order.orderNumber == order_number, Order.status.notin_(CANCELLED_STATUSES))
+    
+    def _order_active(self, order_number: int) -> bool:
+        return bool(self.db.execute(select(self._active_order_clause(order_number))).scalar())
+    
+    def _lock_order(self, order_number: int) -> bool:
+        """
+        Locks the order row until the transaction ends with a no-op UPDATE (in SQLite, the
+        database write lock), then tells whether the order is active. Cancelling or
+        uncancelling the order waits for this transaction, so it cannot happen between
+        the check and the stock reservation.
+        """
+        self.db.execute(
+            update(Order).where(Order.orderNumber == order_number)
+            .values(version=Order.version).execution_options(synchronize_session=False)
+        )
+        return self._order_active(order_number)
+    
+    def get_by_composite_key(self, order_number: int, product_code: str, fields: Optional[List[str]] = None) -> OrderDetail:
+        return self.get_by_id((order_number, product_code), fields)
+    
+    def get_by_order_number(self, order_number: int, fields: Optional[List[str]] = None) -> List[OrderDetail]:
+        if self.router:
+            repository = self._on_shard_of("orders", order_number)
+            return repository.get_by_order_number(order_number, fields) if repository else []
+        statement = self._select_where("by_order", fields, True, lambda s: s.where(OrderDetail.orderNumber == bindparam("order_number")))
+        return self.db.execute(statement, {"order_number": order_number}).scalars().all()
+    
+    def get_product_lines(self, batch_size: int = 100000) -> Iterator[List[Any]]:
+        """
+        Every line as (orderNumber, productCode), streamed in batches
+        """
+        return self.stream_columns(["orderNumber", "productCode"], batch_size)
+    
+    def co_purchases(self, product_code: str) -> Dict[str, int]:
+        """
+        productCode -> orders containing it together with `product_code`; the product's
+        own entry counts the orders containing it
+        """
+        if self.router:
+            totals: Dict[str, int] = {}
+            for counts in self._on_every_shard(lambda repository: repository.co_purchases(product_code)):
+                for code, orders in counts.items():
+                    totals[code] = totals.get(code, 0) + orders
+            return totals
+        other = aliased(OrderDetail)
+        statement = (
+            select(other.productCode, func.count())
+            .select_from(OrderDetail)
+            .join(other, other.orderNumber == OrderDetail.orderNumber)
+            .where(OrderDetail.productCode == product_code)
+            .group_by(other.productCode)
+        )
+        return {code: orders for code, orders in self.db.execute(statement)}
 
 class ProductRepository(BaseRepository):
     def __init__(self, db: Session):
         super().__init__(db, Product)
     
     def get_by_product_code(self, product_code: str) -> Product:
-        return self.db.query(Product).filter(Product.productCode == product_code).first()
+        return self.get_by_id(product_code)
+    
+    def get_by_product_line(self, product_line: str, fields: Optional[List[str]] = None) -> List[Product]:
+        statement = self._select_where("by_line", fields, True, lambda s: s.where(Product.productLine == bindparam("product_line")))
+        return self.db.execute(statement, {"product_line": product_line}).scalars().all()
+    
+    def reserve_stock(self, quantities: Dict[str, int]):
+        """
+        Takes stock for every product with a conditional UPDATE (no locking read), in
+        product code order so concurrent multi-line orders lock rows in the same order.
+        Raises InsufficientStock on the first product short of stock; the caller rolls back.
+        A negative quantity gives stock back.
+        """
+        for product_code in sorted(quantities):
+            quantity = quantities[product_code]
+            taken = self.db.execute(
+                update(Product)
+                .where(Product.productCode == product_code, Product.quantityInStock >= quantity)
+                .values(quantityInStock=Product.quantityInStock - quantity)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not taken:
+                raise InsufficientStock(product_code)
+        self.change_log.record(Product.__table__, "update", [(product_code,) for product_code in sorted(quantities)])
+    
+    def adjust_stock(self, product_code: str, delta: int) -> Optional[int]:
+        """
+        Atomic quantityInStock += delta that never goes below zero; returns the new stock,
+        or None when the product does not exist or has too little stock
+        """
+        adjusted = self.db.execute(
+            update(Product)
+            .where(Product.productCode == product_code, Product.quantityInStock + delta >= 0)
+            .values(quantityInStock=Product.quantityInStock + delta)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not adjusted:
+            self.db.rollback()
+            return None
+        self.change_log.record(Product.__table__, "update", [(product_code,)])
+        self.db.commit()
+        return self.db.execute(select(Product.quantityInStock).where(Product.productCode == product_code)).scalar()
+    
+    def release_order_stock(self, order_number: int, include_cancelled: bool = False) -> int:
+        """
+        Gives back the stock held by an order's lines in one UPDATE; orders already
+        cancelled hold none unless include_cancelled (used right after cancelling)
+        """
+        if not sharding.same_database(self.db, Product.__table__, OrderDetail.__table__):
+            return self._release_lines(order_number, include_cancelled)
+        line_of_order = and_(OrderDetail.orderNumber == order_number, OrderDetail.productCode == Product.productCode)
+        criteria = [exists().where(line_of_order)]
+        if not include_cancelled:
+            criteria.append(exists().where(Order.orderNumber == order_number, Order.status.notin_(CANCELLED_STATUSES)))
+        quantity = select(OrderDetail.quantityOrdered).where(line_of_order).scalar_subquery()
+        self.change_log.record_where(Product.__table__, "update", criteria)
+        return self.db.execute(
+            update(Product).where(*criteria)
+            .values(quantityInStock=Product.quantityInStock + quantity)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    
+    def _release_lines(self, order_number: int, include_cancelled: bool) -> int:
+        # Lines on a shard, products at home (SHARDS): read the lines, then give back product by product
+        criteria = [OrderDetail.orderNumber == order_number]
+        if not include_cancelled:
+            criteria.append(exists().where(Order.orderNumber == order_number, Order.status.notin_(CANCELLED_STATUSES)))
+        lines = sorted(self.db.execute(select(OrderDetail.productCode, OrderDetail.quantityOrdered).where(*criteria)).all())
+        for product_code, quantity in lines:
+            self.db.execute(
+                update(Product).where(Product.productCode == product_code)
+                .values(quantityInStock=Product.quantityInStock + quantity)
+                .execution_options(synchronize_session=False)
+            )
+        self.change_log.record(Product.__table__, "update", [(product_code,) for product_code, _ in lines])
+        return len(lines)
     
-    def get_by_product_line(self, product_line: str) -> List[Product]:
-        return self.db.query(Product).filter(Product.productLine == product_line).all()
+    def get_msrp_by_codes(self, product_codes: List[str]) -> Dict[str, float]:
+        rows = self.db.execute(
+            select(Product.productCode, Product.MSRP).where(Product.productCode.in_(product_codes))
+        )
+        return {code: msrp for code, msrp in rows}
 
 class ProductLineRepository(BaseRepository):
     def __init__(self, db: Session):
         super().__init__(db, ProductLine)
     
     def get_by_product_line(self, product_line: str) -> ProductLine:
-        return self.db.query(ProductLine).filter(ProductLine.productLine == product_line).first()
+        return self.get_by_id(product_line)
 
 class PaymentRepository(BaseRepository):
     def __init__(self, db: Session):
         super().__init__(db, Payment)
     
-    def get_by_composite_key(self, customer_number: int, check_number: str) -> Payment:
-        return self.db.query(Payment).filter(
-            Payment.customerNumber == customer_number,
-            Payment.checkNumber == check_number
-        ).first()
+    def get_by_composite_key(self, customer_number: int, check_number: str, fields: Optional[List[str]] = None) -> Payment:
+        return self.get_by_id((customer_number, check_number), fields)
+    
+    def get_by_customer_number(self, customer_number: int, fields: Optional[List[str]] = None) -> List[Payment]:
+        if self.router:
+            repository = self._on_shard_of("customers", customer_number)
+            return repository.get_by_customer_number(customer_number, fields) if repository else []
+        statement = self._select_where("by_customer", fields, True, lambda s: s.where(Payment.customerNumber == bindparam("customer_number")))
+        return self.db.execute(statement, {"customer_number": customer_number}).scalars().all()
+    
+    def timeseries(self, bucket: str, criteria: Optional[List[Any]] = None) -> List[Any]:
+        """
+        Payments per time bucket of paymentDate: count and summed amount
+        """
+        if self.router:
+            points = sharding.merge_groups(
+                self._on_every_shard(lambda repository: repository.timeseries(bucket, criteria)), "start", ["count", "amount"]
+            )
+            return [{**point, "amount": round(point["amount"], 2)} for point in points]
+        start = date_bucket(Payment.paymentDate, bucket, self.db.get_bind().dialect.name).label("start")
+        statement = (
+            select(start, func.count().label("count"), func.round(func.sum(Payment.amount), 2).label("amount"))
+            .where(*(criteria or []))
+            .group_by(start)
+            .order_by(start)
+        )
+        return list(self.db.execute(statement).mappings())
+
+class TableVersionRepository:
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def get_versions(self, table_names: List[str]) -> Dict[str, int]:
+        rows = self.db.execute(
+            select(TableVersion.tableName, TableVersion.version).where(TableVersion.tableName.in_(table_names))
+        )
+        return {name: version for name, version in rows}
+    
+    def bump_many(self, table_names: Iterable[str]):
+        """
+        Bumps several tables with one UPDATE and does not commit, so the new versions
+        commit together with the caller's writes. Rows are locked in table name order.
+        """
+        names = sorted(table_names)
+        result = self.db.execute(
+            update(TableVersion).where(TableVersion.tableName.in_(names))
+            .values(version=TableVersion.version + 1).execution_options(synchronize_session=False)
+        )
+        if result.rowcount < len(names):
+            existing = self.get_versions(names)
+            self.db.execute(insert(TableVersion), [{"tableName": name, "version": 1} for name in names if name not in existing])
+    
+    def ensure(self, table_names: Iterable[str]):
+        """
+        Creates missing version rows up front, so concurrent first writes only UPDATE them
+        """
+        missing = set(table_names) - set(self.get_versions(list(table_names)))
+        if not missing:
+            return
+        try:
+            self.db.execute(insert(TableVersion), [{"tableName": name, "version": 0} for name in sorted(missing)])
+            self.db.commit()
+        except IntegrityError:
+            # Another worker created them first
+            self.db.rollback()
+    
+    def bump(self, table_name: str) -> int:
+        """
+        Bumps one table and commits. A missing row is created; when another worker creates
+        it first, the bump is an UPDATE of that row instead of an IntegrityError.
+        """
+        if not self._increment(table_name):
+            try:
+                self.db.execute(insert(TableVersion).values(tableName=table_name, version=1))
+                self.db.commit()
+            except IntegrityError:
+                self.db.rollback()
+                self._increment(table_name)
+                self.db.commit()
+        else:
+            self.db.commit()
+        return self.get_versions([table_name])[table_name]
+    
+    def _increment(self, table_name: str) -> bool:
+        result = self.db.execute(
+            update(TableVersion).where(TableVersion.tableName == table_name)
+            .values(version=TableVersion.version + 1).execution_options(synchronize_session=False)
+        )
+        return result.rowcount > 0
+
+def mark_written(db: Session, table: Table, keys: Optional[Iterable[Tuple]] = None):
+    """
+    Notes a table written in the session's current transaction (see cache.result_cache,
+    cache.stale_cache), and for KEYED_TABLES the keys of the rows written (None: any row)
+    """
+    db.info.setdefault(WRITTEN_TABLES, set()).add(table.name)
+    if table.name in KEYED_TABLES:
+        written = db.info.setdefault(WRITTEN_KEYS, {})
+        if keys is None:
+            written[table.name] = None
+        elif written.get(table.name, ()) is not None:
+            written.setdefault(table.name, set()).update(keys)
+
+def encode_row_key(key: Tuple) -> str:
+    return "|".join(str(value) for value in key)
+
+def decode_row_key(table: Table, row_key: str) -> Dict[str, Any]:
+    columns = list(table.primary_key)
+    values = row_key.split("|", len(columns) - 1)
+    return {column.name: column.type.python_type(value) for column, value in zip(columns, values)}
+
+class ChangeLogRepository:
+    """
+    Writes and reads the change feed. Writers call it inside their own transaction,
+    before commit, so a change becomes visible together with the write itself. Every
+    table it is told about is also marked as written, with or without CHANGE_FEED.
+    """
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def record(self, table: Table, operation: str, keys: List[Tuple]):
+        if not keys:
+            return
+        mark_written(self.db, table, keys)
+        sharding.note_written(self.db, table, keys)
+        if not CHANGE_FEED:
+            return
+        changed_at = datetime.utcnow()
+        self.db.execute(insert(Change), [
+            {"tableName": table.name, "rowKey": encode_row_key(key), "operation": operation, "changedAt": changed_at}
+            for key in keys
+        ])
+    
+    def record_where(self, table: Table, operation: str, criteria: List[Any]):
+        """
+        Logs every row of `table` matching `criteria` with one INSERT ... SELECT. For
+        deletes, also the rows that the foreign keys' ON DELETE rules remove or update.
+        """
+        mark_written(self.db, table)
+        if operation == "delete":
+            self._record_cascades(table, criteria)
+        on_shard = not sharding.same_database(self.db, table, Change.__table__)
+        if on_shard or (sharding.router is not None and table.name in sharding.REPLICATED_TABLES):
+            # The rows are on a shard and the changes at home, or the replicas need the keys (SHARDS)
+            keys = [tuple(row) for row in self.db.execute(select(*table.primary_key).where(*criteria))]
+            self.record(table, operation, keys)
+            return
+        if not CHANGE_FEED:
+            return
+        columns = list(table.primary_key)
+        row_key = cast(columns[0], String)
+        for column in columns[1:]:
+            row_key = row_key + "|" + cast(column, String)
+        rows = select(
+            literal(table.name), row_key, literal(operation), literal(datetime.utcnow(), DateTime)
+        ).select_from(table).where(*criteria)
+        self.db.execute(insert(Change).from_select(["tableName", "rowKey", "operation", "changedAt"], rows))
+    
+    def _record_cascades(self, table: Table, criteria: List[Any]):
+        # SQLite runs without PRAGMA foreign_keys here, so nothing cascades there
+        if self.db.get_bind().dialect.name == "sqlite":
+            return
+        for child in table.metadata.sorted_tables:
+            for foreign_key in child.foreign_keys:
+                if foreign_key.column.table is not table or foreign_key.ondelete not in ("CASCADE", "SET NULL"):
+                    continue
+                # Foreign keys do not act across databases (reference tables at home, customer data on shards)
+                if not sharding.same_database(self.db, table, child):
+                    continue
+                child_criteria = [foreign_key.parent.in_(select(foreign_key.column).where(*criteria))]
+                self.record_where(child, "delete" if foreign_key.ondelete == "CASCADE" else "update", child_criteria)
+    
+    def head(self) -> int:
+        return self.db.execute(select(func.max(Change.id))).scalar() or 0
+    
+    def oldest(self) -> Optional[int]:
+        return self.db.execute(select(func.min(Change.id))).scalar()
+    
+    def get_changes(self, since: int, table_names: Optional[List[str]] = None, limit: int = 500) -> List[Change]:
+        statement = select(Change).where(Change.id > since)
+        if table_names:
+            statement = statement.where(Change.tableName.in_(table_names))
+        return list(self.db.execute(statement.order_by(Change.id).limit(limit)).scalars())
+    
+    def get_rows(self, table: Table, row_keys: List[str]) -> Dict[str, Any]:
+        """
+        Current rows for the given encoded keys in one query; deleted rows are absent
+        """
+        router = sharding.router_for(self.db, table.name)
+        if router:
+            return {row_key: row for rows in router.fan_out(self.db, lambda session: ChangeLogRepository(session).get_rows(table, row_keys))
+                    for row_key, row in rows.items()}
+        columns = list(table.primary_key)
+        keys = [tuple(decode_row_key(table, row_key).values()) for row_key in row_keys]
+        if len(columns) == 1:
+            criteria = columns[0].in_([key[0] for key in keys])
+        else:
+            criteria = tuple_(*columns).in_(keys)
+        rows = self.db.execute(select(table).where(criteria)).mappings()
+        return {encode_row_key(tuple(row[column.name] for column in columns)): dict(row) for row in rows}
+    
+    def purge(self, older_than: datetime) -> int:
+        """
+        Deletes changes logged before `older_than`; the newest change is always kept so
+        the id sequence (the cursor) never restarts
+        """
+        result = self.db.execute(
+            delete(Change).where(Change.changedAt < older_than, Change.id < self.head())
+            .execution_options(synchronize_session=False)
+        )
+        self.db.commit()
+        return result.rowcount
+
+
+class ImportCheckpointRepository:
+    """
+    Progress of bulk imports; save() does not commit, so the importer commits it together
+    with the chunk of rows it describes
+    """
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def get(self, import_id: str) -> Dict[str, ImportCheckpoint]:
+        checkpoints = self.db.execute(select(ImportCheckpoint).where(ImportCheckpoint.importId == import_id)).scalars()
+        return {checkpoint.tableName: checkpoint for checkpoint in checkpoints}
+    
+    def save(self, import_id: str, table_name: str, rows_loaded: int, finished: bool = False):
+        values = {"rowsLoaded": rows_loaded, "updatedAt": datetime.utcnow()}
+        if finished:
+            values["finishedAt"] = values["updatedAt"]
+        result = self.db.execute(
+            update(ImportCheckpoint)
+            .where(ImportCheckpoint.importId == import_id, ImportCheckpoint.tableName == table_name)
+            .values(**values).execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            self.db.execute(insert(ImportCheckpoint).values(importId=import_id, tableName=table_name, **values))
+    
+    def reset(self, import_id: str):
+        self.db.execute(delete(ImportCheckpoint).where(ImportCheckpoint.importId == import_id))
+        self.db.commit()
+
+
+# Columns, row count (None when unknown up front) and rows of a report
+ReportResult = Tuple[List[str], Optional[int], Iterable[Tuple]]
+
+class ReportRepository:
+    """
+    Aggregations and exports run by background jobs; cancelled orders are left out of revenue
+    """
+    
+    def __init__(self, db: Session):
+        self.db = db
+        # With SHARDS every shard runs the report on its own rows and reference replicas
+        self.router = sharding.router_for(db)
+    
+    def sales_by_employee(self, year: Optional[int] = None) -> ReportResult:
+        if self.router:
+            return self._merge_totals(self._on_every_shard(lambda repository: repository.sales_by_employee(year)), 4,
+                                      lambda row: (-row[6], row[0]))
+        orders_joined = [Order.customerNumber == Customer.customerNumber, Order.status.notin_(CANCELLED_STATUSES)]
+        if year is not None:
+            orders_joined.append(Order.orderDate.between(date(year, 1, 1), date(year, 12, 31)))
+        revenue = func.round(func.coalesce(func.sum(Order.totalAmount), 0), 2).label("revenue")
+        statement = (
+            select(
+                Employee.employeeNumber, Employee.lastName, Employee.firstName, Employee.officeCode,
+                func.count(func.distinct(Customer.customerNumber)).label("customers"),
+                func.count(Order.orderNumber).label("orders"),
+                revenue,
+            )
+            .select_from(Employee)
+            .join(Customer, Customer.salesRepEmployeeNumber == Employee.employeeNumber)
+            .outerjoin(Order, and_(*orders_joined))
+            .group_by(Employee.employeeNumber, Employee.lastName, Employee.firstName, Employee.officeCode)
+            .order_by(revenue.desc(), Employee.employeeNumber)
+        )
+        rows = [tuple(row) for row in self.db.execute(statement)]
+        return list(statement.selected_columns.keys()), len(rows), rows
+    
+    def sales_by_product_line(self, year: Optional[int] = None) -> ReportResult:
+        if self.router:
+            columns, _, rows = self._merge_totals(
+                self._on_every_shard(lambda repository: repository.sales_by_product_line(year)), 1, lambda row: -row[3]
+            )
+            # Margin from the summed revenue and cost rather than the sum of rounded margins
+            return columns, len(rows), [row[:5] + (round(row[3] - row[4], 2),) for row in rows]
+        criteria = [Order.status.notin_(CANCELLED_STATUSES)]
+        if year is not None:
+            criteria.append(Order.orderDate.between(date(year, 1, 1), date(year, 12, 31)))
+        revenue = func.round(func.sum(OrderDetail.quantityOrdered * OrderDetail.priceEach), 2).label("revenue")
+        cost = func.round(func.sum(OrderDetail.quantityOrdered * Product.buyPrice), 2).label("cost")
+        statement = (
+            select(
+                Product.productLine,
+                func.count(func.distinct(OrderDetail.orderNumber)).label("orders"),
+                func.sum(OrderDetail.quantityOrdered).label("quantity"),
+                revenue,
+                cost,
+                func.round(revenue - cost, 2).label("margin"),
+            )
+            .select_from(OrderDetail)
+            .join(Product, Product.productCode == OrderDetail.productCode)
+            .join(Order, Order.orderNumber == OrderDetail.orderNumber)
+            .where(*criteria)
+            .group_by(Product.productLine)
+            .order_by(revenue.desc())
+        )
+        rows = [tuple(row) for row in self.db.execute(statement)]
+        return list(statement.selected_columns.keys()), len(rows), rows
+    
+    def orders_export(self, status: Optional[str] = None, customer_number: Optional[int] = None,
+                      date_from: Optional[date] = None, date_to: Optional[date] = None) -> ReportResult:
+        if self.router:
+            results = self._on_every_shard(lambda repository: repository.orders_export(status, customer_number, date_from, date_to))
+            rows = heapq.merge(*(rows for _, _, rows in results), key=lambda row: row[0])
+            return results[0][0], sum(total for _, total, _ in results), rows
+        criteria = []
+        if status is not None:
+            criteria.append(Order.status == status)
+        if customer_number is not None:
+            criteria.append(Order.customerNumber == customer_number)
+        if date_from is not None:
+            criteria.append(Order.orderDate >= date_from)
+        if date_to is not None:
+            criteria.append(Order.orderDate <= date_to)
+        total = self.db.execute(select(func.count()).select_from(Order).where(*criteria)).scalar()
+        columns = [column for column in Order.__table__.columns]
+        # Streamed in batches, the export is never held in memory
+        rows = self.db.execute(
+            select(*columns).where(*criteria).order_by(Order.orderNumber).execution_options(yield_per=2000)
+        )
+        return [column.name for column in columns], total, (tuple(row) for row in rows)
+    
+    def _on_every_shard(self, call: Callable[["ReportRepository"], ReportResult]) -> List[ReportResult]:
+        return self.router.fan_out(self.db, lambda session: call(ReportRepository(session)), local=True)
     
-    def get_by_customer_number(self, customer_number: int) -> List[Payment]:
-        return self.db.query(Payment).filter(Payment.customerNumber == customer_number).all()
\ No newline at end of file
+    def _merge_totals(self, results: List[ReportResult], keys: int, sort_key: Callable[[Tuple], Any]) -> ReportResult:
+        """
+        Per-shard report rows -> one row per value of the first `keys` columns, the other columns added up
+        """
+        merged: Dict[Tuple, Tuple] = {}
+        for _, _, rows in results:
+            for row in rows:
+                current = merged.get(row[:keys])
+                merged[row[:keys]] = row if current is None else row[:keys] + tuple(
+                    round(total + value, 2) if isinstance(value, float) else total + value
+                    for total, value in zip(current[keys:], row[keys:])
+                )
+        rows = sorted(merged.values(), key=sort_key)
+        return results[0][0], len(rows), rows
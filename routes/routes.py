@@ -7,10 +7,16 @@ from controllers.controller import (
     OrderDetailController, 
     ProductController, 
     ProductLineController, 
-    PaymentController
+    PaymentController,
+    ChangeController,
+    JobController,
+    AnalyticsController,
+    AdminController
 )
 
 from controllers.auth_controller import AuthController
+from controllers.metrics_controller import MetricsController
+from controllers.events_controller import OrderEventsController
 
 def setup_routes() -> APIRouter:
     api_router = APIRouter()
@@ -24,17 +30,30 @@ def setup_routes() -> APIRouter:
     product_controller = ProductController()
     product_line_controller = ProductLineController()
     payment_controller = PaymentController()
+    change_controller = ChangeController()
+    job_controller = JobController()
+    analytics_controller = AnalyticsController()
+    admin_controller = AdminController()
     auth_controller = AuthController()
+    metrics_controller = MetricsController()
+    order_events_controller = OrderEventsController()
     
     # Include routers
     api_router.include_router(customer_controller.router)
     api_router.include_router(employee_controller.router)
     api_router.include_router(office_controller.router)
+    # Before the order routes, or /orders/{order_number} would claim /orders/events
+    api_router.include_router(order_events_controller.router)
     api_router.include_router(order_controller.router)
     api_router.include_router(order_detail_controller.router)
     api_router.include_router(product_controller.router)
     api_router.include_router(product_line_controller.router)
     api_router.include_router(payment_controller.router)
+    api_router.include_router(change_controller.router)
+    api_router.include_router(job_controller.router)
+    api_router.include_router(analytics_controller.router)
+    api_router.include_router(admin_controller.router)
     api_router.include_router(auth_controller.router)
+    api_router.include_router(metrics_controller.router)
     
     return api_router
\ No newline at end of file
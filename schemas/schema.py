@@ -1,6 +1,6 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List, Dict, Any
-from datetime import date
+from pydantic import BaseModel, ConfigDict, Field, create_model
+from typing import Optional, List, Dict, Any, Type
+from datetime import date, datetime
 
 # Customer Schemas
 class CustomerBase(BaseModel):
@@ -111,10 +111,31 @@ class OrderUpdate(OrderBase):
 
 class OrderResponse(OrderBase):
     orderNumber: int
+    totalAmount: float = 0
+    lineCount: int = 0
+    itemCount: int = 0
+    version: int = 1
     
     class Config:
         orm_mode = True
 
+class OrderFilter(BaseModel):
+    status: Optional[str] = None
+    customerNumber: Optional[int] = None
+
+class OrderBulkUpdate(BaseModel):
+    filter: OrderFilter
+    values: OrderUpdate
+
+class OrderLineCreate(BaseModel):
+    productCode: str
+    quantityOrdered: int = Field(..., gt=0)
+    priceEach: Optional[float] = None  # defaults to the product MSRP
+    orderLineNumber: Optional[int] = None  # defaults to the position in `lines`
+
+class OrderWithLinesCreate(OrderBase):
+    lines: List[OrderLineCreate] = Field(..., min_length=1)
+
 # OrderDetail Schemas
 class OrderDetailBase(BaseModel):
     orderNumber: int
@@ -135,6 +156,25 @@ class OrderDetailResponse(OrderDetailBase):
     class Config:
         orm_mode = True
 
+class OrderWithLinesResponse(OrderResponse):
+    orderDetails: List[OrderDetailResponse]
+
+class OrderLinesReplace(BaseModel):
+    version: int  # the order's version the lines were read at
+    lines: List[OrderLineCreate]  # priceEach defaults to the stored price, then the MSRP
+
+class OrderLinesReplaceResponse(BaseModel):
+    orderNumber: int
+    version: int
+    totalAmount: float
+    lineCount: int
+    itemCount: int
+    # Product codes of the lines each statement touched
+    inserted: List[str]
+    updated: List[str]
+    deleted: List[str]
+    orderDetails: List[OrderDetailResponse]
+
 # Product Schemas
 class ProductBase(BaseModel):
     productName: str
@@ -165,6 +205,33 @@ class ProductResponse(ProductBase):
     class Config:
         orm_mode = True
 
+class ProductFilter(BaseModel):
+    productLine: Optional[str] = None
+    productVendor: Optional[str] = None
+
+class ProductBulkUpdate(BaseModel):
+    filter: ProductFilter
+    values: ProductUpdate
+
+class StockAdjustment(BaseModel):
+    # Relative change applied atomically, e.g. +120 for a delivery, -3 for breakage
+    delta: int
+
+class StockResponse(BaseModel):
+    productCode: str
+    quantityInStock: int
+
+class ProductRecommendation(BaseModel):
+    productCode: str
+    # Orders containing both products, and their share of the orders containing the requested one
+    orders: int
+    confidence: float
+
+class ProductRecommendationsResponse(BaseModel):
+    productCode: str
+    orders: int
+    recommendations: List[ProductRecommendation]
+
 # ProductLine Schemas
 class ProductLineBase(BaseModel):
     productLine: str
@@ -208,4 +275,136 @@ class PaginatedResponse(BaseModel):
     total: int
     page: int
     size: int
-    pages: int
\ No newline at end of file
+    pages: int
+
+class BulkUpdateResponse(BaseModel):
+    updated: int
+
+# Change feed (GET /changes)
+class ChangeEntry(BaseModel):
+    id: int
+    table: str
+    operation: str
+    key: Dict[str, Any]
+    # Current row, null when it no longer exists
+    data: Optional[Dict[str, Any]] = None
+    changedAt: datetime
+
+class ChangeFeedResponse(BaseModel):
+    changes: List[ChangeEntry]
+    next: int
+    has_more: bool
+
+# Background report jobs (POST /jobs/{report})
+class SalesReportParams(BaseModel):
+    year: Optional[int] = None
+
+class OrdersExportParams(BaseModel):
+    status: Optional[str] = None
+    customerNumber: Optional[int] = None
+    dateFrom: Optional[date] = None
+    dateTo: Optional[date] = None
+
+class JobResponse(BaseModel):
+    id: str
+    report: str
+    params: Dict[str, Any]
+    status: str
+    rows: int
+    total: Optional[int] = None
+    progress: Optional[float] = None
+    error: Optional[str] = None
+    createdAt: datetime
+    startedAt: Optional[datetime] = None
+    finishedAt: Optional[datetime] = None
+    expiresAt: Optional[datetime] = None
+    resultUrl: Optional[str] = None
+
+# Time-bucketed aggregates (GET /orders/timeseries, /payments/timeseries); start = first day of the bucket
+class OrderTimeseriesPoint(BaseModel):
+    start: date
+    count: int
+    totalAmount: float
+    itemCount: int
+
+class OrderTimeseriesResponse(BaseModel):
+    bucket: str
+    field: str
+    points: List[OrderTimeseriesPoint]
+
+class PaymentTimeseriesPoint(BaseModel):
+    start: date
+    count: int
+    amount: float
+
+class PaymentTimeseriesResponse(BaseModel):
+    bucket: str
+    field: str
+    points: List[PaymentTimeseriesPoint]
+
+# Pricing analytics (GET /analytics/pricing/...)
+class PricingGroupStats(BaseModel):
+    group: str
+    count: int
+    sum: float
+    mean: float
+    min: float
+    max: float
+    percentiles: Dict[str, float]
+
+class PricingDistributionResponse(BaseModel):
+    metric: str
+    groupBy: Optional[str] = None
+    groups: List[PricingGroupStats]
+
+class PricingHistogramResponse(BaseModel):
+    metric: str
+    groupBy: Optional[str] = None
+    group: Optional[str] = None
+    edges: List[float]
+    counts: List[int]
+
+class PricingOutlier(BaseModel):
+    productCode: str
+    # Set for order-line metrics (realized_ratio)
+    orderNumber: Optional[int] = None
+    group: str
+    value: float
+    lower: float
+    upper: float
+
+class PricingOutliersResponse(BaseModel):
+    metric: str
+    groupBy: Optional[str] = None
+    k: float
+    total: int
+    outliers: List[PricingOutlier]
+
+# Bulk import (POST /admin/import)
+class ImportTableResult(BaseModel):
+    table: str
+    rows: int
+    resumedFrom: int
+    alreadyImported: bool
+    seconds: float
+    rowsPerSec: float
+
+class ImportResponse(BaseModel):
+    importId: str
+    tables: List[ImportTableResult]
+    rows: int
+
+# Sparse fieldsets (?fields=): every field optional, routes use response_model_exclude_unset
+# so fields that were not selected are left out instead of returned as null
+def sparse(model: Type[BaseModel]) -> Type[BaseModel]:
+    fields = {name: (Optional[field.annotation], None) for name, field in model.model_fields.items()}
+    return create_model(f"{model.__name__.replace('Response', '')}Fields", __config__=ConfigDict(from_attributes=True), **fields)
+
+CustomerFields = sparse(CustomerResponse)
+EmployeeFields = sparse(EmployeeResponse)
+OfficeFields = sparse(OfficeResponse)
+OrderFields = sparse(OrderResponse)
+OrderDetailFields = sparse(OrderDetailResponse)
+ProductFields = sparse(ProductResponse)
+ProductLineFields = sparse(ProductLineResponse)
+PaymentFields = sparse(PaymentResponse)
@@ -0,0 +1,46 @@
+"""
+Maintenance of the change feed (`changes` table behind GET /changes).
+
+    python -m scripts.change_feed head               # current cursor
+    python -m scripts.change_feed purge --days 30    # drop changes older than 30 days
+
+Clients whose cursor falls before the oldest retained change get 410 from
+GET /changes and must do a full download again, so keep --days above the longest
+expected sync interval.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from repositories.repositories import ChangeLogRepository
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Inspect or purge the change feed")
+    parser.add_argument("command", choices=["head", "purge"])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"),
+                        help="defaults to DATABASE_URL, then the MySQL settings from .env")
+    parser.add_argument("--days", type=float, default=30, help="retention when purging")
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        engine = create_engine(args.database_url)
+    else:
+        from database.base import engine
+
+    with Session(engine) as db:
+        repository = ChangeLogRepository(db)
+        if args.command == "purge":
+            purged = repository.purge(datetime.utcnow() - timedelta(days=args.days))
+            print(f"Purged {purged} changes older than {args.days:g} days")
+        print(f"Oldest retained change: {repository.oldest() or '-'}, head: {repository.head()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""
+Creates the indexes declared on the models that an existing database lacks.
+
+    python -m scripts.create_indexes            # create missing indexes
+    python -m scripts.create_indexes --dry-run  # only list them
+
+create_all (run at startup) creates indexes together with new tables only, so
+databases created before an index was added to a model need this once.
+"""
+import argparse
+import os
+import sys
+import time
+from typing import List, Optional
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.engine import Engine
+
+from database.base import Base
+import models.models  # noqa: F401 - register tables on Base.metadata
+
+
+def missing_indexes(engine: Engine) -> List:
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing.extend(index for index in sorted(table.indexes, key=lambda index: index.name) if index.name not in existing)
+    return missing
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Create indexes declared on the models that are missing in the database")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"),
+                        help="defaults to DATABASE_URL, then the MySQL settings from .env")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        engine = create_engine(args.database_url)
+    else:
+        from database.base import engine
+
+    indexes = missing_indexes(engine)
+    if not indexes:
+        print("No missing indexes")
+        return 0
+    for index in indexes:
+        columns = ", ".join(column.name for column in index.columns)
+        if args.dry_run:
+            print(f"missing  {index.table.name}.{index.name} ({columns})")
+            continue
+        started = time.perf_counter()
+        index.create(bind=engine)
+        print(f"created  {index.table.name}.{index.name} ({columns}) in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
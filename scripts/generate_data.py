@@ -0,0 +1,525 @@
+"""
+Synthetic data generator for the ClassicModels schema.
+
+Produces referentially valid offices, employee hierarchies, customers, product
+lines, products, orders, order details and payments at any scale. Customers and
+products are drawn with a Zipf-like skew so a few hot customers place most
+orders and a few best sellers appear on most lines. Output is deterministic
+for a given --seed and set of counts.
+
+    python -m scripts.generate_data --database-url sqlite:///./big.db --scale 1000 --reset
+    python -m scripts.generate_data --scale 10000 --loader load-data   # MySQL LOAD DATA LOCAL INFILE
+
+At --scale 1 the row counts are close to the original ClassicModels sample;
+--scale 10000 gives about 3.3M orders and 25M order lines.
+"""
+import argparse
+import bisect
+import csv
+import itertools
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import Table, create_engine, event
+from sqlalchemy.engine import Engine
+
+from database.base import Base
+from models.models import Customer, Employee, Office, Order, OrderDetail, Payment, Product, ProductLine
+
+PRODUCT_LINES = ["Mobil Klasik", "Sepeda Motor", "Pesawat", "Kapal", "Kereta Api", "Truk dan Bus", "Mobil Antik"]
+TERRITORIES = ["APAC", "EMEA", "NA", "LATAM"]
+CITIES = {
+    "APAC": [("Jakarta", "Indonesia"), ("Surabaya", "Indonesia"), ("Singapore", "Singapore"), ("Sydney", "Australia"), ("Tokyo", "Japan")],
+    "EMEA": [("London", "UK"), ("Paris", "France"), ("Berlin", "Germany"), ("Madrid", "Spain")],
+    "NA": [("New York", "USA"), ("San Francisco", "USA"), ("Boston", "USA"), ("Toronto", "Canada")],
+    "LATAM": [("Sao Paulo", "Brazil"), ("Mexico City", "Mexico"), ("Bogota", "Colombia")],
+}
+FIRST_NAMES = ["Budi", "Dewi", "Agus", "Siti", "Rudi", "Maya", "Andi", "Lina", "Eko", "Sri", "John", "Mary", "Anna", "Luis", "Kenji", "Fatima"]
+LAST_NAMES = ["Wijaya", "Surya", "Sanjaya", "Gunawan", "Kusuma", "Hidayat", "Santoso", "Smith", "Garcia", "Tanaka", "Muller", "Rossi"]
+VENDORS = ["Diecast Indonesia", "Kreasi Logam Klasik", "Miniatur Jalur 66", "Diecast Bintang Merah", "Seni Klasik Motor City",
+           "Autoart Studio", "Exoto Designs", "Gearbox Collectibles", "Highway 66 Mini Classics", "Welly Diecast"]
+SCALES = ["1:10", "1:12", "1:18", "1:24", "1:32", "1:50", "1:72", "1:700"]
+
+
+@dataclass
+class GeneratorConfig:
+    offices: int = 7
+    employees: int = 23
+    customers: int = 122
+    product_lines: int = 7
+    products: int = 110
+    orders: int = 326
+    max_lines_per_order: int = 18
+    payment_ratio: float = 0.85
+    customer_skew: float = 0.9
+    product_skew: float = 0.8
+    start_date: date = date(2016, 1, 1)
+    years: int = 10
+    seed: int = 42
+
+    @classmethod
+    def for_scale(cls, scale: float, **overrides) -> "GeneratorConfig":
+        # Transactional tables grow linearly, the catalog and staff sub-linearly
+        root = math.sqrt(scale)
+        config = cls(
+            offices=max(7, int(7 * root ** 0.5)),
+            employees=max(23, int(23 * root)),
+            customers=max(122, int(122 * scale)),
+            product_lines=7,
+            products=max(110, int(110 * root)),
+            orders=max(326, int(326 * scale)),
+        )
+        for key, value in overrides.items():
+            if value is not None:
+                setattr(config, key, value)
+        return config
+
+
+@dataclass
+class GeneratedKeys:
+    offices: List[str] = field(default_factory=list)
+    employees: List[int] = field(default_factory=list)
+    sales_reps: List[int] = field(default_factory=list)
+    customers: List[int] = field(default_factory=list)
+    products: List[str] = field(default_factory=list)
+    product_msrp: List[float] = field(default_factory=list)
+    first_order: int = 10100
+    last_order: int = 10099
+
+
+class SkewedPicker:
+    """
+    Picks indexes 0..n-1 with weight 1 / (rank + 1) ** skew after a seeded shuffle,
+    so the hot items are spread over the key space instead of being the lowest keys.
+    """
+
+    def __init__(self, n: int, skew: float, rng: random.Random):
+        ranks = list(range(n))
+        rng.shuffle(ranks)
+        total = 0.0
+        self.cumulative = [0.0] * n
+        weights = [1.0 / (rank + 1) ** skew for rank in ranks]
+        for i, weight in enumerate(weights):
+            total += weight
+            self.cumulative[i] = total
+        self.total = total
+
+    def pick(self, rng: random.Random) -> int:
+        return bisect.bisect_left(self.cumulative, rng.random() * self.total)
+
+
+def generate_offices(config: GeneratorConfig, keys: GeneratedKeys) -> Iterator[Dict[str, Any]]:
+    rng = random.Random(config.seed * 31 + 1)
+    for n in range(1, config.offices + 1):
+        territory = TERRITORIES[(n - 1) % len(TERRITORIES)]
+        city, country = rng.choice(CITIES[territory])
+        code = str(n)
+        keys.offices.append(code)
+        yield {
+            "officeCode": code,
+            "city": city,
+            "phone": f"+{rng.randint(1, 99)} {rng.randint(100, 999)} {rng.randint(1000, 9999)}",
+            "addressLine1": f"{rng.randint(1, 300)} Main Street",
+            "addressLine2": None if rng.random() < 0.5 else f"Floor {rng.randint(1, 40)}",
+            "state": None,
+            "country": country,
+            "postalCode": str(rng.randint(10000, 99999)),
+            "territory": territory,
+        }
+
+
+def generate_employees(config: GeneratorConfig, keys: GeneratedKeys) -> Iterator[Dict[str, Any]]:
+    """
+    President -> VPs at the first office -> one sales manager per office -> sales reps.
+    Managers are always emitted before the people reporting to them.
+    """
+    rng = random.Random(config.seed * 31 + 2)
+    numbers = itertools.count(1002)
+
+    def employee(office: str, reports_to: Optional[int], title: str) -> Dict[str, Any]:
+        number = next(numbers)
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        keys.employees.append(number)
+        return {
+            "employeeNumber": number,
+            "lastName": last,
+            "firstName": first,
+            "extension": f"x{rng.randint(1000, 9999)}",
+            "email": f"{first[0].lower()}{last.lower()}{number}@classicmodelcars.com",
+            "officeCode": office,
+            "reportsTo": reports_to,
+            "jobTitle": title,
+        }
+
+    hq = keys.offices[0]
+    president = employee(hq, None, "President")
+    yield president
+    vp_sales = employee(hq, president["employeeNumber"], "VP Sales")
+    yield vp_sales
+    yield employee(hq, president["employeeNumber"], "VP Marketing")
+
+    managers = []
+    for office in keys.offices:
+        manager = employee(office, vp_sales["employeeNumber"], "Sales Manager")
+        managers.append(manager)
+        yield manager
+
+    for i in range(max(1, config.employees - len(keys.employees))):
+        manager = managers[i % len(managers)]
+        rep = employee(manager["officeCode"], manager["employeeNumber"], "Sales Rep")
+        keys.sales_reps.append(rep["employeeNumber"])
+        yield rep
+
+
+def generate_customers(config: GeneratorConfig, keys: GeneratedKeys) -> Iterator[Dict[str, Any]]:
+    rng = random.Random(config.seed * 31 + 3)
+    for number in range(103, 103 + config.customers):
+        territory = rng.choice(TERRITORIES)
+        city, country = rng.choice(CITIES[territory])
+        keys.customers.append(number)
+        yield {
+            "customerNumber": number,
+            "customerName": f"{rng.choice(['PT', 'CV', 'UD', 'Toko', 'Ltd'])} {rng.choice(LAST_NAMES)} {number}",
+            "contactLastName": rng.choice(LAST_NAMES),
+            "contactFirstName": rng.choice(FIRST_NAMES),
+            "phone": f"{rng.randint(100, 999)}-{rng.randint(1000000, 9999999)}",
+            "addressLine1": f"{rng.randint(1, 500)} Market Road",
+            "addressLine2": None,
+            "city": city,
+            "state": None,
+            "postalCode": str(rng.randint(10000, 99999)),
+            "country": country,
+            "salesRepEmployeeNumber": rng.choice(keys.sales_reps) if rng.random() < 0.9 else None,
+            "creditLimit": round(rng.uniform(0, 250000), 2),
+        }
+
+
+def generate_product_lines(config: GeneratorConfig, keys: GeneratedKeys) -> Iterator[Dict[str, Any]]:
+    rng = random.Random(config.seed * 31 + 4)
+    for n in range(config.product_lines):
+        name = PRODUCT_LINES[n] if n < len(PRODUCT_LINES) else f"Koleksi {n + 1}"
+        yield {
+            "productLine": name,
+            "textDescription": f"{name}: " + " ".join(rng.choice(LAST_NAMES).lower() for _ in range(60)),
+            "htmlDescription": None,
+            "image": None,
+        }
+
+
+def generate_products(config: GeneratorConfig, keys: GeneratedKeys) -> Iterator[Dict[str, Any]]:
+    rng = random.Random(config.seed * 31 + 5)
+    lines = [PRODUCT_LINES[n] if n < len(PRODUCT_LINES) else f"Koleksi {n + 1}" for n in range(config.product_lines)]
+    for n in range(config.products):
+        scale = rng.choice(SCALES)
+        code = f"S{scale.split(':')[1]}_{n + 1000:06d}"
+        buy_price = round(rng.uniform(15, 110), 2)
+        msrp = round(buy_price * rng.uniform(1.3, 2.3), 2)
+        keys.products.append(code)
+        keys.product_msrp.append(msrp)
+        yield {
+            "productCode": code,
+            "productName": f"{rng.choice(LAST_NAMES)} {rng.choice(['GT', 'Classic', 'Special', 'Turbo', 'Royal'])} {1900 + rng.randint(0, 120)}",
+            "productLine": rng.choice(lines),
+            "productScale": scale,
+            "productVendor": rng.choice(VENDORS),
+            "productDescription": " ".join(rng.choice(FIRST_NAMES).lower() for _ in range(40)),
+            "quantityInStock": rng.randint(0, 10000),
+            "buyPrice": buy_price,
+            "MSRP": msrp,
+        }
+
+
+def generate_orders(config: GeneratorConfig, keys: GeneratedKeys) -> Iterator[Dict[str, List[Dict[str, Any]]]]:
+    """
+    Yields one {"orders": [...], "orderdetails": [...], "payments": [...]} chunk per
+    order, so the loader can keep parents ahead of children in every batch.
+    """
+    rng = random.Random(config.seed * 31 + 6)
+    customer_picker = SkewedPicker(len(keys.customers), config.customer_skew, rng)
+    product_picker = SkewedPicker(len(keys.products), config.product_skew, rng)
+    span_days = config.years * 365
+    today = config.start_date + timedelta(days=span_days)
+    max_lines = min(config.max_lines_per_order, len(keys.products))
+
+    for i in range(config.orders):
+        order_number = keys.first_order + i
+        # Orders arrive in date order, like a real auto-increment key
+        order_date = config.start_date + timedelta(days=i * span_days // max(1, config.orders))
+        customer = keys.customers[customer_picker.pick(rng)]
+        age = (today - order_date).days
+        if age > 30:
+            status = "Cancelled" if rng.random() < 0.02 else "Shipped"
+        else:
+            status = rng.choice(["In Process", "On Hold", "Shipped", "Shipped"])
+        shipped = order_date + timedelta(days=rng.randint(1, 6)) if status == "Shipped" else None
+
+        line_count = min(max_lines, 1 + int(rng.expovariate(1 / 8)))
+        chosen = set()
+        while len(chosen) < line_count:
+            chosen.add(product_picker.pick(rng))
+        details = []
+        total = 0.0
+        for line_number, product_index in enumerate(chosen, start=1):
+            quantity = rng.randint(10, 60)
+            price = round(keys.product_msrp[product_index] * rng.uniform(0.8, 1.0), 2)
+            total += quantity * price
+            details.append({
+                "orderNumber": order_number,
+                "productCode": keys.products[product_index],
+                "quantityOrdered": quantity,
+                "priceEach": price,
+                "orderLineNumber": line_number,
+            })
+
+        payments = []
+        if shipped is not None and rng.random() < config.payment_ratio:
+            payments.append({
+                "customerNumber": customer,
+                "checkNumber": f"{rng.choice('ABCDEFGHJKMNPQRSTUVWXYZ')}{rng.choice('ABCDEFGHJKMNPQRSTUVWXYZ')}{order_number}",
+                "paymentDate": shipped + timedelta(days=rng.randint(0, 30)),
+                "amount": round(total, 2),
+            })
+
+        keys.last_order = order_number
+        yield {
+            "orders": [{
+                "orderNumber": order_number,
+                "orderDate": order_date,
+                "requiredDate": order_date + timedelta(days=rng.randint(7, 14)),
+                "shippedDate": shipped,
+                "status": status,
+                "comments": None if rng.random() < 0.8 else "Check on availability.",
+                "customerNumber": customer,
+                "totalAmount": round(total, 2),
+                "lineCount": len(details),
+                "itemCount": sum(line["quantityOrdered"] for line in details),
+            }],
+            "orderdetails": details,
+            "payments": payments,
+        }
+
+
+class InsertLoader:
+    """
+    Batched executemany INSERTs through SQLAlchemy Core; mysql-connector rewrites
+    these into multi-row INSERT statements.
+    """
+
+    def __init__(self, engine: Engine, batch_size: int):
+        self.engine = engine
+        self.batch_size = batch_size
+
+    def load(self, table: Table, rows: Iterator[Dict[str, Any]]) -> int:
+        count = 0
+        with self.engine.begin() as conn:
+            for batch in _batched(rows, self.batch_size):
+                conn.execute(table.insert(), batch)
+                count += len(batch)
+        return count
+
+    def load_grouped(self, tables: List[Table], chunks: Iterator[Dict[str, List[Dict[str, Any]]]], progress) -> Dict[str, int]:
+        counts = {table.name: 0 for table in tables}
+        buffers = {table.name: [] for table in tables}
+
+        def flush(conn):
+            # Parents first so foreign keys hold inside every batch
+            for table in tables:
+                if buffers[table.name]:
+                    conn.execute(table.insert(), buffers[table.name])
+                    counts[table.name] += len(buffers[table.name])
+                    buffers[table.name] = []
+
+        with self.engine.connect() as conn:
+            for chunk in chunks:
+                for name, rows in chunk.items():
+                    buffers[name].extend(rows)
+                if len(buffers["orderdetails"]) >= self.batch_size:
+                    flush(conn)
+                    conn.commit()
+                    progress(counts)
+            flush(conn)
+            conn.commit()
+        return counts
+
+
+class MySQLLoadDataLoader(InsertLoader):
+    """
+    Writes CSV chunks to a temp directory and loads them with LOAD DATA LOCAL INFILE.
+    Needs local_infile enabled on the server.
+    """
+
+    chunk_rows = 1_000_000
+
+    def _load_csv(self, conn, table: Table, rows: List[Dict[str, Any]]):
+        columns = [column.name for column in table.columns]
+        with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            for row in rows:
+                writer.writerow(["\\N" if row[name] is None else row[name] for name in columns])
+            path = f.name
+        try:
+            conn.exec_driver_sql(
+                f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {table.name} "
+                f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\n' "
+                f"({', '.join(columns)})"
+            )
+        finally:
+            os.remove(path)
+
+    def load(self, table: Table, rows: Iterator[Dict[str, Any]]) -> int:
+        count = 0
+        with self.engine.begin() as conn:
+            for batch in _batched(rows, self.chunk_rows):
+                self._load_csv(conn, table, batch)
+                count += len(batch)
+        return count
+
+    def load_grouped(self, tables: List[Table], chunks: Iterator[Dict[str, List[Dict[str, Any]]]], progress) -> Dict[str, int]:
+        counts = {table.name: 0 for table in tables}
+        buffers = {table.name: [] for table in tables}
+        with self.engine.connect() as conn:
+            for chunk in itertools.chain(chunks, [None]):
+                if chunk is not None:
+                    for name, rows in chunk.items():
+                        buffers[name].extend(rows)
+                if chunk is None or len(buffers["orderdetails"]) >= self.chunk_rows:
+                    for table in tables:
+                        if buffers[table.name]:
+                            self._load_csv(conn, table, buffers[table.name])
+                            counts[table.name] += len(buffers[table.name])
+                            buffers[table.name] = []
+                    conn.commit()
+                    progress(counts)
+        return counts
+
+
+def _batched(rows: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    iterator = iter(rows)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _tune_for_bulk_load(engine: Engine):
+    if engine.dialect.name == "sqlite":
+        @event.listens_for(engine, "connect")
+        def _sqlite_bulk_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("PRAGMA synchronous = OFF")
+            cursor.execute("PRAGMA journal_mode = MEMORY")
+            cursor.execute("PRAGMA cache_size = -200000")
+            cursor.close()
+    elif engine.dialect.name == "mysql":
+        # Rows are referentially valid by construction
+        @event.listens_for(engine, "connect")
+        def _mysql_bulk_session(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute("SET FOREIGN_KEY_CHECKS = 0")
+            cursor.execute("SET UNIQUE_CHECKS = 0")
+            cursor.close()
+
+
+def generate(engine: Engine, config: GeneratorConfig, loader: str = "insert", batch_size: int = 20000,
+             reset: bool = False, verbose: bool = True) -> GeneratedKeys:
+    """
+    Generate and load a full ClassicModels dataset into `engine`. Returns the keys
+    that were generated so callers (benchmarks) can pick valid ids.
+    """
+    _tune_for_bulk_load(engine)
+    if reset:
+        Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+    if loader == "load-data":
+        if engine.dialect.name != "mysql":
+            raise ValueError("--loader load-data needs a MySQL database")
+        bulk = MySQLLoadDataLoader(engine, batch_size)
+    else:
+        bulk = InsertLoader(engine, batch_size)
+
+    keys = GeneratedKeys()
+
+    def log(message: str):
+        if verbose:
+            print(message, flush=True)
+
+    for model, generator in (
+        (Office, generate_offices),
+        (Employee, generate_employees),
+        (Customer, generate_customers),
+        (ProductLine, generate_product_lines),
+        (Product, generate_products),
+    ):
+        started = time.perf_counter()
+        count = bulk.load(model.__table__, generator(config, keys))
+        elapsed = time.perf_counter() - started
+        log(f"{model.__tablename__:14} {count:>12,} rows {elapsed:8.2f}s {count / max(elapsed, 1e-9):>12,.0f} rows/s")
+
+    started = time.perf_counter()
+
+    def progress(counts: Dict[str, int]):
+        elapsed = time.perf_counter() - started
+        lines = counts["orderdetails"]
+        log(f"  orders {counts['orders']:>12,}  orderdetails {lines:>12,}  payments {counts['payments']:>10,}"
+            f"  {lines / max(elapsed, 1e-9):>10,.0f} lines/s")
+
+    tables = [Order.__table__, OrderDetail.__table__, Payment.__table__]
+    counts = bulk.load_grouped(tables, generate_orders(config, keys), progress)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    log(f"orders+lines+payments {total:>12,} rows {elapsed:8.2f}s {total / max(elapsed, 1e-9):>12,.0f} rows/s")
+    return keys
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate synthetic ClassicModels data")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"),
+                        help="defaults to DATABASE_URL, then the MySQL settings from .env")
+    parser.add_argument("--scale", type=float, default=1.0, help="1 ~ original sample size; orders and lines grow linearly")
+    parser.add_argument("--offices", type=int)
+    parser.add_argument("--employees", type=int)
+    parser.add_argument("--customers", type=int)
+    parser.add_argument("--product-lines", type=int)
+    parser.add_argument("--products", type=int)
+    parser.add_argument("--orders", type=int)
+    parser.add_argument("--max-lines-per-order", type=int)
+    parser.add_argument("--customer-skew", type=float, help="Zipf exponent for orders per customer")
+    parser.add_argument("--product-skew", type=float, help="Zipf exponent for lines per product")
+    parser.add_argument("--start-date", type=date.fromisoformat)
+    parser.add_argument("--years", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--loader", choices=["insert", "load-data"], default="insert")
+    parser.add_argument("--batch-size", type=int, default=20000)
+    parser.add_argument("--reset", action="store_true", help="drop and recreate the ClassicModels tables first")
+    args = parser.parse_args(argv)
+
+    config = GeneratorConfig.for_scale(
+        args.scale,
+        offices=args.offices, employees=args.employees, customers=args.customers,
+        product_lines=args.product_lines, products=args.products, orders=args.orders,
+        max_lines_per_order=args.max_lines_per_order, customer_skew=args.customer_skew,
+        product_skew=args.product_skew, start_date=args.start_date, years=args.years, seed=args.seed,
+    )
+
+    if args.database_url:
+        connect_args = {"allow_local_infile": True} if args.loader == "load-data" else {}
+        engine = create_engine(args.database_url, connect_args=connect_args)
+    else:
+        from database.base import engine
+
+    print(f"Generating {config}")
+    generate(engine, config, loader=args.loader, batch_size=args.batch_size, reset=args.reset)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""
+Bulk import of SQL dumps and CSV files into the ClassicModels tables.
+
+    python -m scripts.import_data data_dump.sql
+    python -m scripts.import_data offices.csv employees.csv customers.csv orders.csv orderdetails.csv
+    python -m scripts.import_data export.csv --table payments --drop-indexes
+
+A dump's INSERT statements may come in any table order: they are loaded parents
+first. A CSV file holds one table, named by --table or the file name, with the
+column names in its header row. Running the same command again after an
+interruption resumes after the last committed chunk; --restart starts over.
+"""
+import argparse
+import os
+import sys
+from contextlib import ExitStack
+from typing import List, Optional
+
+from sqlalchemy import create_engine
+
+from importer.importer import IMPORT_TABLES, ImportConflict, Importer, InvalidImportFile, Source, TableResult
+
+
+def _print_progress(result: TableResult):
+    print(f"{result.table:14} {result.resumed_from + result.rows:>12,} rows {result.seconds:8.2f}s {result.rows_per_sec:>12,.0f} rows/s",
+          flush=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Import SQL dumps and CSV files into the ClassicModels tables")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--table", choices=sorted(IMPORT_TABLES), help="table of the CSV files; only this table of SQL dumps")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"),
+                        help="defaults to DATABASE_URL, then the MySQL settings from .env")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per INSERT statement")
+    parser.add_argument("--commit-every", type=int, default=50000, help="rows per transaction (and checkpoint)")
+    parser.add_argument("--drop-indexes", action="store_true", help="drop secondary indexes while loading, rebuild them after")
+    parser.add_argument("--restart", action="store_true", help="ignore the progress of an earlier, interrupted import")
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        engine = create_engine(args.database_url)
+    else:
+        from database.base import engine
+
+    importer = Importer(engine, batch_size=args.batch_size, commit_rows=args.commit_every,
+                        drop_indexes=args.drop_indexes, progress=_print_progress)
+    try:
+        with ExitStack() as files:
+            sources = [Source(path, files.enter_context(open(path, "rb")), args.table) for path in args.files]
+            results = importer.run(sources, restart=args.restart)
+    except (InvalidImportFile, ImportConflict) as e:
+        print(f"Import failed: {e}", file=sys.stderr)
+        return 1
+
+    for result in results:
+        if result.skipped:
+            print(f"{result.table:14} already imported ({result.resumed_from:,} rows)")
+    print(f"Imported {sum(result.rows for result in results):,} rows")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Consistency check and bulk repair for the denormalized order totals
+(orders.totalAmount, lineCount, itemCount) against orderdetails.
+
+    python -m scripts.order_totals check                 # exit code 1 when totals drifted
+    python -m scripts.order_totals repair --batch-size 50000
+    python -m scripts.order_totals repair --add-columns  # existing databases: add the columns first
+
+Repair recomputes totals with one UPDATE per orderNumber range, committing per batch
+so locks stay short on large tables.
+"""
+import argparse
+import os
+import sys
+import time
+from typing import Optional, List
+
+from sqlalchemy import create_engine, func, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from models.models import Order
+from repositories.repositories import OrderRepository
+
+
+def add_missing_columns(engine: Engine) -> List[str]:
+    """
+    create_all does not alter existing tables; adds the totals and version columns
+    (and index) when missing
+    """
+    existing = {column["name"] for column in inspect(engine).get_columns("orders")}
+    added = []
+    with engine.begin() as conn:
+        for name in ("totalAmount", "lineCount", "itemCount", "version"):
+            if name in existing:
+                continue
+            column = Order.__table__.c[name]
+            column_type = column.type.compile(dialect=engine.dialect)
+            default = column.server_default.arg
+            conn.execute(text(f"ALTER TABLE orders ADD COLUMN {name} {column_type} NOT NULL DEFAULT {default}"))
+            added.append(name)
+        if "totalAmount" in added:
+            for index in Order.__table__.indexes:
+                if "totalAmount" in index.columns:
+                    index.create(conn, checkfirst=True)
+    return added
+
+
+def repair(engine: Engine, batch_size: int = 50000, verbose: bool = True) -> int:
+    with Session(engine) as db:
+        low, high = db.execute(select(func.min(Order.orderNumber), func.max(Order.orderNumber))).one()
+        if low is None:
+            return 0
+        repository = OrderRepository(db)
+        updated = 0
+        started = time.perf_counter()
+        for first in range(low, high + 1, batch_size):
+            updated += repository.refresh_totals(number_range=(first, first + batch_size - 1))
+            db.commit()
+            if verbose:
+                print(f"  orders {first}..{min(first + batch_size - 1, high)}: {updated} refreshed, {time.perf_counter() - started:.1f}s")
+        return updated
+
+
+def check(engine: Engine, limit: int = 20) -> int:
+    with Session(engine) as db:
+        mismatches = OrderRepository(db).find_total_mismatches()
+    for row in mismatches[:limit]:
+        print(f"  order {row.orderNumber}: stored {row.totalAmount:.2f}/{row.lineCount}/{row.itemCount}, "
+              f"expected {row.expectedAmount:.2f}/{row.expectedLines}/{row.expectedItems}")
+    if len(mismatches) > limit:
+        print(f"  ... and {len(mismatches) - limit} more")
+    return len(mismatches)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Check or repair denormalized order totals")
+    parser.add_argument("command", choices=["check", "repair"])
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"),
+                        help="defaults to DATABASE_URL, then the MySQL settings from .env")
+    parser.add_argument("--batch-size", type=int, default=50000, help="orders per UPDATE when repairing")
+    parser.add_argument("--add-columns", action="store_true", help="add the totals and version columns to an existing orders table")
+    args = parser.parse_args(argv)
+
+    if args.database_url:
+        engine = create_engine(args.database_url)
+    else:
+        from database.base import engine
+
+    if args.add_columns:
+        added = add_missing_columns(engine)
+        print(f"Added columns: {', '.join(added)}" if added else "Totals and version columns already present")
+
+    if args.command == "repair":
+        updated = repair(engine, args.batch_size)
+        print(f"Recomputed totals for {updated} orders")
+        return 0
+
+    mismatches = check(engine)
+    print(f"{mismatches} orders with inconsistent totals")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
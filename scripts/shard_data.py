@@ -0,0 +1,243 @@
+"""
+Splits the customer data of the home database over the shards configured in SHARDS
+and fills the shard directory.
+
+    python -m scripts.shard_data                   # split (re-runnable)
+    python -m scripts.shard_data --purge-home      # split, then delete the moved rows at home
+    python -m scripts.shard_data --sync-reference  # only copy the reference tables to the shards
+    python -m scripts.shard_data --reconcile       # repair after writes failed between their commits
+
+A customer goes to the shard of its sales rep's office territory, its orders, order
+lines and payments with it. The shards' customer tables and the directory are rebuilt
+from the home database each run, so run it before serving with SHARDS (or during a
+write freeze): rows written on the shards since the last split are replaced.
+
+--reconcile changes no customer data. It repairs what a write that failed between its
+shard and home commits leaves behind (see database.sharding): directory entries without
+a row, rows without a directory entry, changes of rows that do not exist, and the table
+versions caches compare. Entries that look dangling are checked again after --grace
+seconds, so writes in flight are not mistaken for failed ones.
+"""
+import argparse
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.orm import Session
+
+from database import sharding
+from database.base import Base, engine
+from models.models import Change, Customer, Employee, Office, Order, ShardKey, ShardSequence
+from repositories.repositories import TableVersionRepository, decode_row_key
+
+
+def _customer_shards(router: sharding.ShardRouter) -> Dict[int, str]:
+    statement = (
+        select(Customer.customerNumber, Office.territory)
+        .select_from(Customer)
+        .outerjoin(Employee, Employee.employeeNumber == Customer.salesRepEmployeeNumber)
+        .outerjoin(Office, Office.officeCode == Employee.officeCode)
+    )
+    with engine.connect() as conn:
+        return {number: router.territories.get(territory, router.default) for number, territory in conn.execute(statement)}
+
+
+def _copy_table(router: sharding.ShardRouter, table_name: str, shard_of_row, batch_size: int) -> Counter:
+    """
+    Streams the table from home and inserts each row on its shard, batch_size rows per INSERT
+    """
+    table = Base.metadata.tables[table_name]
+    copied: Counter = Counter()
+    batches: Dict[str, List[Dict]] = defaultdict(list)
+
+    def flush(shard: str):
+        with router.engines[shard].begin() as conn:
+            conn.execute(insert(table), batches[shard])
+        copied[shard] += len(batches[shard])
+        batches[shard] = []
+
+    with engine.connect() as conn:
+        rows = conn.execution_options(yield_per=batch_size).execute(select(table)).mappings()
+        for row in rows:
+            shard = shard_of_row(row)
+            batches[shard].append(dict(row))
+            if len(batches[shard]) >= batch_size:
+                flush(shard)
+    for shard in list(batches):
+        if batches[shard]:
+            flush(shard)
+    return copied
+
+
+def _write_directory(table_name: str, shards: Dict[int, str], batch_size: int):
+    numbers = sorted(shards)
+    with engine.begin() as conn:
+        conn.execute(delete(ShardKey).where(ShardKey.tableName == table_name))
+        for start in range(0, len(numbers), batch_size):
+            conn.execute(insert(ShardKey), [
+                {"tableName": table_name, "keyValue": number, "shard": shards[number]} for number in numbers[start:start + batch_size]
+            ])
+        conn.execute(delete(ShardSequence).where(ShardSequence.tableName == table_name))
+        last = conn.execute(select(func.max(ShardKey.keyValue)).where(ShardKey.tableName == table_name)).scalar() or 0
+        conn.execute(insert(ShardSequence).values(tableName=table_name, lastValue=last))
+
+
+def _directory_state(router: sharding.ShardRouter, directory: str) -> Tuple[Dict[int, str], Dict[int, str]]:
+    """
+    ({key: shard} of the directory, {key: shard} of the rows actually on the shards)
+    """
+    column = Base.metadata.tables[directory].c[sharding.SHARD_KEYS[directory][1]]
+    with engine.connect() as conn:
+        entries = {key: shard for key, shard in conn.execute(
+            select(ShardKey.keyValue, ShardKey.shard).where(ShardKey.tableName == directory)
+        )}
+    rows: Dict[int, str] = {}
+    for name, shard_engine in router.engines.items():
+        with shard_engine.connect() as conn:
+            rows.update((key, name) for key, in conn.execute(select(column)))
+    return entries, rows
+
+
+def _reconcile_directory(router: sharding.ShardRouter, directory: str, grace: float, batch_size: int) -> Counter:
+    entries, rows = _directory_state(router, directory)
+    fixed: Counter = Counter()
+    with engine.begin() as conn:
+        missing = [{"tableName": directory, "keyValue": key, "shard": shard} for key, shard in rows.items() if key not in entries]
+        for start in range(0, len(missing), batch_size):
+            conn.execute(insert(ShardKey), missing[start:start + batch_size])
+        fixed["added"] = len(missing)
+        # A row that is not on its entry's shard (written by hand elsewhere) keeps its entry pointed at it
+        for key, shard in rows.items():
+            if key in entries and entries[key] != shard:
+                conn.execute(update(ShardKey).where(ShardKey.tableName == directory, ShardKey.keyValue == key).values(shard=shard))
+                fixed["moved"] += 1
+    dangling = {key for key in entries if key not in rows}
+    if dangling:
+        time.sleep(grace)
+        entries, rows = _directory_state(router, directory)
+        dangling = sorted(key for key in dangling if key in entries and key not in rows)
+        with engine.begin() as conn:
+            for start in range(0, len(dangling), batch_size):
+                conn.execute(delete(ShardKey).where(
+                    ShardKey.tableName == directory, ShardKey.keyValue.in_(dangling[start:start + batch_size])
+                ))
+        fixed["deleted"] = len(dangling)
+    return fixed
+
+
+def _reconcile_changes(router: sharding.ShardRouter, since: datetime, batch_size: int) -> Counter:
+    """
+    Logs a "delete" for every row of a sharded table whose latest change since `since`
+    is not a delete but that no shard has: its changes committed, its write did not
+    """
+    logged: Counter = Counter()
+    with engine.connect() as conn:
+        latest: Dict[Tuple[str, str], str] = {}
+        for table_name, row_key, operation in conn.execute(
+            select(Change.tableName, Change.rowKey, Change.operation)
+            .where(Change.tableName.in_(sharding.SHARDED_TABLES), Change.changedAt >= since)
+            .order_by(Change.id)
+        ):
+            latest[(table_name, row_key)] = operation
+    for table_name in sharding.SHARDED_TABLES:
+        table = Base.metadata.tables[table_name]
+        columns = [column.name for column in table.primary_key]
+        row_keys = [row_key for (name, row_key), operation in latest.items() if name == table_name and operation != "delete"]
+        keys = {tuple(decode_row_key(table, row_key)[name] for name in columns): row_key for row_key in row_keys}
+        present: Set[Tuple] = set()
+        for shard_engine in router.engines.values():
+            with shard_engine.connect() as conn:
+                batch = list(keys)
+                for start in range(0, len(batch), batch_size):
+                    statement = select(*table.primary_key).where(sharding.key_criteria(table, batch[start:start + batch_size]))
+                    present.update(tuple(row) for row in conn.execute(statement))
+        gone = [row_key for key, row_key in keys.items() if key not in present]
+        if gone:
+            changed_at = datetime.utcnow()
+            with engine.begin() as conn:
+                conn.execute(insert(Change), [
+                    {"tableName": table_name, "rowKey": row_key, "operation": "delete", "changedAt": changed_at} for row_key in gone
+                ])
+        logged[table_name] = len(gone)
+    return logged
+
+
+def reconcile(router: sharding.ShardRouter, grace: float, since: datetime, batch_size: int) -> int:
+    for directory in sharding.DIRECTORIES:
+        fixed = _reconcile_directory(router, directory, grace, batch_size)
+        print(f"shard_keys {directory}: {fixed['added']} added, {fixed['moved']} repointed, {fixed['deleted']} dangling deleted")
+    logged = _reconcile_changes(router, since, batch_size)
+    print("changes: " + ", ".join(f"{count} delete(s) logged for {name}" for name, count in logged.items()))
+    # Caches may hold data a half-committed write changed without moving the versions
+    with Session(engine) as db:
+        TableVersionRepository(db).bump_many(sharding.SHARDED_TABLES)
+        db.commit()
+    print(f"table_versions bumped for {', '.join(sharding.SHARDED_TABLES)}")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Split the customer data of the home database over the SHARDS")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--purge-home", action="store_true", help="delete the customer data from the home database afterwards")
+    parser.add_argument("--sync-reference", action="store_true", help="only copy the reference tables to the shards")
+    parser.add_argument("--reconcile", action="store_true", help="only repair the directory, change feed and table versions")
+    parser.add_argument("--grace", type=float, default=30.0, help="seconds before dangling directory entries are checked again")
+    parser.add_argument("--since-hours", type=float, default=24.0, help="how far back --reconcile checks the change feed")
+    args = parser.parse_args(argv)
+
+    router = sharding.router
+    if router is None:
+        print("SHARDS is not set", file=sys.stderr)
+        return 1
+
+    if args.reconcile:
+        return reconcile(router, args.grace, datetime.utcnow() - timedelta(hours=args.since_hours), args.batch_size)
+
+    started = time.perf_counter()
+    Base.metadata.create_all(bind=engine)
+    router.create_schema()
+    router.replicate({name: None for name in sharding.REPLICATED_TABLES})
+    print(f"Reference tables ({', '.join(sharding.REPLICATED_TABLES)}) copied to {', '.join(router.names)}")
+    if args.sync_reference:
+        return 0
+
+    # Children first, so ON DELETE rules have nothing left to do
+    for shard_engine in router.engines.values():
+        with shard_engine.begin() as conn:
+            for table_name in reversed(sharding.SHARDED_TABLES):
+                conn.execute(delete(Base.metadata.tables[table_name]))
+
+    customers = _customer_shards(router)
+    # Orders of unknown customers go where the API would put them
+    with engine.connect() as conn:
+        orders = {
+            number: customers.get(customer_number, router.default)
+            for number, customer_number in conn.execute(select(Order.orderNumber, Order.customerNumber))
+        }
+    copied = {
+        "customers": _copy_table(router, "customers", lambda row: customers[row["customerNumber"]], args.batch_size),
+        "orders": _copy_table(router, "orders", lambda row: orders[row["orderNumber"]], args.batch_size),
+        "orderdetails": _copy_table(router, "orderdetails", lambda row: orders.get(row["orderNumber"], router.default), args.batch_size),
+        "payments": _copy_table(router, "payments", lambda row: customers.get(row["customerNumber"], router.default), args.batch_size),
+    }
+    _write_directory("customers", customers, args.batch_size)
+    _write_directory("orders", orders, args.batch_size)
+
+    if args.purge_home:
+        with engine.begin() as conn:
+            for table_name in reversed(sharding.SHARDED_TABLES):
+                conn.execute(delete(Base.metadata.tables[table_name]))
+
+    print(f"{'table':14}" + "".join(f"{name:>12}" for name in router.names))
+    for table_name, counts in copied.items():
+        print(f"{table_name:14}" + "".join(f"{counts[name]:>12,}" for name in router.names))
+    print(f"Done in {time.perf_counter() - started:.1f}s" + (", customer data deleted at home" if args.purge_home else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,56 +1,219 @@
+from sqlalchemy import and_, inspect, not_, or_
 from sqlalchemy.orm import Session
 from repositories.repositories import (
     CustomerRepository, EmployeeRepository, OfficeRepository, 
     OrderRepository, OrderDetailRepository, ProductRepository, 
-    ProductLineRepository, PaymentRepository
+    ProductLineRepository, PaymentRepository, ChangeLogRepository, ReportRepository,
+    CANCELLED_STATUSES, TIME_BUCKETS, InsufficientStock, VersionConflict, decode_row_key
 )
 from schemas.schema import (
     CustomerCreate, CustomerUpdate, EmployeeCreate, EmployeeUpdate,
     OfficeCreate, OfficeUpdate, OrderCreate, OrderUpdate,
     OrderDetailCreate, OrderDetailUpdate, ProductCreate, ProductUpdate,
-    ProductLineCreate, ProductLineUpdate, PaymentCreate, PaymentUpdate
+    ProductLineCreate, ProductLineUpdate, PaymentCreate, PaymentUpdate,
+    OrderWithLinesCreate, OrderLinesReplace, SalesReportParams, OrdersExportParams
 )
-from typing import Dict, List, Any, Optional, Tuple
+from typing import BinaryIO, Dict, List, Any, Optional, Tuple
 from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+from auth.auth import User
+from analytics import pricing
+from cache import reference_snapshot, result_cache, shared_cache
+from database.base import engine
+from events import events
+from importer import importer
+from jobs import jobs
+from recommendations import recommendations
+from models.models import Customer, Employee, Office, Order, OrderDetail, Payment, Product, ProductLine
+from datetime import date, datetime, timedelta
+import os
+import threading
+
+# Tables served by GET /changes
+FEED_TABLES = {
+    model.__tablename__: model.__table__
+    for model in (Customer, Employee, Office, Order, OrderDetail, Product, ProductLine, Payment)
+}
+
+# Changes younger than this are held back: a lower id may still belong to an uncommitted transaction
+CHANGE_FEED_SETTLE_SECONDS = float(os.getenv("CHANGE_FEED_SETTLE_SECONDS", "1"))
+CHANGE_FEED_MAX_LIMIT = 5000
+
+# Date columns of orders that can be filtered by range and bucketed by /orders/timeseries
+ORDER_DATE_FIELDS = ("orderDate", "requiredDate", "shippedDate")
+
+# One bulk import at a time per worker process; imports share the tables and their indexes
+IMPORT_LOCK = threading.Lock()
+# The API import runs inside the request, larger files go through scripts/import_data.py
+IMPORT_MAX_UPLOAD_MB = float(os.getenv("IMPORT_MAX_UPLOAD_MB", "10"))
+
+# Reports run as background jobs: parameter schema and the query the job runs
+REPORTS = {
+    "sales-by-employee": (SalesReportParams, lambda repository, params: repository.sales_by_employee(params.year)),
+    "sales-by-product-line": (SalesReportParams, lambda repository, params: repository.sales_by_product_line(params.year)),
+    "orders-export": (OrdersExportParams, lambda repository, params: repository.orders_export(
+        params.status, params.customerNumber, params.dateFrom, params.dateTo
+    )),
+}
+
+def parse_fields(model, fields: Optional[str]) -> Optional[List[str]]:
+    """
+    ?fields=a,b -> column names with the primary key first, "*" -> every column,
+    nothing -> None (the endpoint's default view)
+    """
+    if not fields:
+        return None
+    columns = [column.key for column in model.__table__.columns]
+    if fields.strip() == "*":
+        return columns
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in columns]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown field(s): {', '.join(unknown)}")
+    keys = [column.key for column in model.__table__.primary_key]
+    return keys + [name for name in requested if name not in keys]
+
+def parse_sort(model, sort: Optional[str]) -> List[Any]:
+    """
+    ?sort=col or ?sort=-col (descending); the primary key breaks ties so pages are stable
+    """
+    keys = [getattr(model, column.key) for column in model.__table__.primary_key]
+    if not sort:
+        return keys
+    name = sort.lstrip("-")
+    if name not in model.__table__.c:
+        raise HTTPException(status_code=400, detail=f"Unknown sort field: {name}")
+    column = getattr(model, name)
+    return [column.desc() if sort.startswith("-") else column.asc()] + keys
+
+def date_range_criteria(column, date_from: Optional[date], date_to: Optional[date]) -> List[Any]:
+    """
+    Inclusive date range on a column; either end may be left open
+    """
+    if date_from is not None and date_to is not None and date_from > date_to:
+        raise HTTPException(status_code=400, detail=f"{column.key}: date_from is after date_to")
+    criteria = []
+    if date_from is not None:
+        criteria.append(column >= date_from)
+    if date_to is not None:
+        criteria.append(column <= date_to)
+    return criteria
+
+def check_bucket(bucket: str):
+    if bucket not in TIME_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Unknown bucket: {bucket} (use {', '.join(TIME_BUCKETS)})")
+
+def to_dict(db_item, fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    # Only selected (or loaded) columns, so deferred columns are never lazy-loaded here
+    unloaded = inspect(db_item).unloaded
+    columns = fields or [column.key for column in db_item.__table__.columns]
+    return {name: getattr(db_item, name) for name in columns if name not in unloaded}
 
 class BaseService:
     def __init__(self, db: Session, repository):
         self.db = db
         self.repository = repository
     
-    def get_all(self, skip: int = 0, limit: int = 100):
-        return self.repository.get_all(skip, limit)
+    def get_all(self, skip: int = 0, limit: int = 100, fields: Optional[str] = None):
+        selected = self._fields(fields)
+        return self._cached("all", (skip, limit, selected), lambda: [
+            to_dict(item, selected) for item in self.repository.get_all(skip, limit, selected)
+        ])
     
-    def get_paginated(self, page: int = 1, size: int = 10) -> Dict[str, Any]:
-        items, total, pages = self.repository.get_paginated(page, size)
-        return {
-            "items": items,
-            "total": total,
-            "page": page,
-            "size": size,
-            "pages": pages
-        }
+    def get_paginated(self, page: int = 1, size: int = 10, fields: Optional[str] = None) -> Dict[str, Any]:
+        selected = self._fields(fields)
+        return self._cached("paginated", (page, size, selected), lambda: self._page(
+            *self.repository.get_paginated(page, size, selected), page, size, selected
+        ))
     
-    def get_by_id(self, id_value):
-        db_item = self.repository.get_by_id(id_value)
+    def get_by_id(self, id_value, fields: Optional[str] = None):
+        selected = self._fields(fields)
+        if shared_cache.cached_table(self.repository.model.__tablename__):
+            row = self._shared_row(id_value)
+            if row is None:
+                raise HTTPException(status_code=404, detail="Item not found")
+            return row if selected is None else {name: row[name] for name in selected}
+        db_item = self.repository.get_by_id(id_value, selected)
         if db_item is None:
             raise HTTPException(status_code=404, detail="Item not found")
-        return db_item
+        return db_item if selected is None else to_dict(db_item, selected)
     
     def create(self, item_create):
         return self.repository.create(item_create.dict())
     
     def update(self, id_value, item_update):
-        db_item = self.repository.update(id_value, item_update.dict(exclude_unset=True))
-        if db_item is None:
-            raise HTTPException(status_code=404, detail="Item not found")
-        return db_item
+        return self._update(id_value, item_update.dict(exclude_unset=True), skip_none=True, not_found="Item not found")
+    
+    def patch(self, id_value, item_update):
+        # Unlike PUT, explicit nulls in a PATCH body clear the column
+        return self._update(id_value, item_update.dict(exclude_unset=True), skip_none=False, not_found="Item not found")
+    
+    def bulk_update(self, bulk_update) -> Dict[str, int]:
+        filters = bulk_update.filter.dict(exclude_none=True)
+        values = bulk_update.values.dict(exclude_unset=True, exclude_none=True)
+        if not filters:
+            raise HTTPException(status_code=400, detail="At least one filter is required")
+        if not values:
+            raise HTTPException(status_code=400, detail="Nothing to update")
+        return {"updated": self.repository.update_where(filters, values)}
     
     def delete(self, id_value) -> bool:
         success = self.repository.delete(id_value)
         if not success:
             raise HTTPException(status_code=404, detail="Item not found")
         return success
+    
+    def _update(self, id_value, data: Dict[str, Any], skip_none: bool, not_found: str):
+        try:
+            db_item = self.repository.update(id_value, data, skip_none=skip_none)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if db_item is None:
+            raise HTTPException(status_code=404, detail=not_found)
+        return db_item
+    
+    def _fields(self, fields: Optional[str]) -> Optional[List[str]]:
+        return parse_fields(self.repository.model, fields)
+    
+    def _page(self, items, total: int, pages: int, page: int, size: int, fields: Optional[List[str]]) -> Dict[str, Any]:
+        return {
+            "items": [to_dict(item, fields) for item in items],
+            "total": total,
+            "page": page,
+            "size": size,
+            "pages": pages
+        }
+    
+    def _shared_row(self, id_value) -> Optional[Dict[str, Any]]:
+        """
+        The whole row from the host's shared cache; on a miss read and shared for the other workers
+        """
+        table = self.repository.model.__tablename__
+        row = shared_cache.cache.get(table, id_value)
+        if row is None:
+            # Generation before the read: a write committing after it keeps put() from storing the row
+            generation = shared_cache.cache.generation(table)
+            db_item = self.repository.get_by_id(id_value)
+            if db_item is None:
+                return None
+            row = to_dict(db_item)
+            shared_cache.cache.put(table, id_value, row, generation)
+        return row
+    
+    def _cached(self, name: str, params: Tuple, compute, tables: Optional[List[Any]] = None):
+        """
+        Result of compute() from the result cache while the tables it reads (default:
+        the repository's) have not been written; parameters must be hashable
+        """
+        if not result_cache.RESULT_CACHE:
+            return compute()
+        params = tuple(tuple(value) if isinstance(value, list) else value for value in params)
+        models = tables or [self.repository.model]
+        return result_cache.cache.get_or_compute(
+            self.db, f"{self.repository.model.__tablename__}.{name}", params,
+            [model.__tablename__ for model in models], compute
+        )
 
 class CustomerService(BaseService):
     def __init__(self, db: Session):
@@ -61,116 +224,685 @@ class CustomerService(BaseService):
         if customer is None:
             raise HTTPException(status_code=404, detail="Customer not found")
         return customer
+    
+    def get_customer_orders(self, customer_number: int, fields: Optional[str] = None):
+        selected = parse_fields(Order, fields)
+        
+        def compute():
+            self.get_customer_with_orders(customer_number)
+            return [to_dict(order, selected) for order in OrderRepository(self.db).get_by_customer(customer_number, selected)]
+        return self._cached("orders", (customer_number, selected), compute, tables=[Customer, Order])
 
 class EmployeeService(BaseService):
     def __init__(self, db: Session):
         super().__init__(db, EmployeeRepository(db))
     
-    def get_employees_by_office(self, office_code: str):
-        return self.repository.get_by_office_code(office_code)
+    def get_employees_by_office(self, office_code: str, fields: Optional[str] = None):
+        selected = self._fields(fields)
+        return [to_dict(employee, selected) for employee in self.repository.get_by_office_code(office_code, selected)]
+
+class ReferenceDataService(BaseService):
+    """
+    For small reference tables: with REFERENCE_SNAPSHOT=true reads are served from the
+    in-memory snapshot and every write bumps the table version so all workers reload it.
+    """
+    def __init__(self, db: Session, repository, table: reference_snapshot.ReferenceTable):
+        super().__init__(db, repository)
+        self.table = table
+    
+    def get_all(self, skip: int = 0, limit: int = 100, fields: Optional[str] = None):
+        if not reference_snapshot.REFERENCE_SNAPSHOT:
+            return super().get_all(skip, limit, fields)
+        selected = self._fields(fields)
+        return [self._project(row, selected, list_view=True) for row in self.table.get_all(self.db, skip, limit)]
+    
+    def get_paginated(self, page: int = 1, size: int = 10, fields: Optional[str] = None) -> Dict[str, Any]:
+        if not reference_snapshot.REFERENCE_SNAPSHOT:
+            return super().get_paginated(page, size, fields)
+        selected = self._fields(fields)
+        result = self.table.get_paginated(self.db, page, size)
+        return {**result, "items": [self._project(row, selected, list_view=True) for row in result["items"]]}
+    
+    def get_by_id(self, id_value, fields: Optional[str] = None):
+        if not reference_snapshot.REFERENCE_SNAPSHOT:
+            return super().get_by_id(id_value, fields)
+        selected = self._fields(fields)
+        row = self.table.get_by_id(self.db, id_value)
+        if row is None:
+            raise HTTPException(status_code=404, detail="Item not found")
+        return self._project(row, selected)
+    
+    def create(self, item_create):
+        db_item = super().create(item_create)
+        self._written()
+        return db_item
+    
+    def delete(self, id_value) -> bool:
+        success = super().delete(id_value)
+        self._written()
+        return success
+    
+    def _update(self, id_value, data: Dict[str, Any], skip_none: bool, not_found: str):
+        db_item = super()._update(id_value, data, skip_none, not_found)
+        self._written()
+        return db_item
+    
+    def _written(self):
+        if reference_snapshot.REFERENCE_SNAPSHOT:
+            self.table.invalidate(self.db)
+    
+    def _project(self, row, fields: Optional[List[str]], list_view: bool = False):
+        # Same views as the database path: selected fields, or no heavy columns on lists
+        if fields:
+            return {name: row[name] for name in fields}
+        if list_view and self.table.heavy:
+            return {name: value for name, value in row.items() if name not in self.table.heavy}
+        return row
 
-class OfficeService(BaseService):
+class OfficeService(ReferenceDataService):
     def __init__(self, db: Session):
-        super().__init__(db, OfficeRepository(db))
+        super().__init__(db, OfficeRepository(db), reference_snapshot.offices)
 
 class OrderService(BaseService):
     def __init__(self, db: Session):
         super().__init__(db, OrderRepository(db))
     
-    def get_orders_by_customer(self, customer_number: int):
-        return self.repository.get_by_customer(customer_number)
+    def get_all(self, skip: int = 0, limit: int = 100, fields: Optional[str] = None, sort: Optional[str] = None,
+                min_total: Optional[float] = None, max_total: Optional[float] = None, customer_number: Optional[int] = None,
+                date_ranges: Optional[Dict[str, Tuple[Optional[date], Optional[date]]]] = None, late: Optional[bool] = None):
+        selected = self._fields(fields)
+        criteria, filters = self._list_criteria(min_total, max_total, customer_number, date_ranges, late)
+        order_by = parse_sort(Order, sort)
+        return self._cached("all", (skip, limit, selected, sort, filters), lambda: [
+            to_dict(order, selected)
+            for order in self.repository.get_all(skip, limit, selected, criteria=criteria, order_by=order_by)
+        ])
+    
+    def get_paginated(self, page: int = 1, size: int = 10, fields: Optional[str] = None, sort: Optional[str] = None,
+                      min_total: Optional[float] = None, max_total: Optional[float] = None, customer_number: Optional[int] = None,
+                      date_ranges: Optional[Dict[str, Tuple[Optional[date], Optional[date]]]] = None,
+                      late: Optional[bool] = None) -> Dict[str, Any]:
+        selected = self._fields(fields)
+        criteria, filters = self._list_criteria(min_total, max_total, customer_number, date_ranges, late)
+        order_by = parse_sort(Order, sort)
+        return self._cached("paginated", (page, size, selected, sort, filters), lambda: self._page(
+            *self.repository.get_paginated(page, size, selected, criteria=criteria, order_by=order_by),
+            page, size, selected
+        ))
+    
+    def get_timeseries(self, bucket: str = "month", field: str = "orderDate", date_from: Optional[date] = None,
+                       date_to: Optional[date] = None, customer_number: Optional[int] = None,
+                       status: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Order count, amount and items per day/week/month of one of the order dates, grouped in SQL
+        """
+        check_bucket(bucket)
+        if field not in ORDER_DATE_FIELDS:
+            raise HTTPException(status_code=400, detail=f"Unknown date field: {field} (use {', '.join(ORDER_DATE_FIELDS)})")
+        criteria = date_range_criteria(getattr(Order, field), date_from, date_to)
+        if customer_number is not None:
+            criteria.append(Order.customerNumber == customer_number)
+        if status is not None:
+            criteria.append(Order.status == status)
+        
+        def compute():
+            points = [dict(row) for row in self.repository.timeseries(bucket, field, criteria)]
+            return {"bucket": bucket, "field": field, "points": points}
+        return self._cached("timeseries", (bucket, field, date_from, date_to, customer_number, status), compute)
+    
+    def bulk_update(self, bulk_update) -> Dict[str, int]:
+        # A bulk status change cannot release or re-reserve stock line by line, so it may
+        # not move orders into or out of a cancelled status
+        filters = bulk_update.filter.dict(exclude_none=True)
+        status = bulk_update.values.status
+        if status is not None and (
+            status in CANCELLED_STATUSES or filters.get("status") in CANCELLED_STATUSES + (None,)
+        ):
+            raise HTTPException(
+                status_code=400,
+                detail="Bulk status updates need a non-cancelled status filter and cannot cancel orders"
+            )
+        previous = {}
+        if events.hub.active and filters:
+            criteria = [getattr(Order, name) == value for name, value in filters.items()]
+            previous = self.repository.get_statuses(criteria)
+        result = super().bulk_update(bulk_update)
+        if previous:
+            for order in self.repository.get_all(0, None, criteria=[Order.orderNumber.in_(list(previous))]):
+                events.hub.publish("order.updated", to_dict(order), previous[order.orderNumber])
+        return result
+    
+    def create(self, item_create):
+        order = super().create(item_create)
+        # to_dict reloads the committed row: only worth it for subscribers
+        if events.hub.active:
+            events.hub.publish("order.created", to_dict(order))
+        return order
+    
+    def delete(self, id_value) -> bool:
+        order = self.repository.get_by_id(id_value) if events.hub.active else None
+        # Serialized before the commit expires it
+        deleted = to_dict(order) if order is not None else None
+        success = super().delete(id_value)
+        if deleted is not None:
+            events.hub.publish("order.deleted", deleted)
+        return success
+    
+    def _update(self, id_value, data: Dict[str, Any], skip_none: bool, not_found: str):
+        previous_status = self.repository.get_status(id_value) if events.hub.active else None
+        try:
+            order = super()._update(id_value, data, skip_none, not_found)
+        except InsufficientStock as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        if events.hub.active:
+            events.hub.publish("order.updated", to_dict(order), previous_status)
+        return order
+    
+    def _list_criteria(self, min_total: Optional[float], max_total: Optional[float], customer_number: Optional[int],
+                       date_ranges: Optional[Dict[str, Tuple[Optional[date], Optional[date]]]],
+                       late: Optional[bool]) -> Tuple[List[Any], Tuple]:
+        """
+        Filter criteria of the order lists, and the filters as a hashable cache key
+        """
+        criteria = []
+        if min_total is not None:
+            criteria.append(Order.totalAmount >= min_total)
+        if max_total is not None:
+            criteria.append(Order.totalAmount <= max_total)
+        if customer_number is not None:
+            criteria.append(Order.customerNumber == customer_number)
+        ranges = tuple(sorted((name, bounds) for name, bounds in (date_ranges or {}).items() if bounds != (None, None)))
+        for name, (date_from, date_to) in ranges:
+            criteria.extend(date_range_criteria(getattr(Order, name), date_from, date_to))
+        today = date.today() if late is not None else None
+        if late is not None:
+            # Shipped after the required date, or still unshipped past it; cancelled orders are never late
+            overdue = and_(
+                or_(Order.shippedDate > Order.requiredDate, and_(Order.shippedDate.is_(None), Order.requiredDate < today)),
+                Order.status.notin_(CANCELLED_STATUSES),
+            )
+            criteria.append(overdue if late else not_(overdue))
+        return criteria, (min_total, max_total, customer_number, ranges, late, today)
+    
+    def get_orders_by_customer(self, customer_number: int, fields: Optional[str] = None):
+        selected = self._fields(fields)
+        return [to_dict(order, selected) for order in self.repository.get_by_customer(customer_number, selected)]
     
     def get_order_with_details(self, order_number: int):
         order = self.repository.get_orders_with_details(order_number)
         if order is None:
             raise HTTPException(status_code=404, detail="Order not found")
         return order
+    
+    def get_order_details(self, order_number: int, fields: Optional[str] = None):
+        selected = parse_fields(OrderDetail, fields)
+        
+        def compute():
+            self.get_order_with_details(order_number)
+            return [to_dict(detail, selected) for detail in OrderDetailRepository(self.db).get_by_order_number(order_number, selected)]
+        return self._cached("details", (order_number, selected), compute, tables=[Order, OrderDetail])
+    
+    def create_with_lines(self, order_create: OrderWithLinesCreate):
+        lines = order_create.lines
+        product_codes = [line.productCode for line in lines]
+        if len(set(product_codes)) != len(product_codes):
+            raise HTTPException(status_code=400, detail="Each product can only appear once per order")
+        
+        # Validate every product (and fetch default prices) in one query
+        msrp = ProductRepository(self.db).get_msrp_by_codes(product_codes)
+        missing = [code for code in product_codes if code not in msrp]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Product not found: {', '.join(missing)}")
+        
+        line_data = [
+            {
+                "productCode": line.productCode,
+                "quantityOrdered": line.quantityOrdered,
+                "priceEach": line.priceEach if line.priceEach is not None else msrp[line.productCode],
+                "orderLineNumber": line.orderLineNumber if line.orderLineNumber is not None else position,
+            }
+            for position, line in enumerate(lines, start=1)
+        ]
+        try:
+            order, details = self.repository.create_with_lines(order_create.dict(exclude={"lines"}), line_data)
+        except InsufficientStock as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        events.hub.publish("order.created", order)
+        if recommendations.RECOMMENDATIONS:
+            recommendations.recommender.add(product_codes, [])
+        return {**order, "orderDetails": details}
 
 class OrderDetailService:
     def __init__(self, db: Session):
         self.db = db
         self.repository = OrderDetailRepository(db)
     
-    def get_by_order_number(self, order_number: int):
-        return self.repository.get_by_order_number(order_number)
+    def get_by_order_number(self, order_number: int, fields: Optional[str] = None):
+        selected = parse_fields(OrderDetail, fields)
+        return [to_dict(detail, selected) for detail in self.repository.get_by_order_number(order_number, selected)]
     
-    def get_by_composite_key(self, order_number: int, product_code: str):
-        detail = self.repository.get_by_composite_key(order_number, product_code)
+    def get_by_composite_key(self, order_number: int, product_code: str, fields: Optional[str] = None):
+        selected = parse_fields(OrderDetail, fields)
+        detail = self.repository.get_by_composite_key(order_number, product_code, selected)
         if detail is None:
             raise HTTPException(status_code=404, detail="Order detail not found")
-        return detail
+        return detail if selected is None else to_dict(detail, selected)
     
     def create(self, detail_create: OrderDetailCreate):
-        return self.repository.create(detail_create.dict())
+        try:
+            detail = self.repository.create(detail_create.dict())
+        except InsufficientStock as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        if recommendations.RECOMMENDATIONS:
+            basket = [line.productCode for line in self.repository.get_by_order_number(detail_create.orderNumber, ["productCode"])]
+            recommendations.recommender.add([detail_create.productCode], basket)
+        return detail
     
     def update(self, order_number: int, product_code: str, detail_update: OrderDetailUpdate):
-        detail = self.repository.get_by_composite_key(order_number, product_code)
+        try:
+            detail = self.repository.update(
+                (order_number, product_code), detail_update.dict(exclude_unset=True), skip_none=False
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except InsufficientStock as e:
+            raise HTTPException(status_code=409, detail=str(e))
         if detail is None:
             raise HTTPException(status_code=404, detail="Order detail not found")
-        
-        update_data = detail_update.dict(exclude_unset=True)
-        for key, value in update_data.items():
-            setattr(detail, key, value)
-        
-        self.db.commit()
-        self.db.refresh(detail)
         return detail
     
     def delete(self, order_number: int, product_code: str) -> bool:
-        detail = self.repository.get_by_composite_key(order_number, product_code)
-        if detail is None:
+        if not self.repository.delete((order_number, product_code)):
             raise HTTPException(status_code=404, detail="Order detail not found")
-        
-        self.db.delete(detail)
-        self.db.commit()
         return True
+    
+    def replace_order_lines(self, order_number: int, replace: OrderLinesReplace):
+        lines = replace.lines
+        product_codes = [line.productCode for line in lines]
+        if len(set(product_codes)) != len(product_codes):
+            raise HTTPException(status_code=400, detail="Each product can only appear once per order")
+        
+        # Validate every product (and fetch the prices of new lines) in one query
+        msrp = ProductRepository(self.db).get_msrp_by_codes(product_codes) if product_codes else {}
+        missing = [code for code in product_codes if code not in msrp]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Product not found: {', '.join(missing)}")
+        
+        line_data = [
+            {
+                "productCode": line.productCode,
+                "quantityOrdered": line.quantityOrdered,
+                "priceEach": line.priceEach,
+                "orderLineNumber": line.orderLineNumber if line.orderLineNumber is not None else position,
+            }
+            for position, line in enumerate(lines, start=1)
+        ]
+        try:
+            result = self.repository.replace_order_lines(order_number, replace.version, line_data, msrp)
+        except (InsufficientStock, VersionConflict) as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        if result is None:
+            raise HTTPException(status_code=404, detail="Order not found")
+        if recommendations.RECOMMENDATIONS:
+            recommendations.recommender.add(result["inserted"], product_codes)
+        return result
 
 class ProductService(BaseService):
     def __init__(self, db: Session):
         super().__init__(db, ProductRepository(db))
     
-    def get_products_by_product_line(self, product_line: str):
-        return self.repository.get_by_product_line(product_line)
+    # The pricing version is bumped by the commit of the write itself
+    def create(self, item_create):
+        pricing.data.mark_written(self.db)
+        return super().create(item_create)
+    
+    def bulk_update(self, bulk_update) -> Dict[str, int]:
+        pricing.data.mark_written(self.db)
+        return super().bulk_update(bulk_update)
+    
+    def delete(self, id_value) -> bool:
+        pricing.data.mark_written(self.db)
+        return super().delete(id_value)
+    
+    def _update(self, id_value, data: Dict[str, Any], skip_none: bool, not_found: str):
+        pricing.data.mark_written(self.db)
+        return super()._update(id_value, data, skip_none, not_found)
+    
+    def get_products_by_product_line(self, product_line: str, fields: Optional[str] = None):
+        selected = self._fields(fields)
+        return [to_dict(product, selected) for product in self.repository.get_by_product_line(product_line, selected)]
+    
+    def adjust_stock(self, product_code: str, delta: int) -> Dict[str, Any]:
+        pricing.data.mark_written(self.db)
+        quantity = self.repository.adjust_stock(product_code, delta)
+        if quantity is None:
+            if self.repository.get_by_id(product_code, ["productCode"]) is None:
+                raise HTTPException(status_code=404, detail="Product not found")
+            raise HTTPException(status_code=409, detail=f"Insufficient stock for product {product_code}")
+        return {"productCode": product_code, "quantityInStock": quantity}
+    
+    def get_recommendations(self, product_code: str, limit: int = recommendations.DEFAULT_LIMIT) -> Dict[str, Any]:
+        """
+        Products most often bought in the same order as this one, from the in-memory
+        co-purchase matrix (RECOMMENDATIONS) or, without it or until it is built, counted in SQL
+        """
+        if not 1 <= limit <= recommendations.MAX_LIMIT:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {recommendations.MAX_LIMIT}")
+        result = None
+        if recommendations.RECOMMENDATIONS:
+            if recommendations.recommender.stale():
+                recommendations.rebuild_in_background()
+            result = recommendations.recommender.recommend(product_code, limit)
+        if result is None:
+            row = self._cached("co_purchases", (product_code,), lambda: OrderDetailRepository(self.db).co_purchases(product_code),
+                               tables=[OrderDetail])
+            result = recommendations.rank(product_code, row, limit)
+        orders, together = result
+        if not orders and not together and self.repository.get_by_id(product_code, ["productCode"]) is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return {"productCode": product_code, "orders": orders, "recommendations": together}
 
-class ProductLineService(BaseService):
+class ProductLineService(ReferenceDataService):
     def __init__(self, db: Session):
-        super().__init__(db, ProductLineRepository(db))
+        super().__init__(db, ProductLineRepository(db), reference_snapshot.product_lines)
 
-class PaymentService:
+class PaymentService(BaseService):
     def __init__(self, db: Session):
-        self.db = db
-        self.repository = PaymentRepository(db)
+        super().__init__(db, PaymentRepository(db))
+    
+    def get_all(self, skip: int = 0, limit: int = 100, fields: Optional[str] = None, sort: Optional[str] = None,
+                customer_number: Optional[int] = None, date_from: Optional[date] = None, date_to: Optional[date] = None):
+        selected = self._fields(fields)
+        criteria = self._criteria(customer_number, date_from, date_to)
+        order_by = parse_sort(Payment, sort)
+        return self._cached("all", (skip, limit, selected, sort, customer_number, date_from, date_to), lambda: [
+            to_dict(payment, selected)
+            for payment in self.repository.get_all(skip, limit, selected, criteria=criteria, order_by=order_by)
+        ])
+    
+    def get_timeseries(self, bucket: str = "month", date_from: Optional[date] = None, date_to: Optional[date] = None,
+                       customer_number: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Payment count and amount per day/week/month of paymentDate, grouped in SQL
+        """
+        check_bucket(bucket)
+        criteria = self._criteria(customer_number, date_from, date_to)
+        
+        def compute():
+            points = [dict(row) for row in self.repository.timeseries(bucket, criteria)]
+            return {"bucket": bucket, "field": "paymentDate", "points": points}
+        return self._cached("timeseries", (bucket, date_from, date_to, customer_number), compute)
     
-    def get_by_customer_number(self, customer_number: int):
-        return self.repository.get_by_customer_number(customer_number)
+    def get_by_customer_number(self, customer_number: int, fields: Optional[str] = None):
+        selected = parse_fields(Payment, fields)
+        return [to_dict(payment, selected) for payment in self.repository.get_by_customer_number(customer_number, selected)]
     
-    def get_by_composite_key(self, customer_number: int, check_number: str):
-        payment = self.repository.get_by_composite_key(customer_number, check_number)
+    def get_by_composite_key(self, customer_number: int, check_number: str, fields: Optional[str] = None):
+        selected = parse_fields(Payment, fields)
+        payment = self.repository.get_by_composite_key(customer_number, check_number, selected)
         if payment is None:
             raise HTTPException(status_code=404, detail="Payment not found")
-        return payment
+        return payment if selected is None else to_dict(payment, selected)
     
     def create(self, payment_create: PaymentCreate):
         return self.repository.create(payment_create.dict())
     
     def update(self, customer_number: int, check_number: str, payment_update: PaymentUpdate):
-        payment = self.repository.get_by_composite_key(customer_number, check_number)
+        try:
+            payment = self.repository.update(
+                (customer_number, check_number), payment_update.dict(exclude_unset=True), skip_none=False
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         if payment is None:
             raise HTTPException(status_code=404, detail="Payment not found")
-        
-        update_data = payment_update.dict(exclude_unset=True)
-        for key, value in update_data.items():
-            setattr(payment, key, value)
-        
-        self.db.commit()
-        self.db.refresh(payment)
         return payment
     
     def delete(self, customer_number: int, check_number: str) -> bool:
-        payment = self.repository.get_by_composite_key(customer_number, check_number)
-        if payment is None:
+        if not self.repository.delete((customer_number, check_number)):
             raise HTTPException(status_code=404, detail="Payment not found")
+        return True
+    
+    def _criteria(self, customer_number: Optional[int], date_from: Optional[date], date_to: Optional[date]) -> List[Any]:
+        criteria = date_range_criteria(Payment.paymentDate, date_from, date_to)
+        if customer_number is not None:
+            criteria.append(Payment.customerNumber == customer_number)
+        return criteria
+
+class PricingAnalyticsService:
+    """
+    Margin, stock value and realized price distributions over the worker's columnar
+    copy of the catalog and order lines (analytics/pricing.py)
+    """
+    MAX_BINS = 1000
+    MAX_OUTLIERS = 1000
+    
+    def __init__(self, db: Session):
+        self.db = db
+    
+    def get_distribution(self, metric: str, group_by: Optional[str] = None, percentiles: Optional[str] = None) -> Dict[str, Any]:
+        points = self._percentiles(percentiles)
+        _, grouped = self._grouped(metric, group_by)
+        return {"metric": metric, "groupBy": group_by, "groups": pricing.describe(grouped, points)}
+    
+    def get_histogram(self, metric: str, group_by: Optional[str] = None, group: Optional[str] = None, bins: int = 20,
+                      min_value: Optional[float] = None, max_value: Optional[float] = None) -> Dict[str, Any]:
+        if not 1 <= bins <= self.MAX_BINS:
+            raise HTTPException(status_code=400, detail=f"bins must be between 1 and {self.MAX_BINS}")
+        if group is not None and group_by is None:
+            raise HTTPException(status_code=400, detail="group needs group_by")
+        if min_value is not None and max_value is not None and min_value >= max_value:
+            raise HTTPException(status_code=400, detail="min_value must be below max_value")
+        if group_by is not None and group_by not in pricing.GROUP_COLUMNS:
+            raise HTTPException(status_code=400, detail=f"Unknown group_by: {group_by} (use {', '.join(pricing.GROUP_COLUMNS)})")
+        # Without a group the whole metric, sorted as one group
+        _, grouped = self._grouped(metric, group_by if group is not None else None)
+        values = grouped.values if group is None else grouped.segment(group)
+        if values is None:
+            raise HTTPException(status_code=404, detail=f"No {group_by} {group}")
+        value_range = None
+        if (min_value is not None or max_value is not None) and len(values):
+            value_range = (min_value if min_value is not None else float(values[0]),
+                           max_value if max_value is not None else float(values[-1]))
+            if value_range[0] >= value_range[1]:
+                raise HTTPException(status_code=400, detail="min_value must be below max_value")
+        return {"metric": metric, "groupBy": group_by, "group": group, **pricing.histogram(values, bins, value_range)}
+    
+    def get_outliers(self, metric: str, group_by: Optional[str] = None, k: float = 1.5, limit: int = 100) -> Dict[str, Any]:
+        if k < 0:
+            raise HTTPException(status_code=400, detail="k must not be negative")
+        if not 1 <= limit <= self.MAX_OUTLIERS:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {self.MAX_OUTLIERS}")
+        columns, grouped = self._grouped(metric, group_by)
+        total, found = pricing.outliers(grouped, k, limit)
+        items = []
+        for row, group, value, lower, upper in found:
+            item = {"group": group, "value": round(value, 4), "lower": round(lower, 4), "upper": round(upper, 4)}
+            if metric in pricing.LINE_METRICS:
+                item["productCode"] = str(columns.products["code"][columns.lines["product"][row]])
+                item["orderNumber"] = int(columns.lines["orderNumber"][row])
+            else:
+                item["productCode"] = str(columns.products["code"][row])
+            items.append(item)
+        return {"metric": metric, "groupBy": group_by, "k": k, "total": total, "outliers": items}
+    
+    def _grouped(self, metric: str, group_by: Optional[str]) -> Tuple[pricing.PricingColumns, pricing.Grouped]:
+        if metric not in pricing.METRICS:
+            raise HTTPException(status_code=400, detail=f"Unknown metric: {metric} (use {', '.join(pricing.METRICS)})")
+        if group_by is not None and group_by not in pricing.GROUP_COLUMNS:
+            raise HTTPException(status_code=400, detail=f"Unknown group_by: {group_by} (use {', '.join(pricing.GROUP_COLUMNS)})")
+        columns = pricing.data.columns(self.db)
+        return columns, columns.grouped(metric, group_by)
+    
+    def _percentiles(self, percentiles: Optional[str]) -> Tuple[float, ...]:
+        if not percentiles:
+            return pricing.DEFAULT_PERCENTILES
+        try:
+            points = tuple(float(value) for value in percentiles.split(",") if value.strip())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="percentiles must be numbers, e.g. 5,50,95")
+        if not points or any(not 0 <= point <= 100 for point in points):
+            raise HTTPException(status_code=400, detail="percentiles must be between 0 and 100")
+        return points
+
+class ChangeFeedService:
+    def __init__(self, db: Session):
+        self.db = db
+        self.repository = ChangeLogRepository(db)
+    
+    def get_changes(self, since: Optional[int] = None, tables: Optional[str] = None, limit: int = 500) -> Dict[str, Any]:
+        """
+        Changes after the `since` cursor in id order, at most one entry per row (its latest
+        change in the page) with the row's current data. Without `since`, returns just the
+        current cursor: take it before a full download, then poll from it.
+        """
+        if not 1 <= limit <= CHANGE_FEED_MAX_LIMIT:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {CHANGE_FEED_MAX_LIMIT}")
+        table_names = [name.strip() for name in tables.split(",") if name.strip()] if tables else None
+        unknown = [name for name in table_names or [] if name not in FEED_TABLES]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown table(s): {', '.join(unknown)}")
+        if since is None:
+            return {"changes": [], "next": self.repository.head(), "has_more": False}
         
-        self.db.delete(payment)
-        self.db.commit()
-        return True
\ No newline at end of file
+        oldest = self.repository.oldest()
+        if oldest is not None and since < oldest - 1:
+            raise HTTPException(status_code=410, detail="Cursor is older than the retained changes, do a full download")
+        
+        changes = self.repository.get_changes(since, table_names, limit + 1)
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        settled_before = datetime.utcnow() - timedelta(seconds=CHANGE_FEED_SETTLE_SECONDS)
+        for position, change in enumerate(changes):
+            if change.changedAt > settled_before:
+                changes, has_more = changes[:position], False
+                break
+        next_cursor = changes[-1].id if changes else since
+        
+        latest: Dict[Tuple[str, str], Any] = {}
+        for change in changes:
+            latest.pop((change.tableName, change.rowKey), None)
+            latest[(change.tableName, change.rowKey)] = change
+        rows: Dict[str, Dict[str, Any]] = {}
+        for table_name in {table_name for table_name, _ in latest}:
+            keys = [row_key for name, row_key in latest if name == table_name]
+            rows[table_name] = self.repository.get_rows(FEED_TABLES[table_name], keys)
+        
+        entries = [
+            {
+                "id": change.id,
+                "table": change.tableName,
+                "operation": change.operation,
+                "key": decode_row_key(FEED_TABLES[change.tableName], change.rowKey),
+                "data": None if change.operation == "delete" else rows[change.tableName].get(change.rowKey),
+                "changedAt": change.changedAt,
+            }
+            for change in latest.values()
+        ]
+        return {"changes": entries, "next": next_cursor, "has_more": has_more}
+
+class JobService:
+    def get_reports(self) -> Dict[str, Any]:
+        return {name: params_model.schema()["properties"] for name, (params_model, _) in REPORTS.items()}
+    
+    def submit(self, report: str, params: Dict[str, Any], owner: str) -> Tuple[Dict[str, Any], bool]:
+        """
+        Queues a report job; an identical job that is still queued, running or has a
+        result on disk is returned instead (second value False)
+        """
+        if report not in REPORTS:
+            raise HTTPException(status_code=404, detail=f"Unknown report: {report}")
+        params_model, run = REPORTS[report]
+        try:
+            parsed = params_model(**params)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=jsonable_encoder(e.errors()))
+        try:
+            job, created = jobs.manager.submit(
+                report, jsonable_encoder(parsed), lambda db: run(ReportRepository(db), parsed), owner
+            )
+        except jobs.JobQueueFull:
+            raise HTTPException(status_code=503, detail="Too many report jobs queued, retry later", headers={"Retry-After": "30"})
+        return self._response(job), created
+    
+    def get(self, job_id: str, principal: User) -> Dict[str, Any]:
+        return self._response(self._get_job(job_id, principal))
+    
+    def get_result(self, job_id: str, principal: User) -> Tuple[str, str]:
+        job = self._get_job(job_id, principal)
+        if job.status != jobs.SUCCEEDED:
+            raise HTTPException(status_code=409, detail=f"Job is {job.status}, no result to download")
+        path = jobs.manager.result_path(job)
+        if not os.path.exists(path):
+            raise HTTPException(status_code=410, detail="Result expired, submit the report again")
+        return path, f"{job.report}-{job.id}.csv"
+    
+    def cancel(self, job_id: str, principal: User) -> Dict[str, Any]:
+        self._get_job(job_id, principal)
+        try:
+            job = jobs.manager.cancel(job_id)
+        except jobs.JobNotLocal:
+            raise HTTPException(status_code=409, detail="Job runs in another worker process, retry or wait for it")
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return self._response(job)
+    
+    def _get_job(self, job_id: str, principal: User):
+        """
+        Jobs of other users are reported as not found, except to admins
+        """
+        job = jobs.manager.get(job_id)
+        if job is None or (job.owner != principal.username and not principal.is_admin):
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+    
+    def _response(self, job) -> Dict[str, Any]:
+        timestamp = lambda value: datetime.utcfromtimestamp(value) if value is not None else None
+        return {
+            "id": job.id,
+            "report": job.report,
+            "params": job.params,
+            "status": job.status,
+            "rows": job.rows,
+            "total": job.total,
+            "progress": job.progress,
+            "error": job.error,
+            "createdAt": timestamp(job.created_at),
+            "startedAt": timestamp(job.started_at),
+            "finishedAt": timestamp(job.finished_at),
+            "expiresAt": timestamp(job.expires_at),
+            "resultUrl": f"/api/v1/jobs/{job.id}/result" if job.status == jobs.SUCCEEDED else None,
+        }
+
+class ImportService:
+    def run(self, files: List[Tuple[str, BinaryIO]], table: Optional[str], drop_indexes: bool, restart: bool) -> Dict[str, Any]:
+        """
+        Imports uploaded SQL dumps and CSV files; uploading the same files again after an
+        interrupted import resumes it
+        """
+        size = 0
+        for _, stream in files:
+            size += stream.seek(0, os.SEEK_END)
+            stream.seek(0)
+        if size > IMPORT_MAX_UPLOAD_MB * 1024 * 1024:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Uploads above {IMPORT_MAX_UPLOAD_MB:g} MB are imported with python -m scripts.import_data",
+            )
+        if not IMPORT_LOCK.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail="Another import is running")
+        try:
+            sources = [importer.Source(name, stream, table) for name, stream in files]
+            import_id = importer.import_id(sources)
+            results = importer.Importer(engine, drop_indexes=drop_indexes).run(sources, import_id, restart=restart)
+        except importer.InvalidImportFile as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except importer.ImportConflict as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        finally:
+            IMPORT_LOCK.release()
+        return {
+            "importId": import_id,
+            "tables": [result.to_dict() for result in results],
+            "rows": sum(result.rows for result in results),
+        }